@@ -0,0 +1,204 @@
+"""
+Validate the storage formats of the embeddings: for each format, measure the
+stored size, the save and load time, and the iou drift of the masks decoded
+from the stored embedding against the masks decoded from the float32
+embedding, with the same random prompts.
+
+The embeddings are read from a project created in float32, or generated at
+random if no project is given. Random embeddings are not representative of
+real images, so validate on a project before changing the default format.
+
+Usage:
+    python -m benchmark.embedding_format --project project.sat --num-images 20
+"""
+import argparse
+import time
+from io import BytesIO
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pycocotools.mask as mask_util
+
+from server.mask.maskCreator import MaskCreator
+from server.mask.prompt import Prompt
+from server.project.projectArchive import ProjectArchive
+from server.sessionConfig import SessionConfig
+from server.util.embedding import (
+    EMBEDDING_FORMATS,
+    FLOAT32,
+    decode_embedding,
+    encode_embedding,
+    get_embedding_format,
+)
+from server.util.general import get_model_paths
+
+
+def load_project_embeddings(
+    project_path: str, num_images: int
+) -> List[Tuple[np.ndarray, List[int]]]:
+    """
+    Returns:
+        (float32 embedding, image size) of the first images of the project
+    """
+    archive = ProjectArchive(project_path)
+    embeddings = []
+    for filename in archive.list_folder(ProjectArchive.EMBEDDING_FOLDER)[:num_images]:
+        embedding = archive.load_numpy(
+            ProjectArchive.join(ProjectArchive.EMBEDDING_FOLDER, filename)
+        )
+        if get_embedding_format(embedding) != FLOAT32:
+            print(
+                f"Warning: {filename} is stored in {get_embedding_format(embedding)}, "
+                "the drift is measured against its upcast values"
+            )
+        annotation = archive.read_json(
+            ProjectArchive.join(
+                ProjectArchive.ANNOTATION_FOLDER, filename[: -len(".npy")] + ".json"
+            )
+        )
+        image = annotation["images"][0]
+        embeddings.append(
+            (decode_embedding(embedding), [image["height"], image["width"]])
+        )
+    archive.close()
+    return embeddings
+
+
+def generate_prompt_sets(
+    image_size: List[int], num_prompt_sets: int, rng: np.random.Generator
+) -> List[List[Prompt]]:
+    """
+    Random prompt sets of 1 to 3 points, the first one positive
+    """
+    height, width = image_size
+    prompt_sets = []
+    for _ in range(num_prompt_sets):
+        prompts = []
+        for idx in range(int(rng.integers(1, 4))):
+            label = Prompt.POSITIVE if idx == 0 else int(rng.integers(0, 2))
+            prompts.append(
+                Prompt(
+                    {
+                        "imageX": float(rng.uniform(0, width)),
+                        "imageY": float(rng.uniform(0, height)),
+                        "label": label,
+                    }
+                )
+            )
+        prompt_sets.append(prompts)
+    return prompt_sets
+
+
+def create_masks(
+    mask_creator: MaskCreator,
+    embedding: np.ndarray,
+    image_size: List[int],
+    prompt_sets: List[List[Prompt]],
+) -> List[Dict]:
+    """
+    Create the rle mask of each prompt set, adding the prompts one by one
+    as the annotators do
+    """
+    masks = []
+    for prompts in prompt_sets:
+        mask_creator.set_image(embedding, image_size)
+        for count in range(1, len(prompts) + 1):
+            annotation = mask_creator.create_mask(prompts[:count])
+        masks.append(annotation["segmentation"])
+    return masks
+
+
+def measure_io(embedding: np.ndarray, repeats: int) -> Tuple[int, float, float]:
+    """
+    Returns:
+        (stored size in bytes, save time in seconds, load time in seconds)
+    """
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        f = BytesIO()
+        np.save(f, embedding)
+    save_time = (time.perf_counter() - start_time) / repeats
+    data = f.getvalue()
+
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        decode_embedding(np.load(BytesIO(data)))
+    load_time = (time.perf_counter() - start_time) / repeats
+    return len(data), save_time, load_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--project", type=str, default=None)
+    parser.add_argument("--model-type", type=str, default="vit_b")
+    parser.add_argument("--decoder-model", type=str, default=None)
+    parser.add_argument("--num-images", type=int, default=10)
+    parser.add_argument("--prompts-per-image", type=int, default=20)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.project is not None:
+        embeddings = load_project_embeddings(args.project, args.num_images)
+    else:
+        embeddings = [
+            (
+                rng.standard_normal((1, 256, 64, 64)).astype(np.float32),
+                [args.height, args.width],
+            )
+            for _ in range(args.num_images)
+        ]
+
+    decoder_model_path = args.decoder_model
+    if decoder_model_path is None:
+        _, decoder_model_path = get_model_paths(args.model_type)
+    mask_creator = MaskCreator(
+        decoder_model_path, load_async=False, session_config=SessionConfig()
+    )
+
+    prompt_sets = [
+        generate_prompt_sets(image_size, args.prompts_per_image, rng)
+        for _, image_size in embeddings
+    ]
+    reference_masks = [
+        create_masks(mask_creator, embedding, image_size, image_prompt_sets)
+        for (embedding, image_size), image_prompt_sets in zip(embeddings, prompt_sets)
+    ]
+
+    print(
+        f"{'format':<10}{'size (MB)':>12}{'save (ms)':>12}{'load (ms)':>12}"
+        f"{'max error':>12}{'mean iou':>12}{'min iou':>12}{'iou < 0.99':>12}"
+    )
+    for embedding_format in EMBEDDING_FORMATS:
+        ious = []
+        max_error = 0.0
+        for (embedding, image_size), image_prompt_sets, image_reference_masks in zip(
+            embeddings, prompt_sets, reference_masks
+        ):
+            stored = encode_embedding(embedding, embedding_format)
+            max_error = max(
+                max_error, float(np.abs(decode_embedding(stored) - embedding).max())
+            )
+            masks = create_masks(mask_creator, stored, image_size, image_prompt_sets)
+            for mask, reference_mask in zip(masks, image_reference_masks):
+                if mask_util.area(mask) == 0 and mask_util.area(reference_mask) == 0:
+                    ious.append(1.0)
+                else:
+                    ious.append(float(mask_util.iou([mask], [reference_mask], [0])[0, 0]))
+
+        size, save_time, load_time = measure_io(
+            encode_embedding(embeddings[0][0], embedding_format), args.repeats
+        )
+        ious = np.array(ious)
+        print(
+            f"{embedding_format:<10}{size / 1024 / 1024:>12.2f}{save_time * 1000:>12.2f}"
+            f"{load_time * 1000:>12.2f}{max_error:>12.2e}{ious.mean():>12.4f}"
+            f"{ious.min():>12.4f}{np.mean(ious < 0.99):>12.2%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark the startup import time of the server modules, and check that the
+runtime path does not import torch. Each import is measured in a fresh
+interpreter, and torch is measured the same way to show the saving of not
+importing it.
+
+Usage:
+    python -m benchmark.import_time --repeats 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+from typing import Dict, List
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules imported before "Server initialized ..." by main.py and cli.py
+RUNTIME_MODULES = [
+    "server.server",
+    "server.embedding",
+    "server.mask.maskCreator",
+    "server.project",
+]
+
+TORCH_MODULES = ["torch", "torchvision", "segment_anything"]
+
+MEASURE_SCRIPT = """
+import sys, time
+start_time = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start_time
+torch_modules = {torch_modules!r}
+loaded = [m for m in torch_modules if m in sys.modules]
+print(elapsed)
+print(",".join(loaded))
+"""
+
+
+def measure_import(module: str, repeats: int) -> Dict:
+    """
+    Import the module in fresh interpreters
+
+    Returns:
+        {
+            "times": List[float],  # Import time of each run in seconds, empty if the import fails
+            "torch_modules": List[str],  # torch related modules imported by the module
+            "error": str,
+        }
+    """
+    times: List[float] = []
+    torch_modules: List[str] = []
+    script = MEASURE_SCRIPT.format(module=module, torch_modules=TORCH_MODULES)
+    for _ in range(repeats):
+        result = subprocess.run(
+            [sys.executable, "-c", script], capture_output=True, text=True, cwd=REPO_DIR
+        )
+        if result.returncode != 0:
+            error = result.stderr.strip().splitlines()
+            return {
+                "times": [],
+                "torch_modules": [],
+                "error": error[-1] if error else "",
+            }
+        elapsed, loaded = result.stdout.split("\n")[:2]
+        times.append(float(elapsed))
+        torch_modules = [m for m in loaded.split(",") if m]
+    return {"times": times, "torch_modules": torch_modules, "error": ""}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'module':<28}{'median (s)':>12}{'min (s)':>10}  torch modules")
+    for module in RUNTIME_MODULES + TORCH_MODULES:
+        result = measure_import(module, args.repeats)
+        if result["error"]:
+            print(f"{module:<28}{'-':>12}{'-':>10}  failed: {result['error']}")
+            continue
+        median_time = statistics.median(result["times"])
+        min_time = min(result["times"])
+        loaded = ",".join(result["torch_modules"]) if module in RUNTIME_MODULES else ""
+        print(f"{module:<28}{median_time:>12.3f}{min_time:>10.3f}  {loaded}")
+
+        if module in RUNTIME_MODULES and result["torch_modules"]:
+            print(f"  {module} imports {loaded} on the runtime path")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Benchmark the encoder preprocessing, comparing the float32 preprocessing into
+a reused buffer against the previous float64 implementation, which is kept
+here as the baseline.
+
+Usage:
+    python -m benchmark.preprocess --height 3000 --width 4000 --batch-size 4
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+from server.util.onnx import (
+    create_input_buffer,
+    determine_sam_input_shape,
+    preprocess_image,
+    preprocess_images,
+    resize_image,
+)
+
+
+def preprocess_image_float64(image: Image) -> np.ndarray:
+    """
+    The previous implementation, normalizing in float64 and padding with np.pad
+    """
+    resized_width, resized_height = determine_sam_input_shape(image)
+    image = image.resize((resized_width, resized_height), Image.Resampling.BILINEAR)
+    input_tensor = np.array(image)
+
+    mean = np.array([123.675, 116.28, 103.53])
+    std = np.array([[58.395, 57.12, 57.375]])
+
+    input_tensor = (input_tensor - mean) / std
+    input_tensor = input_tensor.transpose(2, 0, 1)[None, :, :, :].astype(np.float32)
+
+    if resized_height < resized_width:
+        input_tensor = np.pad(
+            input_tensor, ((0, 0), (0, 0), (0, 1024 - resized_height), (0, 0))
+        )
+    else:
+        input_tensor = np.pad(
+            input_tensor, ((0, 0), (0, 0), (0, 0), (0, 1024 - resized_width))
+        )
+    return input_tensor
+
+
+def measure(func, repeats: int):
+    """
+    Returns:
+        (mean time in seconds, peak traced memory in bytes)
+    """
+    func()
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        func()
+    elapsed = (time.perf_counter() - start_time) / repeats
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    images = [
+        Image.fromarray(
+            rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+        )
+        for _ in range(args.batch_size)
+    ]
+
+    # Both implementations must produce the same input
+    max_diff = max(
+        float(np.abs(preprocess_image_float64(image) - preprocess_image(image)).max())
+        for image in images
+    )
+    print(f"Max difference: {max_diff:.2e}")
+
+    buffer = create_input_buffer(1)
+    batch_buffer = create_input_buffer(args.batch_size)
+    resized_images = [resize_image(image) for image in images]
+
+    results = [
+        (
+            "float64 (per image)",
+            measure(lambda: preprocess_image_float64(images[0]), args.repeats),
+        ),
+        (
+            "float32 buffer (per image)",
+            measure(lambda: preprocess_image(images[0], buffer), args.repeats),
+        ),
+        (
+            "float64 + concatenate (batch)",
+            measure(
+                lambda: np.concatenate(
+                    [preprocess_image_float64(image) for image in images]
+                ),
+                args.repeats,
+            ),
+        ),
+        (
+            "float32 buffer (batch)",
+            measure(
+                lambda: preprocess_images(
+                    [resize_image(image) for image in images], batch_buffer
+                ),
+                args.repeats,
+            ),
+        ),
+        (
+            "normalize only (batch)",
+            measure(
+                lambda: preprocess_images(resized_images, batch_buffer), args.repeats
+            ),
+        ),
+    ]
+
+    print(f"{'method':<32}{'time (ms)':>12}{'peak (MB)':>12}")
+    for name, (elapsed, peak) in results:
+        print(f"{name:<32}{elapsed * 1000:>12.1f}{peak / 1024 / 1024:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
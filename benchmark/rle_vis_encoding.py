@@ -0,0 +1,77 @@
+"""
+Benchmark the conversion of COCO rle masks into the run length encoding
+used by the front end, comparing the direct conversion against decoding
+the full mask.
+
+Usage:
+    python -m benchmark.rle_vis_encoding --height 4000 --width 6000
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from server.util.coco import (
+    numpy_mask_to_rle_mask,
+    rle_mask_to_rle_vis_encoding,
+    rle_mask_to_rle_vis_encoding_dense,
+)
+
+
+def generate_masks(height: int, width: int, num_masks: int, seed: int):
+    """
+    Generate coral-like masks: filled ellipses of random size and position
+    """
+    rng = np.random.default_rng(seed)
+    masks = []
+    for _ in range(num_masks):
+        mask = np.zeros((height, width), dtype=np.uint8)
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        axes = (
+            int(rng.integers(10, max(11, width // 4))),
+            int(rng.integers(10, max(11, height // 4))),
+        )
+        angle = float(rng.uniform(0, 180))
+        cv2.ellipse(mask, center, axes, angle, 0, 360, 1, -1)
+        masks.append(numpy_mask_to_rle_mask(mask))
+    return masks
+
+
+def benchmark(func, masks, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for mask in masks:
+            func(mask)
+        best = min(best, time.perf_counter() - start_time)
+    return best / len(masks)
+
+
+def main(args):
+    masks = generate_masks(args.height, args.width, args.num_masks, args.seed)
+
+    for mask in masks:
+        assert rle_mask_to_rle_vis_encoding(mask) == rle_mask_to_rle_vis_encoding_dense(
+            mask
+        ), "Direct conversion does not match the dense conversion"
+
+    dense_time = benchmark(rle_mask_to_rle_vis_encoding_dense, masks, args.repeat)
+    direct_time = benchmark(rle_mask_to_rle_vis_encoding, masks, args.repeat)
+
+    print(f"Image size: {args.height} x {args.width}, masks: {args.num_masks}")
+    print(f"Dense conversion:  {dense_time * 1000:.2f} ms per mask")
+    print(f"Direct conversion: {direct_time * 1000:.2f} ms per mask")
+    print(f"Speedup: {dense_time / direct_time:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the rle visualization encoding.")
+    parser.add_argument("--height", type=int, default=4000)
+    parser.add_argument("--width", type=int, default=6000)
+    parser.add_argument("--num-masks", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+    main(args)
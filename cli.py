@@ -0,0 +1,466 @@
+"""
+Command line entry point to create, export and analyse projects without the GUI.
+
+Examples:
+    python cli.py create <image folder> <output.sat> --workers 8 --batch-size 4
+    python cli.py propose <project.sat> --workers 4 --points-per-side 32
+    python cli.py export <project.sat> <output folder> --coco --images --annotated-images
+    python cli.py stats <project.sat> <output folder>
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+from typing import Dict, List
+
+from server.annotationRenderer import AnnotationRenderer
+from server.embedding import EmbeddingGenerator
+from server.embeddingCache import EmbeddingCache
+from server.mask.maskProposer import MaskProposer
+from server.project import (
+    ProjectCreator,
+    ProjectLoader,
+    ProjectExportor,
+    ProjectProposer,
+    ProjectSaver,
+    ProjectJournal,
+)
+from server.sessionConfig import SessionConfig
+from server.util.embedding import EMBEDDING_FORMATS
+from server.util.general import get_model_paths
+from server.util.requests import ProjectCreateRequest
+
+IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"]
+
+
+def setup_logging(verbose: bool):
+    # Progress is printed on stdout, so the logs go to stderr
+    log_format = "[%(levelname)s][%(asctime)s][%(name)s] %(message)s"
+    date_format = "%Y-%m-%d|%H:%M:%S"
+    logging.basicConfig(
+        level=logging.DEBUG if verbose else logging.WARNING,
+        format=log_format,
+        datefmt=date_format,
+        stream=sys.stderr,
+    )
+
+
+class ProgressPrinter:
+    """
+    Print the progress of a task on stdout, one line per update
+    """
+
+    def __init__(self, task: str):
+        self.task = task
+        self.start_time = time.time()
+
+    def __call__(self, count: int, total: int):
+        elapsed = time.time() - self.start_time
+        rate = count / elapsed if elapsed > 0 else 0.0
+        percentage = count / total * 100 if total > 0 else 100.0
+        print(
+            f"[{self.task}] {count}/{total} ({percentage:.1f}%) "
+            f"{rate:.2f} images/s",
+            flush=True,
+        )
+
+
+def list_images(input_folder: str) -> List[Dict]:
+    """
+    List the images in the input folder as the inputs of a project create request
+    """
+    inputs = []
+    for filename in sorted(os.listdir(input_folder)):
+        path = os.path.join(input_folder, filename)
+        if not os.path.isfile(path):
+            continue
+        if os.path.splitext(filename)[1].lower() not in IMAGE_EXTENSIONS:
+            continue
+        inputs.append({"image_file_name": filename, "image_path": path})
+    return inputs
+
+
+def create(args) -> int:
+    inputs = list_images(args.input_folder)
+    if len(inputs) == 0:
+        print(f"No images found in {args.input_folder}", file=sys.stderr)
+        return 1
+
+    encoder_model_path, _ = get_model_paths(args.model_type)
+    if args.encoder_model is not None:
+        encoder_model_path = args.encoder_model
+
+    embedding_cache = None
+    if args.embedding_cache_size != 0:
+        embedding_cache = EmbeddingCache(
+            args.embedding_cache_dir,
+            int(args.embedding_cache_size * 1024 * 1024 * 1024),
+        )
+    embedding_generator = EmbeddingGenerator(
+        encoder_model_path,
+        model_type=args.model_type,
+        embedding_cache=embedding_cache,
+        session_config=SessionConfig.from_args(args),
+    )
+
+    output_file = os.path.abspath(args.output_file)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    request = ProjectCreateRequest(
+        {
+            "inputs": inputs,
+            "output_file": output_file,
+            "num_workers": args.workers,
+            "batch_size": args.batch_size,
+            "resume": not args.no_resume,
+            "embedding_format": args.embedding_format,
+        }
+    )
+
+    print(f"Creating {output_file} from {len(inputs)} images", flush=True)
+    start_time = time.time()
+
+    # The creation runs in the worker thread of the creator, so that an
+    # interrupt stops it cleanly and keeps the finished images for resuming
+    project_creator = ProjectCreator(embedding_generator)
+    project_creator.create(
+        request, frontend_enabled=False, progress_callback=ProgressPrinter("create")
+    )
+    try:
+        while project_creator.is_running():
+            project_creator.worker_thread.join(timeout=0.5)
+    except KeyboardInterrupt:
+        print("Stopping project creation ...", flush=True)
+        project_creator.terminate()
+        project_creator.worker_thread.join()
+        return 130
+
+    if not os.path.exists(output_file):
+        print("Project creation failed", file=sys.stderr)
+        return 1
+
+    print(
+        f"Created {output_file} in {time.time() - start_time:.2f} seconds", flush=True
+    )
+    return 0
+
+
+def propose(args) -> int:
+    _, decoder_model_path = get_model_paths(args.model_type)
+    if args.decoder_model is not None:
+        decoder_model_path = args.decoder_model
+
+    dataset, _ = ProjectLoader().load(args.project_file)
+    project_proposer = ProjectProposer(args.project_file)
+
+    print(f"Proposing masks of {dataset.get_size()} images", flush=True)
+    start_time = time.time()
+    num_proposals = project_proposer.propose(
+        dataset,
+        decoder_model_path,
+        session_config=SessionConfig.from_args(args),
+        settings={
+            "points_per_side": args.points_per_side,
+            "points_per_batch": args.points_per_batch,
+            "pred_iou_thresh": args.pred_iou_thresh,
+            "stability_score_thresh": args.stability_score_thresh,
+            "nms_thresh": args.nms_thresh,
+            "min_area": args.min_area,
+        },
+        num_workers=args.workers,
+        progress_callback=ProgressPrinter("propose"),
+    )
+
+    # Save the proposals back to the project file, which then also contains
+    # the journaled edits replayed by the loader
+    ProjectSaver().save_dataset(dataset, args.project_file, args.project_file)
+    ProjectJournal(args.project_file).clear()
+    dataset.get_archive().close()
+
+    print(
+        f"Proposed {num_proposals} masks in {time.time() - start_time:.2f} seconds",
+        flush=True,
+    )
+    return 0
+
+
+def export(args) -> int:
+    if not (args.coco or args.images or args.annotated_images):
+        print(
+            "Nothing to export, use --coco, --images or --annotated-images",
+            file=sys.stderr,
+        )
+        return 1
+
+    dataset, _ = ProjectLoader().load(args.project_file)
+    project_exportor = ProjectExportor(args.project_file)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    if args.images:
+        print(f"Exporting images to {args.output_dir}", flush=True)
+        project_exportor.export_images(args.output_dir)
+
+    if args.annotated_images:
+        print(f"Exporting annotated images to {args.output_dir}", flush=True)
+        project_exportor.export_annotated_images(
+            args.output_dir,
+            dataset,
+            mask_opacity=args.mask_opacity,
+            num_workers=args.workers,
+            progress_callback=ProgressPrinter("annotated_images"),
+        )
+
+    if args.coco:
+        print(f"Exporting COCO annotations to {args.output_dir}", flush=True)
+        project_exportor.export_coco(args.output_dir, dataset)
+
+    dataset.get_archive().close()
+    return 0
+
+
+def stats(args) -> int:
+    # Plot without a display
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from server.statistic import StatisticGraph
+
+    dataset, _ = ProjectLoader().load(args.project_file)
+    category_info = dataset.get_category_info()
+    max_category_id = max([category["id"] for category in category_info], default=0)
+    label_colors = [
+        AnnotationRenderer.get_color(category_id)
+        for category_id in range(max_category_id + 1)
+    ]
+    category_ids = set(category["id"] for category in category_info)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    data_list = dataset.get_data_list()
+    progress_printer = ProgressPrinter("stats")
+    for idx, data in enumerate(data_list):
+        # Masks without a category are not counted
+        annotations = [
+            annotation
+            for annotation in data.get_segmentation()["annotations"]
+            if annotation["category_id"] in category_ids
+        ]
+        json_item = {
+            "images": [
+                {
+                    "filename": data.get_image_name(),
+                    "width": data.get_image_width(),
+                    "height": data.get_image_height(),
+                }
+            ],
+            "annotations": annotations,
+            "categories": category_info,
+        }
+        statistic_graph = StatisticGraph(json_item, label_colors)
+
+        filename = os.path.splitext(data.get_image_name())[0]
+        statistic_graph.export_excel(os.path.join(args.output_dir, f"{filename}.xlsx"))
+        if args.plots:
+            plot_folder = os.path.join(args.output_dir, filename)
+            os.makedirs(plot_folder, exist_ok=True)
+            statistic_graph.plot_coral_coverage(
+                os.path.join(plot_folder, "coral_coverage.png")
+            )
+            statistic_graph.plot_coral_colony_distribution(
+                os.path.join(plot_folder, "colony_distribution.png")
+            )
+            statistic_graph.plot_coral_species_distribution(
+                os.path.join(plot_folder, "species_distribution.png")
+            )
+            statistic_graph.plot_coral_condition_distribution(
+                os.path.join(plot_folder, "condition_distribution.png")
+            )
+        progress_printer(idx + 1, len(data_list))
+
+    dataset.get_archive().close()
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Create, export and analyse projects without the GUI."
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Print the logs to stderr."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    create_parser = subparsers.add_parser(
+        "create", help="Create a project from a folder of images."
+    )
+    create_parser.add_argument("input_folder", type=str, help="Folder of the images.")
+    create_parser.add_argument(
+        "output_file", type=str, help="Path of the project file (.sat)."
+    )
+    create_parser.add_argument(
+        "--model-type",
+        type=str,
+        choices=["vit_b", "vit_h"],
+        default="vit_b",
+        help="SAM model type. Default is vit_b.",
+    )
+    create_parser.add_argument(
+        "--encoder-model",
+        type=str,
+        default=None,
+        help="Path of the encoder model. Default is the model of the model type in the models folder.",
+    )
+    create_parser.add_argument(
+        "--workers",
+        type=int,
+        default=ProjectCreator.DEFAULT_NUM_WORKERS,
+        help=f"Number of image decoding threads. Default is {ProjectCreator.DEFAULT_NUM_WORKERS}.",
+    )
+    create_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=ProjectCreator.DEFAULT_BATCH_SIZE,
+        help=f"Number of images per encoder run. Default is {ProjectCreator.DEFAULT_BATCH_SIZE}.",
+    )
+    create_parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help="Encode all images again instead of resuming an interrupted creation.",
+    )
+    create_parser.add_argument(
+        "--embedding-format",
+        type=str,
+        choices=EMBEDDING_FORMATS,
+        default=ProjectCreator.DEFAULT_EMBEDDING_FORMAT,
+        help="Storage format of the embeddings. float16 halves and int8 quarters "
+        f"the project size. Default is {ProjectCreator.DEFAULT_EMBEDDING_FORMAT}.",
+    )
+    create_parser.add_argument(
+        "--embedding-cache-dir",
+        type=str,
+        default=None,
+        help="Folder of the embedding cache shared across projects. Default is ~/.sat/embedding_cache.",
+    )
+    create_parser.add_argument(
+        "--embedding-cache-size",
+        type=float,
+        default=5,
+        help="Size cap of the embedding cache in GB. Set to 0 to disable the cache. Default is 5.",
+    )
+    SessionConfig.add_arguments(create_parser)
+    create_parser.set_defaults(func=create)
+
+    propose_parser = subparsers.add_parser(
+        "propose",
+        help="Propose the masks of all objects of each image of a project, "
+        "and save them to the project as Detected Coral masks.",
+    )
+    propose_parser.add_argument("project_file", type=str, help="Path of the project file.")
+    propose_parser.add_argument(
+        "--model-type",
+        type=str,
+        choices=["vit_b", "vit_h"],
+        default="vit_b",
+        help="SAM model type. Default is vit_b.",
+    )
+    propose_parser.add_argument(
+        "--decoder-model",
+        type=str,
+        default=None,
+        help="Path of the decoder model. Default is the model of the model type in the models folder.",
+    )
+    propose_parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of proposing processes. Default is the number of CPUs.",
+    )
+    propose_parser.add_argument(
+        "--points-per-side",
+        type=int,
+        default=MaskProposer.DEFAULT_POINTS_PER_SIDE,
+        help=f"Number of prompt points along each side of the image. Default is {MaskProposer.DEFAULT_POINTS_PER_SIDE}.",
+    )
+    propose_parser.add_argument(
+        "--points-per-batch",
+        type=int,
+        default=MaskProposer.DEFAULT_POINTS_PER_BATCH,
+        help=f"Number of prompt points per decoder run. Default is {MaskProposer.DEFAULT_POINTS_PER_BATCH}.",
+    )
+    propose_parser.add_argument(
+        "--pred-iou-thresh",
+        type=float,
+        default=MaskProposer.DEFAULT_PRED_IOU_THRESH,
+        help=f"Minimum predicted iou of the masks. Default is {MaskProposer.DEFAULT_PRED_IOU_THRESH}.",
+    )
+    propose_parser.add_argument(
+        "--stability-score-thresh",
+        type=float,
+        default=MaskProposer.DEFAULT_STABILITY_SCORE_THRESH,
+        help=f"Minimum stability score of the masks. Default is {MaskProposer.DEFAULT_STABILITY_SCORE_THRESH}.",
+    )
+    propose_parser.add_argument(
+        "--nms-thresh",
+        type=float,
+        default=MaskProposer.DEFAULT_NMS_THRESH,
+        help=f"Maximum iou between two masks, and between a mask and an existing annotation. Default is {MaskProposer.DEFAULT_NMS_THRESH}.",
+    )
+    propose_parser.add_argument(
+        "--min-area",
+        type=int,
+        default=MaskProposer.DEFAULT_MIN_AREA,
+        help="Minimum area of the masks in pixels. Default is 0.",
+    )
+    SessionConfig.add_arguments(propose_parser)
+    propose_parser.set_defaults(func=propose)
+
+    export_parser = subparsers.add_parser(
+        "export", help="Export the images and annotations of a project."
+    )
+    export_parser.add_argument("project_file", type=str, help="Path of the project file.")
+    export_parser.add_argument("output_dir", type=str, help="Output folder.")
+    export_parser.add_argument(
+        "--coco", action="store_true", help="Export the annotations in COCO format."
+    )
+    export_parser.add_argument(
+        "--images", action="store_true", help="Export the original images."
+    )
+    export_parser.add_argument(
+        "--annotated-images",
+        action="store_true",
+        help="Export the images with the annotations rendered onto them.",
+    )
+    export_parser.add_argument(
+        "--mask-opacity",
+        type=float,
+        default=AnnotationRenderer.DEFAULT_MASK_OPACITY,
+        help=f"Opacity of the rendered masks. Default is {AnnotationRenderer.DEFAULT_MASK_OPACITY}.",
+    )
+    export_parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of rendering processes. Default is the number of CPUs.",
+    )
+    export_parser.set_defaults(func=export)
+
+    stats_parser = subparsers.add_parser(
+        "stats", help="Compute the statistics of each image of a project."
+    )
+    stats_parser.add_argument("project_file", type=str, help="Path of the project file.")
+    stats_parser.add_argument("output_dir", type=str, help="Output folder.")
+    stats_parser.add_argument(
+        "--plots", action="store_true", help="Also plot the statistics of each image."
+    )
+    stats_parser.set_defaults(func=stats)
+
+    args = parser.parse_args()
+    setup_logging(args.verbose)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -14,6 +14,10 @@ def export_encoder(sam, output):
         args=torch.randn(1, 3, 1024, 1024),
         input_names=["images"],
         output_names=["embeddings"],
+        dynamic_axes={
+            "images": {0: "batch_size"},
+            "embeddings": {0: "batch_size"}
+        },
         export_params=True
     )  
     quantize_output = output.replace(".onnx", "_quantized.onnx")
@@ -48,9 +52,14 @@ def export_decoder(sam, output):
         args=tuple(dummy_inputs.values()),
         input_names=list(dummy_inputs.keys()),
         output_names=output_names,
+        # Independent prompt sets of the same number of points are decoded
+        # in one batch
         dynamic_axes={
-            "point_coords": {1: "num_points"},
-            "point_labels": {1: "num_points"}
+            "point_coords": {0: "num_prompts", 1: "num_points"},
+            "point_labels": {0: "num_prompts", 1: "num_points"},
+            "masks": {0: "num_prompts"},
+            "iou_predictions": {0: "num_prompts"},
+            "low_res_masks": {0: "num_prompts"},
         },
         export_params=True,
         opset_version=17,
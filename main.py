@@ -1,8 +1,12 @@
 import logging
 import eel
+import bottle
 import argparse
+import multiprocessing
 
+from server.project import ProjectLoader
 from server.server import Server
+from server.sessionConfig import SessionConfig
 from typing import List, Dict, Tuple
 from server.util.requests import FileDialogRequest
 
@@ -29,6 +33,15 @@ def setup_logging():
     root_logger.addHandler(console_handler)
 
 
+# Registered before eel.start adds its static file route, so that this route
+# takes precedence
+@bottle.route(f"/{ProjectLoader.IMAGE_ROUTE}/<content_key>/<image_name:path>")
+def get_project_image(content_key: str, image_name: str):
+    return server.get_image_response(
+        content_key, image_name, bottle.request.get_header("If-None-Match")
+    )
+
+
 @eel.expose
 def select_folder(request: Dict) -> str:
     file_dialog_request = FileDialogRequest(request)
@@ -53,9 +66,8 @@ def create_project(project_create_request: Dict):
 
 
 @eel.expose
-def load_project(project_path: str) -> List[Dict]:
+def load_project(project_path: str):
     server.load_project(project_path)
-    return server.get_gallery_data_list()
 
 
 @eel.expose
@@ -87,9 +99,8 @@ def get_data_by_idx(idx: int) -> Dict:
 
 
 @eel.expose
-def get_data_list() -> List[Dict]:
-    data_list = server.get_data_list()
-    return [data.to_json() for data in data_list]
+def get_data_page(offset: int, limit: int, fields: str = "metadata") -> Dict:
+    return server.get_data_page(offset, limit, fields)
 
 
 @eel.expose
@@ -103,8 +114,13 @@ def save_dataset(output_path: str):
 
 
 @eel.expose
-def create_mask(prompts: List[Dict]) -> Dict:
-    return server.create_mask(prompts)
+def create_mask(prompts: List[Dict], preview_size: int = None) -> Dict:
+    return server.create_mask(prompts, preview_size)
+
+
+@eel.expose
+def confirm_mask() -> Dict:
+    return server.confirm_mask()
 
 
 @eel.expose
@@ -118,8 +134,13 @@ def export_images(output_dir: str):
 
 
 @eel.expose
-def export_annotated_images(output_dir: str, data_list: List[Dict]):
-    server.export_annotated_images(output_dir, data_list)
+def export_annotated_images(output_dir: str, mask_opacity: float = 0.4) -> bool:
+    return server.export_annotated_images(output_dir, mask_opacity)
+
+
+@eel.expose
+def terminate_export_process():
+    server.terminate_export_process()
 
 
 @eel.expose
@@ -133,9 +154,13 @@ def import_json(input_path: str):
 
 
 if __name__ == "__main__":
+    # Annotated images are rendered in worker processes, which need this
+    # in the packaged executable
+    multiprocessing.freeze_support()
 
     parser = argparse.ArgumentParser(description="Start the server.")
     parser.add_argument(
+        "--model-type",
         "--model_type",
         type=str,
         choices=["vit_b", "vit_h"],
@@ -143,14 +168,34 @@ if __name__ == "__main__":
         help="Port number for the server. Default is 0 (random port).",
     )
 
+    parser.add_argument(
+        "--embedding-cache-dir",
+        type=str,
+        default=None,
+        help="Folder of the embedding cache shared across projects. Default is ~/.sat/embedding_cache.",
+    )
+    parser.add_argument(
+        "--embedding-cache-size",
+        type=float,
+        default=5,
+        help="Size cap of the embedding cache in GB. Set to 0 to disable the cache. Default is 5.",
+    )
+    SessionConfig.add_arguments(parser)
+
     args = parser.parse_args()
     model_type = args.model_type
+    embedding_cache_size = int(args.embedding_cache_size * 1024 * 1024 * 1024)
 
     setup_logging()
     print("Please wait for the tool to be ready ...")
     eel.init("web")
     print(f"About to start the server ...")
-    server = Server(model_type=model_type)
+    server = Server(
+        model_type=model_type,
+        embedding_cache_dir=args.embedding_cache_dir,
+        embedding_cache_size=embedding_cache_size,
+        session_config=SessionConfig.from_args(args),
+    )
     print(f"Server initialized ...")
     eel.start("main_page.html", size=(1200, 800), port=0)
     print(f"Server started ...")
@@ -0,0 +1,281 @@
+import logging
+import numpy as np
+import pycocotools.mask as mask_util
+
+from io import BytesIO
+from PIL import Image, ImageDraw, ImageFont
+from typing import Dict, List, Tuple
+from .util.coco import decode_rle_mask_crop
+
+
+class AnnotationRenderer:
+    """
+    Render the annotations of an image onto the image with NumPy, so that
+    annotated images can be exported without the browser.
+
+    The output follows web/js/panels/annotationRenderer.js:
+    - masks are blended onto the image with the mask opacity, and the last
+      mask wins where masks overlap
+    - mask borders are drawn with the category color
+    - the category id is drawn in a circle at the middle point of each mask
+    """
+
+    # Keep in sync with web/js/data/categoryManager.js
+    DEFAULT_COLOR = "#FF0000"
+    PROMPT_COLOR = "#1491ff"
+    DEFAULT_TEXT_COLOR = "#fff"
+    LABEL_OUTLINE_COLOR = "#fff"
+
+    UNDEFINED_ID = -1
+    PROMPT_ID = -2
+
+    COLOR_LIST = [
+        "#F6C3CB",
+        "#FFA500",
+        "#225437",
+        "#F7D941",
+        "#73FBFE",
+        "#9EFCD6",
+        "#2B00F7",
+        "#F2AA34",
+        "#EF7C76",
+        "#BADFE5",
+        "#BED966",
+        "#CCE1FD",
+        "#F188E9",
+        "#6CFB45",
+        "#7FCBAC",
+        "#C9BFB6",
+        "#163263",
+        "#751608",
+        "#54AFAA",
+        "#5F0F63",
+    ]
+
+    TEXT_COLOR = [
+        "#fff",
+        "#000",
+        "#fff",
+        "#fff",
+        "#000",
+        "#000",
+        "#000",
+        "#fff",
+        "#000",
+        "#000",
+        "#000",
+        "#000",
+        "#000",
+        "#000",
+        "#000",
+        "#000",
+        "#000",
+        "#fff",
+        "#fff",
+        "#fff",
+    ]
+
+    DEFAULT_MASK_OPACITY = 0.4
+
+    # Border dot radius and label font size relative to the image size
+    BORDER_RADIUS_RATIO = 0.0015
+    FONT_SIZE_RATIO = 0.04
+    MAX_FONT_SIZE = 40
+
+    def __init__(self, mask_opacity: float = DEFAULT_MASK_OPACITY):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        assert 0 <= mask_opacity <= 1, f"Invalid mask opacity: {mask_opacity}"
+        self.mask_opacity = mask_opacity
+        self.fonts: Dict[int, ImageFont.ImageFont] = {}
+
+    @staticmethod
+    def hex_to_rgb(hex_color: str) -> Tuple[int, int, int]:
+        hex_color = hex_color.lstrip("#")
+        if len(hex_color) == 3:
+            hex_color = "".join(c * 2 for c in hex_color)
+        value = int(hex_color, 16)
+        return ((value >> 16) & 255, (value >> 8) & 255, value & 255)
+
+    @staticmethod
+    def get_color(category_id: int) -> str:
+        if category_id == AnnotationRenderer.UNDEFINED_ID:
+            return AnnotationRenderer.DEFAULT_COLOR
+        elif category_id == AnnotationRenderer.PROMPT_ID:
+            return AnnotationRenderer.PROMPT_COLOR
+        return AnnotationRenderer.COLOR_LIST[
+            category_id % len(AnnotationRenderer.COLOR_LIST)
+        ]
+
+    @staticmethod
+    def get_text_color(category_id: int) -> str:
+        if category_id == AnnotationRenderer.UNDEFINED_ID:
+            return AnnotationRenderer.DEFAULT_TEXT_COLOR
+        return AnnotationRenderer.TEXT_COLOR[
+            category_id % len(AnnotationRenderer.COLOR_LIST)
+        ]
+
+    def get_font(self, size: int) -> ImageFont.ImageFont:
+        if size not in self.fonts:
+            try:
+                self.fonts[size] = ImageFont.load_default(size=size)
+            except TypeError:
+                # Pillow < 10.1 only has the fixed size bitmap font
+                self.fonts[size] = ImageFont.load_default()
+        return self.fonts[size]
+
+    def render_bytes(self, image_bytes: bytes, annotations: List[Dict]) -> Image.Image:
+        """
+        Render the annotations onto the encoded image
+        """
+        image = np.array(Image.open(BytesIO(image_bytes)).convert("RGB"))
+        return self.render(image, annotations)
+
+    def render(self, image: np.ndarray, annotations: List[Dict]) -> Image.Image:
+        """
+        Render the annotations onto the image
+
+        Args:
+            image: RGB image with shape (H, W, 3)
+            annotations: List of COCO annotations, each is a dict
+            {
+                "segmentation": Dict,  # COCO RLE
+                "category_id": int,
+                ...
+            }
+
+        Returns:
+            The annotated image
+        """
+        height, width = image.shape[:2]
+
+        # Index of the mask covering each pixel, 0 means no mask
+        mask_index = np.zeros((height, width), dtype=np.uint16)
+        colors = np.zeros((len(annotations) + 1, 3), dtype=np.uint8)
+        border = np.zeros((height, width), dtype=np.uint16)
+        labels = []
+
+        radius = max(int(round(min(width, height) * self.BORDER_RADIUS_RATIO)), 0)
+        for idx, annotation in enumerate(annotations, start=1):
+            category_id = annotation["category_id"]
+            color = self.get_color(category_id)
+            colors[idx] = self.hex_to_rgb(color)
+
+            segmentation = annotation["segmentation"]
+            if tuple(segmentation["size"]) != (height, width):
+                self.logger.warning(
+                    f"Skipping annotation with mask size {tuple(segmentation['size'])}, "
+                    f"expected {(height, width)}"
+                )
+                continue
+
+            # Work in the bounding box of the mask, with a margin for the
+            # border dots, instead of the full image
+            crop = self.get_crop(segmentation, radius, width, height)
+            if crop is None:
+                continue
+            x0, y0, x1, y1 = crop
+            mask = decode_rle_mask_crop(segmentation, x0, y0, x1, y1)
+            mask_index[y0:y1, x0:x1][mask] = idx
+            border[y0:y1, x0:x1][self.get_border(mask, radius)] = idx
+
+            if category_id != self.UNDEFINED_ID:
+                middle_point = self.get_middle_point(mask)
+                if middle_point is not None:
+                    middle_x, middle_y = middle_point
+                    labels.append(((middle_x + x0, middle_y + y0), category_id))
+
+        # Blend only the covered pixels, in integers with the opacity in
+        # 1/256 steps, so that no float copy of the image is made
+        output = image.copy()
+        covered = mask_index > 0
+        opacity = int(round(self.mask_opacity * 256))
+        blended = output[covered].astype(np.uint16) * (256 - opacity)
+        blended += colors[mask_index[covered]].astype(np.uint16) * opacity
+        blended += 128
+        output[covered] = blended >> 8
+        has_border = border > 0
+        output[has_border] = colors[border[has_border]]
+        output = Image.fromarray(output)
+
+        self.draw_labels(output, labels)
+        return output
+
+    @staticmethod
+    def get_crop(
+        segmentation: Dict, radius: int, width: int, height: int
+    ) -> Tuple[int, int, int, int]:
+        """
+        Get the bounding box of the mask as (x0, y0, x1, y1), grown by the
+        radius of the border dots and one pixel, so that the border in the
+        crop is the same as in the full image. None if the mask is empty.
+        """
+        x, y, w, h = mask_util.toBbox(segmentation)
+        if w <= 0 or h <= 0:
+            return None
+        margin = radius + 1
+        x0 = max(int(x) - margin, 0)
+        y0 = max(int(y) - margin, 0)
+        x1 = min(int(x + w) + margin, width)
+        y1 = min(int(y + h) + margin, height)
+        return x0, y0, x1, y1
+
+    @staticmethod
+    def get_border(mask: np.ndarray, radius: int) -> np.ndarray:
+        """
+        Get the pixels of the mask with a 4-neighbour outside the mask,
+        thickened by the radius of the border dots
+        """
+        inner = mask.copy()
+        inner[1:, :] &= mask[:-1, :]
+        inner[:-1, :] &= mask[1:, :]
+        inner[:, 1:] &= mask[:, :-1]
+        inner[:, :-1] &= mask[:, 1:]
+        border = mask & ~inner
+
+        for _ in range(radius):
+            grown = border.copy()
+            grown[1:, :] |= border[:-1, :]
+            grown[:-1, :] |= border[1:, :]
+            grown[:, 1:] |= border[:, :-1]
+            grown[:, :-1] |= border[:, 1:]
+            border = grown
+        return border
+
+    @staticmethod
+    def get_middle_point(mask: np.ndarray) -> Tuple[int, int]:
+        ys, xs = np.nonzero(mask)
+        if len(xs) == 0:
+            return None
+        return (int(xs.mean()), int(ys.mean()))
+
+    def draw_labels(self, image: Image.Image, labels: List[Tuple]):
+        width, height = image.size
+        font_size = min(int(min(width, height) * self.FONT_SIZE_RATIO), self.MAX_FONT_SIZE)
+        if font_size <= 0:
+            return
+
+        draw = ImageDraw.Draw(image)
+        bg_radius = font_size * 0.7
+        for (x, y), category_id in labels:
+            display_id = str(category_id)
+            center_x = x + bg_radius / 2
+            center_y = y - bg_radius / 2
+            draw.ellipse(
+                (
+                    center_x - bg_radius,
+                    center_y - bg_radius,
+                    center_x + bg_radius,
+                    center_y + bg_radius,
+                ),
+                fill=self.hex_to_rgb(self.get_color(category_id)),
+                outline=self.hex_to_rgb(self.LABEL_OUTLINE_COLOR),
+                width=1,
+            )
+            font = self.get_font(max(int(font_size / max(len(display_id), 1)), 1))
+            draw.text(
+                (center_x, center_y),
+                display_id,
+                fill=self.hex_to_rgb(self.get_text_color(category_id)),
+                font=font,
+                anchor="mm",
+            )
@@ -1,8 +1,10 @@
 import numpy as np
-import copy
 
-from typing import Dict, List
-from .util.coco import rle_mask_to_rle_vis_encoding
+from typing import Dict, List, Tuple, TYPE_CHECKING
+from .util.coco import rle_mask_to_rle_vis_encoding, get_rle_key
+
+if TYPE_CHECKING:
+    from .project.projectArchive import ProjectArchive
 
 
 class Data:
@@ -12,8 +14,20 @@ class Data:
         self.image_path = None
         self.idx = -1
         self.embedding = None
+        self.embedding_path = None
+        self.archive = None
         self.segmentation = None
 
+        # Whether the segmentation is changed since the project is saved
+        self.dirty = False
+
+        # Incremented on every segmentation change, to invalidate derived data
+        self.version = 0
+
+        # Key is the rle mask key, and the value is the RLE encoding for
+        # front end visualization
+        self.rle_vis_cache: Dict[Tuple, List[int]] = {}
+
     def set_image_name(self, image_name: str):
         self.image_name = image_name
 
@@ -36,21 +50,58 @@ class Data:
         self.embedding = embedding
 
     def get_embedding(self) -> np.ndarray:
-        return self.embedding
+        """
+        Get the embedding of the image. If the embedding is not held in
+        memory, it is memory-mapped from the project archive, or from the
+        embedding file if the data has no archive, so that only the pages
+        that are actually read become resident.
+        """
+        if self.embedding is not None or self.embedding_path is None:
+            return self.embedding
+        if self.archive is not None:
+            return self.archive.load_numpy(self.embedding_path)
+        return np.load(self.embedding_path, mmap_mode="r")
+
+    def set_embedding_path(self, embedding_path: str):
+        """
+        Set the path of the embedding file, or the member name of the
+        embedding if the data has a project archive
+        """
+        self.embedding_path = embedding_path
+
+    def get_embedding_path(self) -> str:
+        return self.embedding_path
+
+    def set_archive(self, archive: "ProjectArchive"):
+        self.archive = archive
+
+    def get_archive(self) -> "ProjectArchive":
+        return self.archive
 
     def set_segmentation(self, segmentation: Dict):
         self.segmentation = segmentation
+        self.dirty = True
+        self.version += 1
 
     def get_segmentation(self) -> Dict:
         return self.segmentation
 
+    def get_version(self) -> int:
+        return self.version
+
+    def is_dirty(self) -> bool:
+        return self.dirty
+
+    def set_dirty(self, dirty: bool):
+        self.dirty = dirty
+
     def get_image_width(self) -> int:
         return self.segmentation["images"][0]["width"]
 
     def get_image_height(self) -> int:
         return self.segmentation["images"][0]["height"]
 
-    def to_json(self) -> Dict:
+    def to_json(self, include_rle: bool = True) -> Dict:
         """
         Convert the data to json format:
         {
@@ -60,6 +111,8 @@ class Data:
             "segmentation": Json information containing ["images" and "annotations"]. Also note that there is
             an additional key "rle" which is the RLE encoding for the segmentation mask for visualization.
         }
+
+        The "rle" key is skipped if include_rle is False.
         """
 
         assert self.image_name is not None, "Data has no image name"
@@ -67,10 +120,34 @@ class Data:
         assert self.idx != -1, "Data has no index"
         assert self.segmentation is not None, "Data has no segmentation"
 
-        # Convert the segmentation mask encoding to RLE for front end visualization
-        segmentation = copy.deepcopy(self.segmentation)
+        # Convert the segmentation mask encoding to RLE for front end visualization.
+        # The annotations are copied shallowly, the rle masks are not modified.
+        segmentation = {
+            "images": [dict(image) for image in self.segmentation["images"]],
+            "annotations": [
+                dict(annotation) for annotation in self.segmentation["annotations"]
+            ],
+        }
+
+        if not include_rle:
+            return {
+                "image_name": self.image_name,
+                "image_path": self.image_path,
+                "idx": self.idx,
+                "segmentation": segmentation,
+            }
+
+        # Reuse the encoding of the annotations whose mask is unchanged, and
+        # drop the encodings of the masks that no longer exist
+        rle_vis_cache = {}
         for annotation in segmentation["annotations"]:
-            annotation["rle"] = rle_mask_to_rle_vis_encoding(annotation["segmentation"])
+            key = get_rle_key(annotation["segmentation"])
+            rle_vis = self.rle_vis_cache.get(key, None)
+            if rle_vis is None:
+                rle_vis = rle_mask_to_rle_vis_encoding(annotation["segmentation"])
+            rle_vis_cache[key] = rle_vis
+            annotation["rle"] = rle_vis
+        self.rle_vis_cache = rle_vis_cache
 
         return {
             "image_name": self.image_name,
@@ -86,6 +163,24 @@ class Data:
             "idx": self.idx,
         }
 
+    def to_metadata_json(self) -> Dict:
+        """
+        Convert the data to json format without the annotations:
+        {
+            "image_name": "image_name",
+            "image_path": "image_path",
+            "idx": 0,
+            "width": int,
+            "height": int,
+            "annotation_count": int,
+        }
+        """
+        metadata = self.to_image_json()
+        metadata["width"] = self.get_image_width()
+        metadata["height"] = self.get_image_height()
+        metadata["annotation_count"] = len(self.segmentation["annotations"])
+        return metadata
+
 
 class Dataset:
 
@@ -96,6 +191,12 @@ class Dataset:
         self.category_info: List[Dict] = None
         self.last_saved_id = 0
 
+        # Project archive the data is read from, if any
+        self.archive = None
+
+        # Whether the category info is changed since the project is saved
+        self.category_info_dirty = False
+
     def add_data(self, data: Data):
         """
         Add data to the dataset.
@@ -110,11 +211,21 @@ class Dataset:
         assert data_idx in self.data, f"Data at index {data_idx} not found"
         data = self.data[data_idx]
         data.set_segmentation(segmentation)
+        data.set_dirty(True)
         self.last_saved_id = data_idx
 
+    def set_archive(self, archive: "ProjectArchive"):
+        self.archive = archive
+
+    def get_archive(self) -> "ProjectArchive":
+        return self.archive
+
     def get_last_saved_id(self) -> int:
         return self.last_saved_id
 
+    def has_data(self, idx: int) -> bool:
+        return idx in self.data
+
     def get_data(self, idx: int) -> Data:
         """
         Get the data at the given index
@@ -150,6 +261,24 @@ class Dataset:
 
     def set_category_info(self, category_info: List[Dict]):
         self.category_info = category_info
+        self.category_info_dirty = True
+
+    def get_dirty_data_list(self) -> List[Data]:
+        """
+        Get the data changed since the project is saved, sorted by image idx
+        """
+        return [data for data in self.get_data_list() if data.is_dirty()]
+
+    def is_dirty(self) -> bool:
+        return self.category_info_dirty or len(self.get_dirty_data_list()) > 0
+
+    def clear_dirty(self):
+        """
+        Mark all the data and the category info as saved
+        """
+        for data in self.data.values():
+            data.set_dirty(False)
+        self.category_info_dirty = False
 
     def get_data_list_by_category_id(self, category_id: int) -> List[Data]:
         """
@@ -1,27 +1,161 @@
 import numpy as np
-import torch
 import logging
 import onnxruntime as ort
+import threading
 import time
 from PIL import Image
-from segment_anything import sam_model_registry, SamPredictor
-from .util.onnx import preprocess_image
+from typing import List
+from .util.onnx import create_input_buffer, preprocess_image
+from .util.general import compute_file_hash
+from .embeddingCache import EmbeddingCache
+from .sessionConfig import SessionConfig
 
 
 class EmbeddingGenerator:
-    def __init__(self, model_path):
+    def __init__(
+        self,
+        model_path: str,
+        model_type: str = None,
+        embedding_cache: EmbeddingCache = None,
+        session_config: SessionConfig = None,
+    ):
+        """
+        The encoder model is loaded on the first use, since it is only needed
+        to create projects. Call load to load it in advance.
+        """
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.info(f"Initializing {self.__class__.__name__} ...")
-        self.logger.info(f"Loading model from {model_path}")
 
-        execution_providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
-        self.encoder = ort.InferenceSession(model_path, providers=execution_providers)
+        self.model_path = model_path
+        self.session_config = session_config if session_config is not None else SessionConfig()
+        self.encoder: ort.InferenceSession = None
+        self.batch_enabled = False
+        self.lock = threading.Lock()
+        self.hash_lock = threading.Lock()
 
-    def generate_embedding(self, image: np.ndarray) -> np.ndarray:
+        # Reused input of generate_embedding
+        self.input_buffer: np.ndarray = None
+        self.buffer_lock = threading.Lock()
+
+        # Cache entries are keyed by the encoder file hash as well, so that
+        # replacing the model file never returns stale embeddings.
+        self.model_type = model_type
+        self.embedding_cache = embedding_cache
+        self.encoder_hash = None
+
+    def load(self):
+        """
+        Load the encoder model if it is not loaded yet
+        """
+        with self.lock:
+            if self.encoder is not None:
+                return
+
+            self.logger.info(f"Loading model from {self.model_path}")
+            start_time = time.time()
+            encoder = self.session_config.create_session(
+                self.model_path, SessionConfig.ENCODER
+            )
+
+            # Models exported with a fixed batch dimension can only encode one
+            # image per run, so batches are split into single runs for them.
+            batch_dim = encoder.get_inputs()[0].shape[0]
+            self.batch_enabled = not isinstance(batch_dim, int)
+            self.encoder = encoder
+            self.logger.info(
+                f"Loaded model in {time.time() - start_time:.2f} seconds, "
+                f"batched encoding enabled: {self.batch_enabled}"
+            )
+
+    def is_loaded(self) -> bool:
+        return self.encoder is not None
+
+    def get_encoder(self) -> ort.InferenceSession:
+        self.load()
+        return self.encoder
+
+    def get_encoder_hash(self) -> str:
+        with self.hash_lock:
+            if self.encoder_hash is None:
+                start_time = time.time()
+                self.encoder_hash = compute_file_hash(self.model_path)
+                self.logger.info(
+                    f"Hashed encoder model in {time.time() - start_time:.2f} seconds"
+                )
+            return self.encoder_hash
+
+    def get_cache_key(self, image_hash: str) -> str:
+        return EmbeddingCache.get_key(
+            image_hash, self.model_type, self.get_encoder_hash()
+        )
+
+    def get_cached_embedding(self, image_hash: str) -> np.ndarray:
+        """
+        Get the embedding of the image from the embedding cache.
+        Return None if the cache is disabled or the image is not cached.
+        """
+        if self.embedding_cache is None or image_hash is None:
+            return None
+        return self.embedding_cache.get(self.get_cache_key(image_hash))
+
+    def cache_embedding(self, image_hash: str, embedding: np.ndarray):
+        if self.embedding_cache is None or image_hash is None:
+            return
+        self.embedding_cache.put(self.get_cache_key(image_hash), embedding)
+
+    def generate_embedding(self, image: np.ndarray, image_hash: str = None) -> np.ndarray:
+        cached_embedding = self.get_cached_embedding(image_hash)
+        if cached_embedding is not None:
+            return cached_embedding
+
+        encoder = self.get_encoder()
         start_time = time.time()
-        input_tensor = preprocess_image(Image.fromarray(image))
-        outputs = self.encoder.run(None, {"images": input_tensor})
+        with self.buffer_lock:
+            if self.input_buffer is None:
+                self.input_buffer = create_input_buffer(1)
+            input_tensor = preprocess_image(Image.fromarray(image), self.input_buffer)
+            outputs = encoder.run(None, {"images": input_tensor})
         self.logger.info(
             f"Generate embedding time: {time.time() - start_time:.2f} seconds"
         )
+        self.cache_embedding(image_hash, outputs[0])
         return outputs[0]
+
+    def generate_embeddings(
+        self, input_batch: np.ndarray, image_hashes: List[str] = None
+    ) -> List[np.ndarray]:
+        """
+        Generate embeddings for a batch of preprocessed images.
+        The cache is not checked here, since the images are already
+        preprocessed. Use get_cached_embedding before preprocessing instead.
+
+        Args:
+            input_batch: Batch returned by preprocess_images, with shape
+                (N, 3, 1024, 1024)
+            image_hashes: Content hashes of the images, used to store the
+                embeddings in the embedding cache
+
+        Returns:
+            List of embeddings, each with shape (1, 256, 64, 64)
+        """
+        if len(input_batch) == 0:
+            return []
+
+        encoder = self.get_encoder()
+        start_time = time.time()
+        if self.batch_enabled:
+            outputs = encoder.run(None, {"images": input_batch})[0]
+            embeddings = [outputs[i : i + 1] for i in range(len(input_batch))]
+        else:
+            embeddings = [
+                encoder.run(None, {"images": input_batch[i : i + 1]})[0]
+                for i in range(len(input_batch))
+            ]
+        self.logger.info(
+            f"Generate {len(input_batch)} embeddings time: {time.time() - start_time:.2f} seconds"
+        )
+
+        if image_hashes is not None:
+            for image_hash, embedding in zip(image_hashes, embeddings):
+                self.cache_embedding(image_hash, embedding)
+        return embeddings
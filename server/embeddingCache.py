@@ -0,0 +1,128 @@
+import logging
+import os
+import threading
+import numpy as np
+
+from typing import Dict
+from .util.general import compute_bytes_hash
+
+
+class EmbeddingCache:
+    """
+    Persistent on-disk cache of image embeddings shared by all projects.
+
+    Each embedding is stored as a .npy file named by the hash of
+    (image content hash, model type, encoder file hash), so the same image
+    encoded by another model never hits a stale entry. The total size of
+    the cache is capped, and the least recently used entries are evicted.
+    The access time of an entry is tracked through its file mtime, so the
+    LRU order survives restarts.
+    """
+
+    DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".sat", "embedding_cache")
+    DEFAULT_MAX_SIZE = 5 * 1024 * 1024 * 1024  # 5 GB
+
+    def __init__(self, cache_dir: str = None, max_size: int = None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        if cache_dir is None:
+            cache_dir = EmbeddingCache.DEFAULT_CACHE_DIR
+        if max_size is None:
+            max_size = EmbeddingCache.DEFAULT_MAX_SIZE
+
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+        # Key is the cache key, and the value is [file size, last access time]
+        self.entries: Dict[str, list] = {}
+        self.total_size = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.scan()
+
+    def scan(self):
+        for filename in os.listdir(self.cache_dir):
+            key, ext = os.path.splitext(filename)
+            if ext != ".npy":
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, filename))
+            self.entries[key] = [stat.st_size, stat.st_mtime]
+            self.total_size += stat.st_size
+
+        self.logger.info(
+            f"Embedding cache at {self.cache_dir}: {len(self.entries)} entries, "
+            f"{self.total_size / 1024 / 1024:.1f} MB of {self.max_size / 1024 / 1024:.1f} MB"
+        )
+
+    @staticmethod
+    def get_key(image_hash: str, model_type: str, encoder_hash: str) -> str:
+        return compute_bytes_hash(
+            f"{image_hash}:{model_type}:{encoder_hash}".encode("utf-8")
+        )
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def get(self, key: str) -> np.ndarray:
+        """
+        Get the cached embedding, or None if it is not cached
+        """
+        with self.lock:
+            if key not in self.entries:
+                return None
+
+        path = self.get_path(key)
+        try:
+            embedding = np.load(path)
+            os.utime(path)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Dropping unreadable cache entry {key}: {e}")
+            self.remove(key)
+            return None
+
+        with self.lock:
+            if key in self.entries:
+                self.entries[key][1] = os.path.getmtime(path)
+        return embedding
+
+    def put(self, key: str, embedding: np.ndarray):
+        """
+        Store the embedding in the cache, evicting the least recently used
+        entries if the cache grows beyond its size cap
+        """
+        path = self.get_path(key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            np.save(f, embedding)
+        os.replace(temp_path, path)
+
+        stat = os.stat(path)
+        with self.lock:
+            if key in self.entries:
+                self.total_size -= self.entries[key][0]
+            self.entries[key] = [stat.st_size, stat.st_mtime]
+            self.total_size += stat.st_size
+        self.evict()
+
+    def remove(self, key: str):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.total_size -= entry[0]
+        path = self.get_path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def evict(self):
+        with self.lock:
+            if self.total_size <= self.max_size:
+                return
+            keys = sorted(self.entries.keys(), key=lambda key: self.entries[key][1])
+
+        for key in keys:
+            with self.lock:
+                if self.total_size <= self.max_size:
+                    break
+            self.logger.debug(f"Evicting cache entry {key}")
+            self.remove(key)
@@ -1,22 +1,54 @@
 import logging
+import threading
+import time
 
 import numpy as np
 import onnxruntime as ort
 
-from typing import List
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+from ..sessionConfig import SessionConfig
 from ..transforms import ResizeLongestSide
+from ..util.coco import numpy_mask_to_rle_mask, rle_to_vis_annotation
+from ..util.embedding import decode_embedding
+from ..util.onnx import postprocess_masks
 from .prompt import Prompt
 
 
 class MaskCreator:
 
-    def __init__(self, onnx_path: str):
+    MASK_THRESHOLD = 0.5
+
+    FULL = "full"
+    PREVIEW = "preview"
+
+    DEFAULT_CACHE_SIZE = 64
+
+    def __init__(
+        self,
+        onnx_path: str,
+        load_async: bool = True,
+        session_config: SessionConfig = None,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+    ):
+        """
+        Args:
+            onnx_path: Path of the decoder model
+            load_async: Load and warm up the decoder model in a background
+                thread, so that the caller is not blocked. create_mask waits
+                for the model to be loaded.
+            session_config: Settings of the onnxruntime session
+            cache_size: Maximum number of decoder results of create_mask
+                cached for the current image. 0 disables the cache.
+        """
         self.logger = logging.getLogger(self.__class__.__name__)
-        self.logger.info(f"Loading ONNX model from {onnx_path}")
 
-        self.ort_session = ort.InferenceSession(
-            onnx_path, providers=["CUDAExecutionProvider", "CPUExecutionProvider"]
-        )
+        self.onnx_path = onnx_path
+        self.session_config = session_config if session_config is not None else SessionConfig()
+        self.ort_session: ort.InferenceSession = None
+        self.loaded_event = threading.Event()
+        self.load_error: Exception = None
+
         self.image: np.ndarray = None
         self.image_embedding: np.ndarray = None
         self.image_size = None
@@ -24,57 +56,436 @@ class MaskCreator:
 
         self.default_mask_input = np.zeros((1, 1, 256, 256), dtype=np.float32)
         self.default_has_mask_input = np.zeros(1, dtype=np.float32)
+        self.has_mask_input = np.ones(1, dtype=np.float32)
         self.transforms = ResizeLongestSide(1024)
 
-        self.low_res_logits = None
+        # The embedding is bound to the decoder once per image, and the
+        # outputs are written into buffers reused across calls of
+        # create_mask
+        self.io_binding: ort.IOBinding = None
+        self.embedding_value: ort.OrtValue = None
+        self.coord_scale: np.ndarray = None
+        self.mask_buffers: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.iou_buffer = np.empty((1, 1), dtype=np.float32)
+        self.low_res_buffer = np.empty((1, 1, 256, 256), dtype=np.float32)
+
+        # Decoder results of create_mask on the current image, least recently
+        # used first. The key is (prompt key, id of the mask input entry),
+        # and the value is the entry:
+        # {
+        #     "id": int,
+        #     "low_res_logits": np.ndarray,  # (1, 1, 256, 256)
+        #     "masks": Dict[Tuple[int, int], Dict],  # Mask annotation of each size
+        # }
+        assert cache_size >= 0, f"Invalid cache size: {cache_size}"
+        self.cache_size = cache_size
+        self.cache: Dict[Tuple, Dict] = OrderedDict()
+        # Key of the latest entry of each prompt key
+        self.prompt_keys: Dict[Tuple, Tuple] = {}
+        self.next_entry_id = 0
+
+        # Entry of the last created mask, None if there is no mask
+        self.entry: Dict = None
+
+        if load_async:
+            # Not a daemon thread, since exiting while onnxruntime loads the
+            # model aborts the process
+            self.load_thread = threading.Thread(target=self.load)
+            self.load_thread.start()
+        else:
+            self.load()
+
+    def load(self):
+        """
+        Load the decoder model and run it once, since the first run of a
+        session is much slower than the following runs
+        """
+        try:
+            self.logger.info(f"Loading ONNX model from {self.onnx_path}")
+            start_time = time.time()
+            ort_session = self.session_config.create_session(
+                self.onnx_path, SessionConfig.DECODER
+            )
+            self.logger.info(
+                f"Loaded ONNX model in {time.time() - start_time:.2f} seconds"
+            )
+
+            start_time = time.time()
+            self.warmup(ort_session)
+            self.logger.info(
+                f"Warmed up ONNX model in {time.time() - start_time:.2f} seconds"
+            )
+            self.ort_session = ort_session
+        except Exception as e:
+            self.logger.error(f"Error loading ONNX model: {e}")
+            self.load_error = e
+        finally:
+            self.loaded_event.set()
+
+    def warmup(self, ort_session: ort.InferenceSession):
+        embedding_shape = [1, 256, 64, 64]
+        for model_input in ort_session.get_inputs():
+            if model_input.name == "image_embeddings":
+                embedding_shape = [
+                    dim if isinstance(dim, int) else default
+                    for dim, default in zip(model_input.shape, embedding_shape)
+                ]
+        ort_inputs = {
+            "image_embeddings": np.zeros(embedding_shape, dtype=np.float32),
+            "point_coords": np.zeros((1, 1, 2), dtype=np.float32),
+            "point_labels": np.ones((1, 1), dtype=np.float32),
+            "mask_input": self.default_mask_input,
+            "has_mask_input": self.default_has_mask_input,
+            "orig_im_size": np.array([1024, 1024], dtype=np.float32),
+        }
+        ort_session.run(None, ort_inputs)
+
+    def get_session(self) -> ort.InferenceSession:
+        """
+        Get the decoder session, waiting for it to be loaded
+        """
+        self.loaded_event.wait()
+        if self.ort_session is None:
+            raise RuntimeError(f"Failed to load the decoder model: {self.load_error}")
+        return self.ort_session
 
     def set_image(self, image_embedding: np.ndarray, image_size: List[int]):
-        self.image_embedding = image_embedding
+        """
+        Set the image of the following masks
+
+        Args:
+            image_embedding: Embedding of the image in any storage format,
+                upcast to float32 for the decoder
+            image_size: (height, width) of the image
+        """
+        self.image_embedding = decode_embedding(image_embedding)
         self.image_size = image_size
-        self.low_res_logits = None
+        self.entry = None
+        self.cache.clear()
+        self.prompt_keys.clear()
 
-    def create_mask(self, prompts: List[Prompt]) -> np.ndarray:
-        self.logger.info(f"Creating mask with {len(prompts)} prompts ...")
-        if len(prompts) == 0:
-            return np.zeros(self.image_size, dtype=np.uint8)
+        # Scale of the prompt coordinates from the original image to the
+        # longest side 1024 input of the encoder, as in ResizeLongestSide
+        height, width = image_size
+        new_height, new_width = ResizeLongestSide.get_preprocess_shape(
+            height, width, self.transforms.target_length
+        )
+        self.coord_scale = np.array(
+            [new_width / width, new_height / height], dtype=np.float32
+        )
 
-        input_points = []
-        for prompt in prompts:
-            input_points.append([prompt.get_x(), prompt.get_y()])
+        # Bound on the next create_mask, so that setting the image does not
+        # wait for the decoder to be loaded
+        self.io_binding = None
 
-        input_labels = []
-        for prompt in prompts:
-            input_labels.append(prompt.get_label())
+    def bind_image(self):
+        """
+        Bind the embedding of the current image to the decoder
+        """
+        session = self.get_session()
+        io_binding = session.io_binding()
 
-        onnx_coord = np.array(input_points, dtype=np.float32)[None, :, :]
-        onnx_coord = self.transforms.apply_coords(onnx_coord, self.image_size).astype(
-            np.float32
+        # With the CUDA provider the embedding is copied to the device here,
+        # instead of on every run
+        device = "cpu"
+        if session.get_providers()[0] == "CUDAExecutionProvider":
+            device = "cuda"
+        self.embedding_value = ort.OrtValue.ortvalue_from_numpy(
+            self.image_embedding, device, 0
         )
+        io_binding.bind_ortvalue_input("image_embeddings", self.embedding_value)
+
+        masks_name, iou_name, _ = [output.name for output in session.get_outputs()]
+        self.bind_output(io_binding, iou_name, self.iou_buffer)
+        self.io_binding = io_binding
 
-        onnx_label = np.array(input_labels, dtype=np.float32)[None, :].astype(
-            np.float32
+    @staticmethod
+    def bind_output(io_binding: ort.IOBinding, name: str, buffer: np.ndarray):
+        io_binding.bind_output(
+            name, "cpu", 0, buffer.dtype, buffer.shape, buffer.ctypes.data
         )
 
-        if self.low_res_logits is not None:
-            mask_input = self.low_res_logits
-            has_mask_input = np.ones(1, dtype=np.float32)
+    def get_mask_buffers(
+        self, resolution: str, size: Tuple[int, int]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the buffers of the decoder mask output and the thresholded mask
+        of the resolution. The buffers are only reallocated when the size
+        changes.
+        """
+        size = tuple(size)
+        buffers = self.mask_buffers.get(resolution)
+        if buffers is None or buffers[1].shape != size:
+            buffers = (
+                np.empty((1, 1, *size), dtype=np.float32),
+                np.empty(size, dtype=bool),
+            )
+            self.mask_buffers[resolution] = buffers
+        return buffers
+
+    def get_preview_size(self, max_size: int) -> List[int]:
+        """
+        Get the size of the preview mask, with the longest side at most
+        max_size and the aspect ratio of the image
+        """
+        height, width = self.image_size
+        if max(height, width) <= max_size:
+            return [height, width]
+        return list(ResizeLongestSide.get_preprocess_shape(height, width, max_size))
+
+    @staticmethod
+    def get_prompt_key(prompts: List[Prompt]) -> Tuple:
+        return tuple(
+            (float(prompt.get_x()), float(prompt.get_y()), int(prompt.get_label()))
+            for prompt in prompts
+        )
+
+    def get_mask_input_entry(self, prompt_key: Tuple) -> Dict:
+        """
+        Get the entry whose low resolution logits are the mask input of the
+        prompts. It is the entry of the prompts without the last prompt, as
+        when the prompts are added one by one, so that the mask of the same
+        prompts is the same, e.g. after undoing the last prompt. If that
+        entry is not cached, it is the entry of the last created mask.
+        """
+        if len(prompt_key) <= 1:
+            return None
+        key = self.prompt_keys.get(prompt_key[:-1], None)
+        if key is not None and key in self.cache:
+            return self.cache[key]
+        return self.entry
+
+    def add_cache_entry(self, key: Tuple, entry: Dict):
+        if self.cache_size == 0:
+            return
+        self.cache[key] = entry
+        self.prompt_keys[key[0]] = key
+        while len(self.cache) > self.cache_size:
+            evicted_key, _ = self.cache.popitem(last=False)
+            if self.prompt_keys.get(evicted_key[0], None) == evicted_key:
+                del self.prompt_keys[evicted_key[0]]
+
+    def create_mask(self, prompts: List[Prompt], preview_size: int = None) -> Dict:
+        """
+        Create the mask of the prompts on the current image.
+
+        The decoder results are cached by the prompts and the mask input
+        until the image is changed, so that repeated prompts are not decoded
+        again.
+
+        Args:
+            prompts: Prompts of the mask
+            preview_size: If given, create a preview mask with the longest side
+                at most preview_size instead of the full resolution mask. The
+                decoder then upsamples its low resolution logits to the
+                preview size only, and the full resolution mask is created by
+                get_full_mask when needed.
+
+        Returns:
+            The mask annotation in COCO format, with the rle encoding of the
+            mask for front end visualization, see rle_to_vis_annotation. It
+            is cached with the decoder results, do not modify it.
+        """
+        self.logger.info(f"Creating mask with {len(prompts)} prompts ...")
+        mask_size = list(self.image_size)
+        if preview_size is not None:
+            mask_size = self.get_preview_size(preview_size)
+
+        if len(prompts) == 0:
+            self.entry = None
+            return rle_to_vis_annotation(
+                numpy_mask_to_rle_mask(np.zeros(mask_size, dtype=np.uint8))
+            )
+
+        prompt_key = self.get_prompt_key(prompts)
+        mask_input_entry = self.get_mask_input_entry(prompt_key)
+        key = (
+            prompt_key,
+            mask_input_entry["id"] if mask_input_entry is not None else None,
+        )
+
+        entry = self.cache.get(key, None)
+        if entry is not None:
+            self.logger.info(f"Using the cached mask")
+            self.cache.move_to_end(key)
         else:
-            mask_input = self.default_mask_input
-            has_mask_input = self.default_has_mask_input
+            entry = self.decode(prompts, mask_input_entry, mask_size)
+            self.add_cache_entry(key, entry)
 
-        ort_inputs = {
-            "image_embeddings": self.image_embedding,
-            "point_coords": onnx_coord,
-            "point_labels": onnx_label,
-            "mask_input": mask_input,
-            "has_mask_input": has_mask_input,
-            "orig_im_size": np.array(self.image_size, dtype=np.float32),
+        self.entry = entry
+        return self.get_entry_mask(entry, mask_size)
+
+    def decode(
+        self, prompts: List[Prompt], mask_input_entry: Dict, mask_size: List[int]
+    ) -> Dict:
+        """
+        Run the decoder on the prompts, with the low resolution logits of
+        the mask input entry as the mask input
+
+        Returns:
+            The entry of the result, with the mask of mask_size
+        """
+        if self.io_binding is None:
+            self.bind_image()
+        io_binding = self.io_binding
+        session = self.get_session()
+
+        onnx_coord = np.array(
+            [[prompt.get_x(), prompt.get_y()] for prompt in prompts], dtype=np.float32
+        )[None, :, :]
+        onnx_coord *= self.coord_scale
+        onnx_label = np.array(
+            [prompt.get_label() for prompt in prompts], dtype=np.float32
+        )[None, :]
+        io_binding.bind_cpu_input("point_coords", onnx_coord)
+        io_binding.bind_cpu_input("point_labels", onnx_label)
+
+        if mask_input_entry is not None:
+            io_binding.bind_cpu_input("mask_input", mask_input_entry["low_res_logits"])
+            io_binding.bind_cpu_input("has_mask_input", self.has_mask_input)
+        else:
+            io_binding.bind_cpu_input("mask_input", self.default_mask_input)
+            io_binding.bind_cpu_input("has_mask_input", self.default_has_mask_input)
+
+        # The decoder upsamples the mask to orig_im_size
+        resolution = MaskCreator.PREVIEW
+        if mask_size == list(self.image_size):
+            resolution = MaskCreator.FULL
+        mask_buffer, mask_output = self.get_mask_buffers(resolution, mask_size)
+        io_binding.bind_cpu_input(
+            "orig_im_size", np.array(mask_size, dtype=np.float32)
+        )
+        masks_name, _, low_res_name = [output.name for output in session.get_outputs()]
+        self.bind_output(io_binding, masks_name, mask_buffer)
+        self.bind_output(io_binding, low_res_name, self.low_res_buffer)
+
+        session.run_with_iobinding(io_binding)
+
+        np.greater(mask_buffer[0, 0], MaskCreator.MASK_THRESHOLD, out=mask_output)
+        entry = {
+            "id": self.next_entry_id,
+            "low_res_logits": self.low_res_buffer.copy(),
+            "masks": {
+                tuple(mask_size): rle_to_vis_annotation(
+                    numpy_mask_to_rle_mask(mask_output)
+                )
+            },
         }
+        self.next_entry_id += 1
+        return entry
+
+    def get_entry_mask(self, entry: Dict, mask_size: List[int]) -> Dict:
+        """
+        Get the mask annotation of the entry with the size. A mask of a new
+        size is upsampled from the low resolution logits of the entry, in
+        the same way as the decoder does.
+        """
+        size = tuple(mask_size)
+        if size not in entry["masks"]:
+            _, mask_output = self.get_mask_buffers(
+                MaskCreator.FULL if list(size) == list(self.image_size) else MaskCreator.PREVIEW,
+                size,
+            )
+            logits = postprocess_masks(
+                entry["low_res_logits"][0, 0], self.image_size, size
+            )
+            np.greater(logits, MaskCreator.MASK_THRESHOLD, out=mask_output)
+            entry["masks"][size] = rle_to_vis_annotation(
+                numpy_mask_to_rle_mask(mask_output)
+            )
+        return entry["masks"][size]
+
+    def get_full_mask(self) -> Dict:
+        """
+        Get the full resolution mask annotation of the last create_mask call
+        """
+        if self.entry is None:
+            return rle_to_vis_annotation(
+                numpy_mask_to_rle_mask(np.zeros(self.image_size, dtype=np.uint8))
+            )
+        return self.get_entry_mask(self.entry, self.image_size)
+
+    def supports_batch(self) -> bool:
+        """
+        Check if the decoder model decodes a batch of prompt sets in one run,
+        i.e. it is exported with a dynamic batch size of point_coords
+        """
+        for model_input in self.get_session().get_inputs():
+            if model_input.name == "point_coords":
+                return not isinstance(model_input.shape[0], int)
+        return False
+
+    def get_batches(
+        self, prompt_sets: List[List[Prompt]], batch_size: int
+    ) -> List[List[int]]:
+        """
+        Split the prompt sets into batches of at most batch_size prompt sets
+        with the same number of prompts
+
+        Returns:
+            The indices of the prompt sets of each batch
+        """
+        assert batch_size > 0, f"Invalid batch size: {batch_size}"
+        if not self.supports_batch():
+            batch_size = 1
+
+        groups: Dict[int, List[int]] = {}
+        for idx, prompts in enumerate(prompt_sets):
+            groups.setdefault(len(prompts), []).append(idx)
 
-        mask, _, low_res_logits = self.ort_session.run(None, ort_inputs)
-        mask = mask > 0.5
-        mask = mask.squeeze()
+        batches = []
+        for indices in groups.values():
+            for start in range(0, len(indices), batch_size):
+                batches.append(indices[start : start + batch_size])
+        return batches
+
+    def decode_batch(
+        self, prompt_sets: List[List[Prompt]], mask_size: List[int]
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Decode independent prompt sets with the same number of prompts on
+        the current image in one run, without mask input
+
+        Args:
+            prompt_sets: Prompts of each mask
+            mask_size: (height, width) the decoder upsamples the masks to,
+                with the aspect ratio of the image
+
+        Returns:
+            (mask logits with shape (N, 1, height, width),
+             predicted ious with shape (N, 1),
+             low resolution logits with shape (N, 1, 256, 256))
+        """
+        for prompts in prompt_sets:
+            assert len(prompts) > 0, "Empty prompt set"
+            assert len(prompts) == len(
+                prompt_sets[0]
+            ), "Prompt sets of a batch must have the same number of prompts"
+
+        if self.io_binding is None:
+            self.bind_image()
+        session = self.get_session()
+
+        onnx_coord = np.array(
+            [[[prompt.get_x(), prompt.get_y()] for prompt in prompts] for prompts in prompt_sets],
+            dtype=np.float32,
+        )
+        onnx_coord *= self.coord_scale
+        onnx_label = np.array(
+            [[prompt.get_label() for prompt in prompts] for prompts in prompt_sets],
+            dtype=np.float32,
+        )
 
-        self.low_res_logits = low_res_logits
+        io_binding = session.io_binding()
+        io_binding.bind_ortvalue_input("image_embeddings", self.embedding_value)
+        io_binding.bind_cpu_input("point_coords", onnx_coord)
+        io_binding.bind_cpu_input("point_labels", onnx_label)
+        io_binding.bind_cpu_input("mask_input", self.default_mask_input)
+        io_binding.bind_cpu_input("has_mask_input", self.default_has_mask_input)
+        io_binding.bind_cpu_input("orig_im_size", np.array(mask_size, dtype=np.float32))
+        for output in session.get_outputs():
+            io_binding.bind_output(output.name, "cpu")
+        session.run_with_iobinding(io_binding)
 
-        return mask
+        masks, iou_predictions, low_res_logits = io_binding.copy_outputs_to_cpu()
+        return masks, iou_predictions, low_res_logits
@@ -0,0 +1,244 @@
+import logging
+import time
+
+import numpy as np
+import pycocotools.mask as mask_util
+
+from typing import Dict, List
+from ..util.coco import to_coco_annotation
+from ..util.onnx import postprocess_masks
+from .maskCreator import MaskCreator
+from .prompt import Prompt
+
+
+class MaskProposer:
+    """
+    Propose the masks of all the objects of an image from its embedding
+    ("segment everything"), following the automatic mask generator of SAM:
+    1. prompt the decoder with each point of a regular grid over the image,
+       decoding the points in batches
+    2. keep the masks with a high predicted iou and a high stability score
+    3. remove the duplicated masks with non-maximum suppression on the rle
+       masks
+    4. upsample the kept masks to the image size
+
+    The masks are filtered at the longest side 1024 of the encoder input,
+    so that only the kept masks are upsampled to the image size.
+    """
+
+    DEFAULT_POINTS_PER_SIDE = 32
+    DEFAULT_POINTS_PER_BATCH = 64
+    DEFAULT_PRED_IOU_THRESH = 0.88
+    DEFAULT_STABILITY_SCORE_THRESH = 0.95
+    DEFAULT_NMS_THRESH = 0.7
+    DEFAULT_MIN_AREA = 0
+
+    # Offset of the mask threshold to compute the stability score with
+    STABILITY_SCORE_OFFSET = 1.0
+
+    # Longest side of the masks that are filtered
+    PROPOSAL_MASK_SIZE = 1024
+
+    # Category id of the proposed masks, "Detected Coral"
+    CATEGORY_ID = -1
+
+    def __init__(
+        self,
+        mask_creator: MaskCreator,
+        points_per_side: int = DEFAULT_POINTS_PER_SIDE,
+        points_per_batch: int = DEFAULT_POINTS_PER_BATCH,
+        pred_iou_thresh: float = DEFAULT_PRED_IOU_THRESH,
+        stability_score_thresh: float = DEFAULT_STABILITY_SCORE_THRESH,
+        nms_thresh: float = DEFAULT_NMS_THRESH,
+        min_area: int = DEFAULT_MIN_AREA,
+    ):
+        """
+        Args:
+            mask_creator: Mask creator with the decoder model
+            points_per_side: Number of points along each side of the grid
+            points_per_batch: Maximum number of points decoded in one run
+            pred_iou_thresh: Minimum predicted iou of the kept masks
+            stability_score_thresh: Minimum stability score of the kept masks
+            nms_thresh: Maximum iou between two kept masks, and between a
+                kept mask and an existing annotation
+            min_area: Minimum area in pixels of the kept masks
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        assert points_per_side > 0, f"Invalid points per side: {points_per_side}"
+        assert points_per_batch > 0, f"Invalid points per batch: {points_per_batch}"
+        assert 0 <= nms_thresh <= 1, f"Invalid nms threshold: {nms_thresh}"
+
+        self.mask_creator = mask_creator
+        self.points_per_side = points_per_side
+        self.points_per_batch = points_per_batch
+        self.pred_iou_thresh = pred_iou_thresh
+        self.stability_score_thresh = stability_score_thresh
+        self.nms_thresh = nms_thresh
+        self.min_area = min_area
+
+    def get_settings(self) -> Dict:
+        return {
+            "points_per_side": self.points_per_side,
+            "points_per_batch": self.points_per_batch,
+            "pred_iou_thresh": self.pred_iou_thresh,
+            "stability_score_thresh": self.stability_score_thresh,
+            "nms_thresh": self.nms_thresh,
+            "min_area": self.min_area,
+        }
+
+    def build_point_grid(self, image_size: List[int]) -> np.ndarray:
+        """
+        Get the points of a regular grid over the image, with the points in
+        the middle of the grid cells
+
+        Returns:
+            (x, y) of the points in image coordinates, with shape (N, 2)
+        """
+        height, width = image_size
+        offset = 1 / (2 * self.points_per_side)
+        points_one_side = np.linspace(offset, 1 - offset, self.points_per_side)
+        xs, ys = np.meshgrid(points_one_side * width, points_one_side * height)
+        return np.stack([xs.ravel(), ys.ravel()], axis=1)
+
+    @staticmethod
+    def compute_stability_scores(logits: np.ndarray, threshold: float, offset: float) -> np.ndarray:
+        """
+        Get the stability score of each mask, the iou between the masks
+        thresholded at threshold + offset and threshold - offset
+
+        Args:
+            logits: Mask logits with shape (N, H, W)
+        """
+        intersections = (logits > threshold + offset).sum(axis=(1, 2), dtype=np.int64)
+        unions = (logits > threshold - offset).sum(axis=(1, 2), dtype=np.int64)
+        return intersections / np.maximum(unions, 1)
+
+    @staticmethod
+    def mask_nms(rles: List[Dict], scores: np.ndarray, nms_thresh: float) -> List[int]:
+        """
+        Greedy non-maximum suppression on rle masks, keeping the mask with
+        the higher score of two masks with an iou above nms_thresh. Each
+        mask is only compared with the kept masks.
+
+        Returns:
+            Indices of the kept masks, in descending order of score
+        """
+        keep = []
+        kept_rles = []
+        for idx in np.argsort(-scores, kind="stable"):
+            if len(kept_rles) > 0:
+                ious = mask_util.iou([rles[idx]], kept_rles, [0] * len(kept_rles))
+                if np.max(ious) > nms_thresh:
+                    continue
+            keep.append(int(idx))
+            kept_rles.append(rles[idx])
+        return keep
+
+    def propose(
+        self,
+        image_embedding: np.ndarray,
+        image_size: List[int],
+        annotations: List[Dict] = None,
+    ) -> List[Dict]:
+        """
+        Propose the masks of the image
+
+        Args:
+            image_embedding: Embedding of the image
+            image_size: (height, width) of the image
+            annotations: Existing annotations of the image. The proposals
+                overlapping them are skipped.
+
+        Returns:
+            The proposed annotations, in descending order of predicted iou,
+            in the format of to_coco_annotation with the category -1
+            {
+                "segmentation": Dict,
+                "bbox": List[int],
+                "area": int,
+                "category_id": -1,
+                "id": -1,
+                "image_id": -1,
+                "iscrowd": 0,
+                "predicted_iou": float,
+                "stability_score": float,
+            }
+        """
+        start_time = time.time()
+        self.mask_creator.set_image(image_embedding, image_size)
+
+        points = self.build_point_grid(image_size)
+        prompt_sets = [
+            [Prompt({"imageX": float(x), "imageY": float(y), "label": Prompt.POSITIVE})]
+            for x, y in points
+        ]
+        mask_size = self.mask_creator.get_preview_size(MaskProposer.PROPOSAL_MASK_SIZE)
+
+        # Filter the masks of each batch, keeping the rle mask for the nms and
+        # the low resolution logits to upsample the kept masks
+        rles: List[Dict] = []
+        pred_ious: List[float] = []
+        stability_scores: List[float] = []
+        low_res_logits: List[np.ndarray] = []
+        for batch in self.mask_creator.get_batches(prompt_sets, self.points_per_batch):
+            logits, batch_ious, batch_low_res_logits = self.mask_creator.decode_batch(
+                [prompt_sets[idx] for idx in batch], mask_size
+            )
+            logits = logits[:, 0]
+            batch_ious = batch_ious[:, 0]
+
+            keep = batch_ious > self.pred_iou_thresh
+            batch_scores = self.compute_stability_scores(
+                logits[keep], MaskCreator.MASK_THRESHOLD, self.STABILITY_SCORE_OFFSET
+            )
+            keep_idx = np.flatnonzero(keep)[batch_scores > self.stability_score_thresh]
+            batch_scores = batch_scores[batch_scores > self.stability_score_thresh]
+            if len(keep_idx) == 0:
+                continue
+
+            masks = logits[keep_idx] > MaskCreator.MASK_THRESHOLD
+            non_empty = masks.any(axis=(1, 2))
+            keep_idx = keep_idx[non_empty]
+            batch_scores = batch_scores[non_empty]
+            if len(keep_idx) == 0:
+                continue
+
+            # Encode the masks as (H, W, N) in a single copy
+            rles.extend(
+                mask_util.encode(
+                    np.asfortranarray(masks[non_empty].transpose(1, 2, 0), dtype=np.uint8)
+                )
+            )
+            pred_ious.extend(batch_ious[keep_idx].tolist())
+            stability_scores.extend(batch_scores.tolist())
+            low_res_logits.extend(batch_low_res_logits[keep_idx, 0])
+
+        keep = self.mask_nms(rles, np.array(pred_ious), self.nms_thresh)
+
+        existing_rles = [annotation["segmentation"] for annotation in annotations or []]
+        proposals = []
+        for idx in keep:
+            mask = (
+                postprocess_masks(low_res_logits[idx], image_size)
+                > MaskCreator.MASK_THRESHOLD
+            )
+            annotation = to_coco_annotation(mask)
+            if annotation["area"] < max(self.min_area, 1):
+                continue
+            if len(existing_rles) > 0:
+                ious = mask_util.iou(
+                    [annotation["segmentation"]], existing_rles, [0] * len(existing_rles)
+                )
+                if np.max(ious) > self.nms_thresh:
+                    continue
+
+            annotation["category_id"] = MaskProposer.CATEGORY_ID
+            annotation["predicted_iou"] = pred_ious[idx]
+            annotation["stability_score"] = stability_scores[idx]
+            proposals.append(annotation)
+
+        self.logger.info(
+            f"Proposed {len(proposals)} masks from {len(points)} points "
+            f"({len(rles)} passed the filters) in {time.time() - start_time:.2f} seconds"
+        )
+        return proposals
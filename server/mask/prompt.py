@@ -2,10 +2,20 @@ from typing import Dict
 
 
 class Prompt:
+    """
+    A point prompt of the decoder
+    """
+
+    NEGATIVE = 0
+    POSITIVE = 1
+
+    LABELS = [NEGATIVE, POSITIVE]
+
     def __init__(self, prompt_info: Dict):
         self.x = prompt_info["imageX"]
         self.y = prompt_info["imageY"]
         self.label = prompt_info["label"]
+        assert self.label in Prompt.LABELS, f"Invalid prompt label: {self.label}"
 
     def get_x(self):
         return self.x
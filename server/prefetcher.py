@@ -0,0 +1,115 @@
+import logging
+import threading
+import numpy as np
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+from .dataset import Dataset, Data
+
+
+class DataPrefetcher:
+    """
+    Warm the embeddings and the json payloads of the images around the
+    current image in a background thread, so that moving to the next or
+    previous image does not block on reading the embedding and encoding
+    the annotations.
+
+    The cache is bounded to the images within `radius` of the current image.
+    A payload is only used if the data is not changed since it was built.
+    """
+
+    DEFAULT_RADIUS = 2
+
+    def __init__(self, radius: int = DEFAULT_RADIUS):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.radius = radius
+
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.lock = threading.Lock()
+
+        # Key is the image idx, and the value is the prefetched entry:
+        # {"embedding": np.ndarray, "payload": Dict, "version": int}
+        self.cache: Dict[int, Dict] = OrderedDict()
+        self.pending = set()
+
+        self.dataset: Dataset = None
+        self.center_idx = 0
+
+    def reset(self, dataset: Dataset):
+        with self.lock:
+            self.dataset = dataset
+            self.cache.clear()
+            self.pending.clear()
+            self.center_idx = 0
+
+    def is_in_window(self, idx: int) -> bool:
+        return abs(idx - self.center_idx) <= self.radius
+
+    def prefetch(self, center_idx: int):
+        """
+        Drop the entries outside the window around center_idx, and schedule
+        the missing neighbours to be prefetched, nearest first.
+        """
+        with self.lock:
+            if self.dataset is None:
+                return
+            self.center_idx = center_idx
+
+            for idx in list(self.cache.keys()):
+                if not self.is_in_window(idx):
+                    del self.cache[idx]
+
+            for distance in range(1, self.radius + 1):
+                for idx in [center_idx + distance, center_idx - distance]:
+                    if idx < 0 or idx >= self.dataset.get_size():
+                        continue
+                    if idx in self.cache or idx in self.pending:
+                        continue
+                    self.pending.add(idx)
+                    self.executor.submit(self.load, self.dataset, idx)
+
+    def load(self, dataset: Dataset, idx: int):
+        try:
+            with self.lock:
+                if dataset is not self.dataset or not self.is_in_window(idx):
+                    return
+            data = dataset.get_data(idx)
+
+            # Read the version first, so that a change during the build
+            # leaves the payload stale instead of silently outdated
+            version = data.get_version()
+            embedding = np.array(data.get_embedding())
+            payload = data.to_json()
+
+            with self.lock:
+                if dataset is self.dataset and self.is_in_window(idx):
+                    self.cache[idx] = {
+                        "embedding": embedding,
+                        "payload": payload,
+                        "version": version,
+                    }
+        except Exception as e:
+            self.logger.error(f"Error prefetching data {idx}: {e}")
+        finally:
+            with self.lock:
+                self.pending.discard(idx)
+
+    def get_embedding(self, idx: int) -> np.ndarray:
+        """
+        Get the prefetched embedding, or None if it is not prefetched
+        """
+        with self.lock:
+            entry = self.cache.get(idx, None)
+            return None if entry is None else entry["embedding"]
+
+    def get_payload(self, data: Data) -> Dict:
+        """
+        Get the prefetched json payload of the data, or None if it is not
+        prefetched or the data is changed since it was prefetched
+        """
+        with self.lock:
+            entry = self.cache.get(data.get_idx(), None)
+            if entry is None or entry["version"] != data.get_version():
+                return None
+            return entry["payload"]
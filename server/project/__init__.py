@@ -3,3 +3,5 @@ from .projectExportor import ProjectExportor
 from .projectLoader import ProjectLoader
 from .projectSaver import ProjectSaver
 from .jsonImportor import JsonImportor
+from .projectJournal import ProjectJournal
+from .projectProposer import ProjectProposer
@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+import threading
+
+from typing import Dict, Tuple
+
+
+class CreationManifest:
+    """
+    Append-only record of the images that have been fully written during
+    project creation. The first line holds the settings of the creation:
+    {
+        "settings": {
+            "model_type": str,
+            "encoder_hash": str - sha256 of the encoder model file,
+            "embedding_format": str,
+        }
+    }
+    and each following line is a json object:
+    {
+        "image_hash": str - sha256 of the image file content,
+        "image_file_name": str,
+        "width": int,
+        "height": int,
+    }
+
+    The manifest lives in the creation working directory, so that an
+    interrupted creation can skip the images that are already encoded.
+    The records are discarded if the settings differ, since their
+    embeddings were created by another model or stored in another format.
+    """
+
+    FILE_NAME = "manifest.jsonl"
+
+    def __init__(self, working_dir: str, settings: Dict):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.manifest_path = os.path.join(working_dir, CreationManifest.FILE_NAME)
+        self.settings = settings
+        # Key is (image hash, image file name), since inputs with the same
+        # content may have different names
+        self.records: Dict[Tuple[str, str], Dict] = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.manifest_path):
+            stored_settings = self.read()
+            if stored_settings != self.settings:
+                self.logger.warning(
+                    f"Discarding {len(self.records)} finished images of {self.manifest_path}, "
+                    f"created with {stored_settings} instead of {self.settings}"
+                )
+                self.records = {}
+                os.remove(self.manifest_path)
+
+        if not os.path.exists(self.manifest_path):
+            self.write_line({"settings": self.settings})
+            return
+
+        self.logger.info(
+            f"Loaded {len(self.records)} finished images from {self.manifest_path}"
+        )
+
+    def read(self) -> Dict:
+        """
+        Read the records of the manifest
+
+        Returns:
+            The settings of the manifest, None if it has no settings
+        """
+        settings = None
+        with open(self.manifest_path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line == "":
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line may be incomplete if the process crashed
+                    self.logger.warning(f"Skipping corrupted manifest line: {line}")
+                    continue
+                if "settings" in record:
+                    settings = record["settings"]
+                    continue
+                self.records[self.get_key(record)] = record
+        return settings
+
+    def write_line(self, record: Dict):
+        with open(self.manifest_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def get_key(record: Dict) -> Tuple[str, str]:
+        return (record["image_hash"], record["image_file_name"])
+
+    def get(self, image_hash: str, image_file_name: str) -> Dict:
+        return self.records.get((image_hash, image_file_name), None)
+
+    def add(self, record: Dict):
+        with self.lock:
+            self.write_line(record)
+            self.records[self.get_key(record)] = record
+
+    def get_size(self) -> int:
+        return len(self.records)
@@ -0,0 +1,196 @@
+import json
+import logging
+import shutil
+import struct
+import threading
+import zipfile
+from io import BytesIO
+from typing import Dict, List
+
+import numpy as np
+
+
+class ProjectArchive:
+    """
+    Read access to the members of a .sat project file without extracting it.
+
+    The project file is a zip archive with the following structure:
+    - images/<image file>
+    - embeddings/<image name>.npy
+    - annotations/<image name>.json
+    - project_info.json
+
+    The embeddings are stored in float32, float16 or int8, see
+    util/embedding.py, and are upcast to float32 by the mask creator.
+
+    Members are read on demand. Embeddings stored without compression are
+    memory-mapped directly from the archive at the offset of their data.
+    """
+
+    IMAGE_FOLDER = "images"
+    EMBEDDING_FOLDER = "embeddings"
+    ANNOTATION_FOLDER = "annotations"
+    PROJECT_INFO_FILE = "project_info.json"
+
+    # Size of the fixed part of a zip local file header
+    LOCAL_HEADER_SIZE = 30
+
+    def __init__(self, project_path: str):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.project_path = project_path
+        self.lock = threading.Lock()
+        self.zip_file: zipfile.ZipFile = None
+        self.data_offsets: Dict[str, int] = {}
+        self.open()
+
+    def open(self):
+        """
+        (Re)open the archive, e.g. after the project file is rewritten
+        """
+        with self.lock:
+            if self.zip_file is not None:
+                self.zip_file.close()
+            self.zip_file = zipfile.ZipFile(self.project_path, "r")
+            self.data_offsets = {}
+
+    def close(self):
+        with self.lock:
+            if self.zip_file is not None:
+                self.zip_file.close()
+                self.zip_file = None
+
+    def get_project_path(self) -> str:
+        return self.project_path
+
+    @staticmethod
+    def join(*names: str) -> str:
+        """
+        Join member names. Zip members always use "/" as separator.
+        """
+        return "/".join(names)
+
+    def has(self, name: str) -> bool:
+        try:
+            self.zip_file.getinfo(name)
+            return True
+        except KeyError:
+            return False
+
+    def get_info(self, name: str) -> zipfile.ZipInfo:
+        return self.zip_file.getinfo(name)
+
+    def get_content_key(self, name: str) -> str:
+        """
+        Get a key of the content of the member from its crc32 and size in
+        the central directory, without reading the member
+        """
+        info = self.zip_file.getinfo(name)
+        return f"{info.CRC:08x}-{info.file_size:x}"
+
+    def get_infos(self) -> List[zipfile.ZipInfo]:
+        return self.zip_file.infolist()
+
+    def list_folder(self, folder: str) -> List[str]:
+        """
+        List the sorted file names directly under the given folder
+        """
+        prefix = folder + "/"
+        filenames = set()
+        for name in self.zip_file.namelist():
+            if name.startswith(prefix) and not name.endswith("/"):
+                filename = name[len(prefix) :]
+                if "/" not in filename:
+                    filenames.add(filename)
+        return sorted(filenames)
+
+    def get_central_directory_offset(self) -> int:
+        """
+        Get the offset where the member data ends and the central directory starts
+        """
+        return self.zip_file.start_dir
+
+    def get_stale_size(self) -> int:
+        """
+        Get the total size of the members that are shadowed by a newer member
+        with the same name. Incremental saves append members to the archive,
+        and the last member with a name is the one that is read.
+        """
+        latest_infos = set(
+            id(self.zip_file.getinfo(name)) for name in set(self.zip_file.namelist())
+        )
+        return sum(
+            info.compress_size
+            for info in self.zip_file.infolist()
+            if id(info) not in latest_infos
+        )
+
+    def read_bytes(self, name: str) -> bytes:
+        return self.zip_file.read(name)
+
+    def read_json(self, name: str) -> Dict:
+        with self.zip_file.open(name, "r") as f:
+            return json.load(f)
+
+    def open_member(self, name: str):
+        return self.zip_file.open(name, "r")
+
+    def extract_member(self, name: str, output_path: str):
+        """
+        Copy a single member to the output path
+        """
+        with self.zip_file.open(name, "r") as src, open(output_path, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+
+    def get_data_offset(self, name: str) -> int:
+        """
+        Get the offset of the member data in the archive file.
+        The local header may have a different extra field than the central
+        directory entry, so it is read from the file.
+        """
+        with self.lock:
+            if name in self.data_offsets:
+                return self.data_offsets[name]
+
+        info = self.zip_file.getinfo(name)
+        with open(self.project_path, "rb") as f:
+            f.seek(info.header_offset)
+            header = f.read(ProjectArchive.LOCAL_HEADER_SIZE)
+        filename_length, extra_length = struct.unpack("<HH", header[26:30])
+        offset = (
+            info.header_offset
+            + ProjectArchive.LOCAL_HEADER_SIZE
+            + filename_length
+            + extra_length
+        )
+
+        with self.lock:
+            self.data_offsets[name] = offset
+        return offset
+
+    def load_numpy(self, name: str, mmap: bool = True) -> np.ndarray:
+        """
+        Load a .npy member. If the member is stored without compression,
+        it is memory-mapped from the archive, otherwise it is read into memory.
+        """
+        info = self.zip_file.getinfo(name)
+        if not mmap or info.compress_type != zipfile.ZIP_STORED:
+            return np.load(BytesIO(self.zip_file.read(name)))
+
+        offset = self.get_data_offset(name)
+        with open(self.project_path, "rb") as f:
+            f.seek(offset)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            array_offset = f.tell()
+
+        return np.memmap(
+            self.project_path,
+            dtype=dtype,
+            mode="r",
+            offset=array_offset,
+            shape=shape,
+            order="F" if fortran_order else "C",
+        )
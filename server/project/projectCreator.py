@@ -1,5 +1,7 @@
+import base64
 import logging
 import os
+import queue
 import threading
 import time
 import eel
@@ -8,11 +10,24 @@ import zipfile
 import shutil
 import tempfile
 
-from ..util.general import decode_image_url
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Callable, Dict, Tuple
+
+from ..util.general import (
+    remove_image_url_header,
+    compute_bytes_hash,
+    compute_file_hash,
+)
+from ..util.onnx import create_input_buffer, preprocess_images, resize_image
+from ..util.embedding import EMBEDDING_FORMATS, FLOAT32, encode_embedding
 from ..util.json import save_json
 from ..embedding import EmbeddingGenerator
 from PIL import Image
 from ..util.requests import ProjectCreateRequest
+from .creationManifest import CreationManifest
+from .projectJournal import ProjectJournal
 
 from ..jsonFormat import (
     ImageJson,
@@ -28,6 +43,24 @@ class ProjectCreator:
     SAM_ENCODER_PATH = "models/vit_h_encoder_quantized.onnx"
     SAM_MODEL_TYPE = "vit_b"
 
+    DEFAULT_NUM_WORKERS = 4
+    DEFAULT_BATCH_SIZE = 4
+    DEFAULT_EMBEDDING_FORMAT = FLOAT32
+
+    # Images in these formats are copied into the project as they are, other
+    # images are converted to PNG
+    BROWSER_IMAGE_FORMATS = {
+        ".jpg": "JPEG",
+        ".jpeg": "JPEG",
+        ".png": "PNG",
+        ".gif": "GIF",
+        ".webp": "WEBP",
+        ".bmp": "BMP",
+    }
+    CONVERTED_IMAGE_EXTENSION = ".png"
+    EXIF_ORIENTATION_TAG = 0x0112
+    QUEUE_TIMEOUT = 0.1
+
     TEMP_PROJECT_FILE = os.path.join(
         tempfile.gettempdir(), "SAT", "temp_project.sat"
     )
@@ -56,11 +89,24 @@ class ProjectCreator:
         self,
         request: ProjectCreateRequest,
         frontend_enabled: bool = True,
-    ):
+        progress_callback: Callable[[int, int], None] = None,
+    ) -> Dict:
         """
         Create a proejct from the request. The project data will be stored in a zip file with .coral extension.
+
+        Args:
+            request: The project create request
+            frontend_enabled: Whether to report the progress and the status to the frontend
+            progress_callback: Called with (number of processed images, total) after each image
+
+        Returns:
+            The creation status
+            {
+                "finished": bool,
+                "project_path": str  # only if finished
+            }
         """
-        inputs = request.get_inputs()
+        inputs = [self.get_project_input(input) for input in request.get_inputs()]
         inputs = sorted(inputs, key=lambda x: x["image_file_name"])
 
         output_file = request.get_output_file()
@@ -72,11 +118,20 @@ class ProjectCreator:
         if os.path.exists(output_file):
             os.remove(output_file)
 
+        # The journal of a previous project at the same path must not be
+        # replayed on the new project
+        journal_path = ProjectJournal.get_journal_path(output_file)
+        if os.path.exists(journal_path):
+            os.remove(journal_path)
+
         output_dir = os.path.dirname(output_file)
 
-        # Temporary folders for storing images, embeddings, annotations, and project info
+        # Temporary folders for storing images, embeddings, annotations, and project info.
+        # In resume mode, the folder of an interrupted creation is kept, so that
+        # the images listed in its manifest are not encoded again.
+        resume = request.get_resume()
         output_temp_dir = os.path.join(output_dir, TEMP_CREATE_NAME)
-        if os.path.exists(output_temp_dir):
+        if os.path.exists(output_temp_dir) and not resume:
             shutil.rmtree(output_temp_dir)
         os.makedirs(output_temp_dir, exist_ok=True)
 
@@ -91,99 +146,241 @@ class ProjectCreator:
 
         project_info_path = os.path.join(output_temp_dir, "project_info.json")
 
-        # Update process in the frontend
+        embedding_format = request.get_embedding_format(
+            ProjectCreator.DEFAULT_EMBEDDING_FORMAT
+        )
+        assert (
+            embedding_format in EMBEDDING_FORMATS
+        ), f"Invalid embedding format: {embedding_format}"
+
+        # The finished images of an interrupted creation are only reused if
+        # their embeddings come from the same model in the same format
+        manifest = CreationManifest(
+            output_temp_dir,
+            {
+                "model_type": self.embeddings_generator.model_type,
+                "encoder_hash": self.embeddings_generator.get_encoder_hash(),
+                "embedding_format": embedding_format,
+            },
+        )
 
+        # Update process in the frontend
         if frontend_enabled:
             eel.updateProgressPercentage(0)
 
-        terminated = False
-        for idx, input in enumerate(inputs):
-            image_filename = input["image_file_name"]
-            filename = os.path.splitext(image_filename)[0]
-
-            self.logger.info(f"Processing input {idx + 1} of {len(inputs)}")
-            self.logger.info(f"Processing image: {image_filename}")
-
-            start_time = time.time()
-            self.logger.info(f"Processing image {image_filename} ...")
-
-            # Create image
-            if "image_path" in input:
-                image_path = input["image_path"]
-                image = Image.open(image_path)
-                image = image.convert("RGB")
-                image = np.array(image)
-            else:
-                image_url = input["image_url"]
-                image = decode_image_url(image_url)
-
-            if self.stop_event.is_set():
-                self.logger.info("Project creation stopped.")
-                terminated = True
-                break
-
-            # Generate embedding
-            embedding = self.embeddings_generator.generate_embedding(image)
-            if self.stop_event.is_set():
-                self.logger.info("Project creation stopped.")
-                terminated = True
-                break
-
-            # Generate annotations
-            annotation_file_json = AnnotationFileJson()
-
-            image_json = ImageJson()
-            image_json.set_id(idx)
-            image_json.set_filename(image_filename)
-            image_json.set_width(image.shape[1])
-            image_json.set_height(image.shape[0])
-            annotation_file_json.add_image(image_json)
-
-            end_time = time.time()
-            self.logger.info(f"Processed image in {end_time - start_time:.2f} seconds")
-
-            # Check if the stop event is set
-            if image is None or embedding is None:
-                terminated = True
-                break
-
-            image_path = os.path.join(image_folder, image_filename)
-            embedding_path = os.path.join(embedding_folder, f"{filename}.npy")
-            annotation_path = os.path.join(annotation_folder, f"{filename}.json")
-
-            np.save(embedding_path, embedding)
-            save_json(annotation_file_json.to_json(), annotation_path)
-            Image.fromarray(image).save(image_path)
-
-            process_percentage = (idx + 1) / len(inputs) * 100
-            process_percentage = int(process_percentage)
+        num_workers = request.get_num_workers(ProjectCreator.DEFAULT_NUM_WORKERS)
+        batch_size = request.get_batch_size(ProjectCreator.DEFAULT_BATCH_SIZE)
+        self.logger.info(
+            f"Creating project with {num_workers} decode workers, batch size {batch_size} "
+            f"and {embedding_format} embeddings"
+        )
 
-            if frontend_enabled:
-                eel.updateProgressPercentage(process_percentage)
+        # The three stages (decode, encode, write) are joined by bounded
+        # queues, so that at most a few batches of images are held in memory.
+        decode_queue = queue.Queue(maxsize=batch_size * 2)
+        write_queue = queue.Queue(maxsize=batch_size * 2)
+        abort_event = threading.Event()
+
+        def should_stop() -> bool:
+            return self.stop_event.is_set() or abort_event.is_set()
+
+        def put(target_queue: queue.Queue, item) -> bool:
+            while not should_stop():
+                try:
+                    target_queue.put(item, timeout=ProjectCreator.QUEUE_TIMEOUT)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get(source_queue: queue.Queue):
+            while not should_stop():
+                try:
+                    return source_queue.get(timeout=ProjectCreator.QUEUE_TIMEOUT)
+                except queue.Empty:
+                    continue
+            return None
+
+        def decode_stage():
+            try:
+                with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                    # Keep a sliding window of pending futures so that results
+                    # are queued in input order without decoding everything at once.
+                    pending = deque()
+                    for idx, input in enumerate(inputs):
+                        if should_stop():
+                            break
+                        future = executor.submit(
+                            self.load_input,
+                            idx,
+                            input,
+                            manifest,
+                            image_folder,
+                            embedding_folder,
+                        )
+                        pending.append(future)
+                        if len(pending) >= num_workers * 2:
+                            if not put(decode_queue, pending.popleft().result()):
+                                break
+                    while pending and not should_stop():
+                        if not put(decode_queue, pending.popleft().result()):
+                            break
+                    for future in pending:
+                        future.cancel()
+            except Exception as e:
+                self.logger.error(f"Error decoding images: {e}")
+                abort_event.set()
+            put(decode_queue, None)
+
+        def write_stage():
+            processed_count = 0
+            try:
+                while True:
+                    item = get(write_queue)
+                    if item is None:
+                        break
+                    input = item["input"]
+                    record = item["record"]
+                    if record is None:
+                        self.write_output(
+                            item["idx"],
+                            input,
+                            item["width"],
+                            item["height"],
+                            encode_embedding(item["embedding"], embedding_format),
+                            item["image"],
+                            image_folder,
+                            embedding_folder,
+                            annotation_folder,
+                        )
+                        manifest.add(
+                            {
+                                "image_hash": item["image_hash"],
+                                "image_file_name": input["image_file_name"],
+                                "width": item["width"],
+                                "height": item["height"],
+                            }
+                        )
+                    else:
+                        # The image and embedding are already on disk, only the
+                        # annotation file depends on the image index.
+                        self.write_annotation(
+                            item["idx"],
+                            input["image_file_name"],
+                            record["width"],
+                            record["height"],
+                            annotation_folder,
+                        )
+
+                    processed_count += 1
+                    process_percentage = processed_count / len(inputs) * 100
+                    process_percentage = int(process_percentage)
+
+                    if frontend_enabled:
+                        eel.updateProgressPercentage(process_percentage)
+                    if progress_callback is not None:
+                        progress_callback(processed_count, len(inputs))
+            except Exception as e:
+                self.logger.error(f"Error writing project files: {e}")
+                abort_event.set()
+
+        decode_thread = threading.Thread(target=decode_stage)
+        write_thread = threading.Thread(target=write_stage)
+        decode_thread.start()
+        write_thread.start()
+
+        # Encode stage, batching the decoded images for the encoder.
+        # The decode workers only resize the images, which are 4 times smaller
+        # in uint8 than the normalized float32 input.
+        input_buffer = create_input_buffer(batch_size)
+        finished = False
+        try:
+            while not finished and not should_stop():
+                batch = []
+                while len(batch) < batch_size:
+                    item = get(decode_queue)
+                    if item is None:
+                        finished = True
+                        break
+                    batch.append(item)
+
+                if len(batch) == 0 or should_stop():
+                    break
+
+                # Only the images not found in the manifest or the embedding
+                # cache need to be encoded
+                start_time = time.time()
+                to_encode = [
+                    item
+                    for item in batch
+                    if item["record"] is None and item["embedding"] is None
+                ]
+                # The resized images are normalized into the reused input buffer
+                input_batch = preprocess_images(
+                    [item["resized_image"] for item in to_encode], input_buffer
+                )
+                embeddings = self.embeddings_generator.generate_embeddings(
+                    input_batch,
+                    [item["image_hash"] for item in to_encode],
+                )
+                for item, embedding in zip(to_encode, embeddings):
+                    item["embedding"] = embedding
+                    item["resized_image"] = None
+                self.logger.info(
+                    f"Processed {len(to_encode)} images in {time.time() - start_time:.2f} seconds"
+                )
+
+                for item in batch:
+                    if not put(write_queue, item):
+                        break
+        except Exception as e:
+            self.logger.error(f"Error generating embeddings: {e}")
+            abort_event.set()
+
+        put(write_queue, None)
+        decode_thread.join()
+        write_thread.join()
+
+        terminated = should_stop()
+        if self.stop_event.is_set():
+            self.logger.info("Project creation stopped.")
 
         if terminated:
-            # If the process is terminated, clear the temporary folder and return
-            # self.clear_temp_folder(output_dir)
-            shutil.rmtree(output_temp_dir)
+            # If the process is terminated, clear the temporary folder and return.
+            # In resume mode the finished images are kept for the next run.
+            if resume:
+                self.logger.info(
+                    f"Keeping {manifest.get_size()} finished images in {output_temp_dir}"
+                )
+            else:
+                shutil.rmtree(output_temp_dir)
             status = {}
             status["finished"] = False
 
             if frontend_enabled:
                 eel.afterProjectCreation(status)
-            return
+            return status
 
         project_info_json = ProjectInfoJson()
         project_info_json.set_last_image_idx(0)
         save_json(project_info_json.to_json(), project_info_path)
 
+        # Only archive the files of the requested inputs, the working folder
+        # may still contain images of an earlier interrupted creation.
         project_path = output_file
         with zipfile.ZipFile(project_path, "w") as archive:
-            for root, _, files in os.walk(output_temp_dir):
-                for file in files:
+            for input in inputs:
+                image_filename = input["image_file_name"]
+                filename = os.path.splitext(image_filename)[0]
+                for relative_path in [
+                    os.path.join("images", image_filename),
+                    os.path.join("embeddings", f"{filename}.npy"),
+                    os.path.join("annotations", f"{filename}.json"),
+                ]:
                     archive.write(
-                        os.path.join(root, file),
-                        os.path.relpath(os.path.join(root, file), output_temp_dir),
+                        os.path.join(output_temp_dir, relative_path), relative_path
                     )
+            archive.write(project_info_path, "project_info.json")
 
         if os.path.exists(output_temp_dir):
             shutil.rmtree(output_temp_dir)
@@ -194,11 +391,189 @@ class ProjectCreator:
 
         if frontend_enabled:
             eel.afterProjectCreation(status)
+        return status
+
+    def load_input(
+        self,
+        idx: int,
+        input: Dict,
+        manifest: CreationManifest,
+        image_folder: str,
+        embedding_folder: str,
+    ) -> Dict:
+        """
+        Hash the input image and decode it if it is not finished yet.
+        If the embedding of the image is in the embedding cache, the image
+        is not preprocessed for the encoder. The decoded image is kept only
+        if it is encoded again into the project, since the source files of
+        the other images are copied as they are, so that mostly the resized
+        images are held in the queues.
+
+        Returns:
+        {
+            "idx": int,
+            "input": Dict,
+            "image_hash": str - The content hash of the image,
+            "width": int - Width of the image, None if already finished,
+            "height": int - Height of the image, None if already finished,
+            "image": np.ndarray - The decoded image if the source file is not copied, otherwise None,
+            "resized_image": np.ndarray - The image resized for the encoder, None if not needed,
+            "embedding": np.ndarray - The cached embedding, otherwise None,
+            "record": Dict - The manifest record if already finished, otherwise None,
+        }
+        """
+        item = {
+            "idx": idx,
+            "input": input,
+            "image_hash": None,
+            "width": None,
+            "height": None,
+            "image": None,
+            "resized_image": None,
+            "embedding": None,
+            "record": None,
+        }
+
+        image_filename = input["image_file_name"]
+        filename = os.path.splitext(image_filename)[0]
+
+        if "image_path" in input:
+            image_hash = compute_file_hash(input["image_path"])
+        else:
+            image_hash = compute_bytes_hash(
+                base64.b64decode(remove_image_url_header(input["image_url"]))
+            )
+
+        record = manifest.get(image_hash, image_filename)
+        if (
+            record is not None
+            and os.path.exists(os.path.join(image_folder, image_filename))
+            and os.path.exists(os.path.join(embedding_folder, f"{filename}.npy"))
+        ):
+            self.logger.info(f"Skipping finished image: {image_filename}")
+            item["image_hash"] = image_hash
+            item["record"] = record
+            return item
+
+        item["image_hash"] = image_hash
+        image, copy_source = self.decode_input(input)
+        item["height"], item["width"] = image.shape[:2]
+        if not copy_source:
+            item["image"] = image
+        item["embedding"] = self.embeddings_generator.get_cached_embedding(image_hash)
+        if item["embedding"] is not None:
+            self.logger.info(f"Found cached embedding for image: {image_filename}")
+        else:
+            item["resized_image"] = resize_image(Image.fromarray(image))
+        return item
+
+    def get_project_input(self, input: Dict) -> Dict:
+        """
+        Get the input with the file name of the image in the project. Images
+        that browsers cannot show are converted to PNG, keeping the name.
+        """
+        name, extension = os.path.splitext(input["image_file_name"])
+        if extension.lower() in ProjectCreator.BROWSER_IMAGE_FORMATS:
+            return input
+        input = dict(input)
+        input["image_file_name"] = name + ProjectCreator.CONVERTED_IMAGE_EXTENSION
+        return input
+
+    def decode_input(self, input: Dict) -> Tuple[np.ndarray, bool]:
+        """
+        Decode the input image into a RGB numpy array
+
+        Returns:
+            (the decoded image,
+             whether the source file can be copied into the project as it is)
+        """
+        if "image_path" in input:
+            image = Image.open(input["image_path"])
+        else:
+            image = Image.open(
+                BytesIO(base64.b64decode(remove_image_url_header(input["image_url"])))
+            )
+        copy_source = self.is_browser_readable(image, input["image_file_name"])
+        image = np.array(image.convert("RGB"))
+        return image, copy_source
+
+    def is_browser_readable(self, image: Image.Image, image_filename: str) -> bool:
+        """
+        Check if browsers show the source file of the image as it is decoded,
+        i.e. it is in the format of its file name and it is not rotated by
+        its EXIF orientation. The masks are created on the decoded image.
+        """
+        extension = os.path.splitext(image_filename)[1].lower()
+        if image.format != ProjectCreator.BROWSER_IMAGE_FORMATS.get(extension):
+            return False
+        orientation = image.getexif().get(ProjectCreator.EXIF_ORIENTATION_TAG, 1)
+        return orientation == 1
+
+    def write_output(
+        self,
+        idx: int,
+        input: Dict,
+        width: int,
+        height: int,
+        embedding: np.ndarray,
+        image: np.ndarray,
+        image_folder: str,
+        embedding_folder: str,
+        annotation_folder: str,
+    ):
+        """
+        Write the image, embedding in its storage format and the empty
+        annotation file of one input. The decoded image is encoded in the
+        format of its file name if it is given, otherwise the source file of
+        the image is copied byte for byte.
+        """
+        image_filename = input["image_file_name"]
+        filename = os.path.splitext(image_filename)[0]
+
+        image_path = os.path.join(image_folder, image_filename)
+        embedding_path = os.path.join(embedding_folder, f"{filename}.npy")
+
+        np.save(embedding_path, embedding)
+        if image is not None:
+            Image.fromarray(image).save(image_path)
+        elif "image_path" in input:
+            shutil.copyfile(input["image_path"], image_path)
+        else:
+            with open(image_path, "wb") as f:
+                f.write(base64.b64decode(remove_image_url_header(input["image_url"])))
+        self.write_annotation(idx, image_filename, width, height, annotation_folder)
+
+    def write_annotation(
+        self,
+        idx: int,
+        image_filename: str,
+        width: int,
+        height: int,
+        annotation_folder: str,
+    ):
+        """
+        Write the empty annotation file of one image
+        """
+        filename = os.path.splitext(image_filename)[0]
+
+        # Generate annotations
+        annotation_file_json = AnnotationFileJson()
+
+        image_json = ImageJson()
+        image_json.set_id(idx)
+        image_json.set_filename(image_filename)
+        image_json.set_width(width)
+        image_json.set_height(height)
+        annotation_file_json.add_image(image_json)
+
+        annotation_path = os.path.join(annotation_folder, f"{filename}.json")
+        save_json(annotation_file_json.to_json(), annotation_path)
 
     def create(
         self,
         request: ProjectCreateRequest,
         frontend_enabled: bool = True,
+        progress_callback: Callable[[int, int], None] = None,
     ):
         """
         Create a project from the request. A threading process will be created to handle user termination.
@@ -209,10 +584,13 @@ class ProjectCreator:
 
         self.stop_event.clear()
         self.worker_thread = threading.Thread(
-            target=self.create_, args=(request, frontend_enabled)
+            target=self.create_, args=(request, frontend_enabled, progress_callback)
         )
         self.worker_thread.start()
 
+    def is_running(self) -> bool:
+        return self.worker_thread is not None and self.worker_thread.is_alive()
+
     def terminate(self):
         """
         Terminate the current project creation process.
@@ -1,12 +1,12 @@
 import logging
 import os
-import shutil
+import threading
 
-from ..util.general import decode_image_url
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from ..util.json import save_json
 from ..dataset import Dataset
-from PIL import Image
-from ..util.data import unzip_file
+from ..annotationRenderer import AnnotationRenderer
+from .projectArchive import ProjectArchive
 
 from ..jsonFormat import (
     ImageJson,
@@ -15,9 +15,39 @@ from ..jsonFormat import (
     COCOJson,
 )
 
-from typing import Dict, List
+from typing import Callable, Dict, List, Tuple
 
-TEMP_LOAD_NAME = "__coralscop_lat_temp_load"
+
+# Project archive and renderer of a render worker process, created once per
+# process by init_render_worker instead of once per image
+worker_archive: ProjectArchive = None
+worker_renderer: AnnotationRenderer = None
+
+
+def init_render_worker(project_path: str, mask_opacity: float):
+    global worker_archive, worker_renderer
+    worker_archive = ProjectArchive(project_path)
+    worker_renderer = AnnotationRenderer(mask_opacity)
+
+
+def render_annotated_image(task: Tuple[str, List[Dict], str]) -> str:
+    """
+    Render the annotations of an image from the project archive and save
+    the annotated image. Runs in a render worker process.
+
+    Args:
+        task: (image name, annotations, output path)
+
+    Returns:
+        The image name
+    """
+    image_name, annotations, output_path = task
+    image_bytes = worker_archive.read_bytes(
+        ProjectArchive.join(ProjectArchive.IMAGE_FOLDER, image_name)
+    )
+    annotated_image = worker_renderer.render_bytes(image_bytes, annotations)
+    annotated_image.save(output_path)
+    return image_name
 
 
 class ProjectExportor:
@@ -29,43 +59,112 @@ class ProjectExportor:
         self.project_path = project_path
 
     def export_images(self, output_dir: str):
-        project_folder = os.path.dirname(self.project_path)
-
-        # Extract the project files
-        temp_dir = os.path.join(project_folder, TEMP_LOAD_NAME)
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-        unzip_file(self.project_path, temp_dir)
-
         # Create images folder
         image_folder = os.path.join(output_dir, "images")
         os.makedirs(image_folder, exist_ok=True)
 
-        # Copy the images to the images folder
-        project_image_folder = os.path.join(temp_dir, "images")
-        for image_name in os.listdir(project_image_folder):
-            image_path = os.path.join(project_image_folder, image_name)
-            shutil.copy(image_path, image_folder)
-
-        # Remove the temporary folder
-        shutil.rmtree(temp_dir)
-
-    def export_annotated_images(self, output_dir: str, data_list: List[Dict]):
+        # Copy the images from the project archive to the images folder
+        archive = ProjectArchive(self.project_path)
+        try:
+            for image_name in archive.list_folder(ProjectArchive.IMAGE_FOLDER):
+                archive.extract_member(
+                    ProjectArchive.join(ProjectArchive.IMAGE_FOLDER, image_name),
+                    os.path.join(image_folder, image_name),
+                )
+        finally:
+            archive.close()
+
+    def export_annotated_images(
+        self,
+        output_dir: str,
+        dataset: Dataset,
+        mask_opacity: float = AnnotationRenderer.DEFAULT_MASK_OPACITY,
+        num_workers: int = None,
+        progress_callback: Callable[[int, int], None] = None,
+        stop_event: threading.Event = None,
+    ) -> bool:
         """
+        Render the annotations onto the images and save them to the
+        annotated_images folder. The images are rendered in a process pool.
+
         Params:
         - output_dir: The output directory
-        - data: The list of data of the image, which is a dict
-        {
-            "image_name": str,
-            "encoded_image": str,
-        }
+        - dataset: The dataset with the annotations to render
+        - mask_opacity: Opacity of the masks
+        - num_workers: Number of render processes. Default is the number of CPUs.
+          With 1 worker, the images are rendered in the current process.
+        - progress_callback: Called with (number of rendered images, total)
+        - stop_event: When set, the images that are not rendered yet are skipped
+
+        Returns:
+            Whether all the images are rendered
         """
         output_annotated_image_folder = os.path.join(output_dir, "annotated_images")
         os.makedirs(output_annotated_image_folder, exist_ok=True)
-        for data in data_list:
-            image = decode_image_url(data["encoded_image"])
-            image = Image.fromarray(image)
-            image.save(os.path.join(output_annotated_image_folder, data["image_name"]))
+
+        tasks = []
+        for data in dataset.get_data_list():
+            annotations = [
+                {
+                    "segmentation": annotation["segmentation"],
+                    "category_id": annotation["category_id"],
+                }
+                for annotation in data.get_segmentation()["annotations"]
+            ]
+            output_path = os.path.join(
+                output_annotated_image_folder, data.get_image_name()
+            )
+            tasks.append((data.get_image_name(), annotations, output_path))
+
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        num_workers = max(min(num_workers, len(tasks)), 1)
+        self.logger.info(
+            f"Rendering {len(tasks)} annotated images with {num_workers} workers"
+        )
+
+        def should_stop() -> bool:
+            return stop_event is not None and stop_event.is_set()
+
+        if num_workers == 1:
+            init_render_worker(self.project_path, mask_opacity)
+            try:
+                for idx, task in enumerate(tasks):
+                    if should_stop():
+                        self.logger.info(f"Export stopped after {idx} images")
+                        return False
+                    render_annotated_image(task)
+                    if progress_callback is not None:
+                        progress_callback(idx + 1, len(tasks))
+            finally:
+                worker_archive.close()
+            return True
+
+        with ProcessPoolExecutor(
+            max_workers=num_workers,
+            initializer=init_render_worker,
+            initargs=(self.project_path, mask_opacity),
+        ) as executor:
+            futures = [
+                executor.submit(render_annotated_image, task) for task in tasks
+            ]
+            try:
+                for idx, future in enumerate(as_completed(futures)):
+                    future.result()
+                    if progress_callback is not None:
+                        progress_callback(idx + 1, len(tasks))
+                    if should_stop():
+                        # The images being rendered are finished when the
+                        # pool shuts down
+                        self.logger.info(f"Export stopped after {idx + 1} images")
+                        for future in futures:
+                            future.cancel()
+                        return False
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        return True
 
     def is_file_path(self, path: str) -> bool:
         # Check if the path looks like a file (e.g., has an extension)
@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+import threading
+
+from typing import Dict, List
+from ..dataset import Dataset
+
+
+class ProjectJournal:
+    """
+    Append-only journal of the annotation edits that are not yet saved to
+    the project file. It is stored next to the project file, and each line
+    is a json record:
+    {
+        "image_id": int,
+        "segmentation": {
+            "images": List[Dict],
+            "annotations": List[Dict] - Annotations with COCO RLE segmentation
+        },
+        "category_info": List[Dict],
+    }
+
+    or a record of the segmentations of all the images, e.g. after an
+    import, which supersedes all the records before it:
+    {
+        "images": List[Dict] - Records of each image, with the image_id and
+            segmentation keys as above,
+        "category_info": List[Dict],
+    }
+
+    The journal is replayed when the project is loaded, and cleared once
+    the project is fully saved.
+    """
+
+    SUFFIX = ".journal"
+
+    def __init__(self, project_path: str):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.journal_path = ProjectJournal.get_journal_path(project_path)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_journal_path(project_path: str) -> str:
+        return project_path + ProjectJournal.SUFFIX
+
+    def get_path(self) -> str:
+        return self.journal_path
+
+    def append(self, image_id: int, segmentation: Dict, category_info: List[Dict]):
+        record = {
+            "image_id": image_id,
+            "segmentation": segmentation,
+            "category_info": category_info,
+        }
+        line = json.dumps(record, separators=(",", ":"))
+        with self.lock:
+            with open(self.journal_path, "a") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def reset(self, segmentations: Dict[int, Dict], category_info: List[Dict]):
+        """
+        Replace the journal with a single record of the segmentations of all
+        the images, keyed by image id. The journal is written to a temporary
+        file first, so that a crash keeps either the old or the new journal.
+        """
+        record = {
+            "images": [
+                {"image_id": image_id, "segmentation": segmentation}
+                for image_id, segmentation in segmentations.items()
+            ],
+            "category_info": category_info,
+        }
+        line = json.dumps(record, separators=(",", ":"))
+        temp_path = self.journal_path + ".tmp"
+        with self.lock:
+            with open(temp_path, "w") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.journal_path)
+
+    def replay(self, dataset: Dataset) -> int:
+        """
+        Apply the journal records to the dataset in order.
+
+        Returns:
+        - int: Number of records applied
+        """
+        if not os.path.exists(self.journal_path):
+            return 0
+
+        applied_count = 0
+        with self.lock, open(self.journal_path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line == "":
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line may be incomplete if the process crashed
+                    self.logger.warning(f"Skipping corrupted journal record")
+                    continue
+
+                image_records = record.get("images", [record])
+                for image_record in image_records:
+                    self.apply_image_record(dataset, image_record)
+                if record["category_info"] is not None:
+                    dataset.set_category_info(record["category_info"])
+                applied_count += 1
+
+        self.logger.info(f"Replayed {applied_count} records from {self.journal_path}")
+        return applied_count
+
+    def apply_image_record(self, dataset: Dataset, record: Dict):
+        # Skip records that do not belong to this project, e.g. when
+        # the project file is replaced by a new project
+        image_id = record["image_id"]
+        if not dataset.has_data(image_id):
+            self.logger.warning(f"Skipping journal record of image {image_id}")
+            return
+        data = dataset.get_data(image_id)
+        image_name = record["segmentation"]["images"][0]["file_name"]
+        if image_name != data.get_image_name():
+            self.logger.warning(f"Skipping journal record of {image_name}")
+            return
+        dataset.update_data(image_id, record["segmentation"])
+
+    def clear(self):
+        with self.lock:
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
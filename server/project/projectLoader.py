@@ -1,27 +1,19 @@
 import logging
 import os
-import shutil
 import time
-import zipfile
 from typing import Dict, List, Tuple, Union
 
-import numpy as np
-from PIL import Image
-
 from ..dataset import Data, Dataset
-from ..util.general import get_resource_path
-from ..util.json import load_json
+from .projectArchive import ProjectArchive
 from .projectCreator import ProjectCreator
-
-TEMP_CREATE_NAME = "__coralscop_lat_temp"
-TEMP_CREATE_NAME_2 = "__coralscop_lat_temp_2"
-TEMP_LOAD_NAME = "__coralscop_lat_temp_load"
+from .projectJournal import ProjectJournal
 
 
 class ProjectLoader:
 
-    WEB_FOLDER_NAME = "web"
-    ASSET_FOLDER = "assets/images"
+    # Route of the images served from the project archive, see
+    # Server.get_image_response
+    IMAGE_ROUTE = "project_images"
 
     def __init__(self):
         self.logger = logging.getLogger(self.__class__.__name__)
@@ -29,6 +21,8 @@ class ProjectLoader:
     def load(self, project_path: str) -> Union[Dataset, int]:
         """
         Load a project from the given project path.
+        Nothing is copied, the front end reads the images from the project
+        archive through the image route.
 
         Returns:
         - Dataset: The loaded dataset
@@ -44,105 +38,63 @@ class ProjectLoader:
 
         self.logger.info(f"Loading project from {project_path}")
 
-        # Unzip the project file
-        start_time = time.time()
-        temp_output_dir = os.path.join(os.path.dirname(project_path), TEMP_LOAD_NAME)
-        with zipfile.ZipFile(project_path, "r") as archive:
-            archive.extractall(temp_output_dir)
-        self.logger.info(f"Unzipped project in {time.time() - start_time} seconds")
-
-        # Load data from the project folder
+        # Open the project file. Only the annotations and the project info are
+        # read here, the images and embeddings are read on demand.
         start_time = time.time()
-        dataset = Dataset()
-
-        image_folder = os.path.join(temp_output_dir, "images")
-        embedding_folder = os.path.join(temp_output_dir, "embeddings")
-        annotation_folder = os.path.join(temp_output_dir, "annotations")
-        project_info_path = os.path.join(temp_output_dir, "project_info.json")
+        archive = ProjectArchive(project_path)
 
-        image_filenames = os.listdir(image_folder)
-        image_filenames = sorted(image_filenames)
+        image_filenames = archive.list_folder(ProjectArchive.IMAGE_FOLDER)
         filenames = [os.path.splitext(filename)[0] for filename in image_filenames]
 
-        # Move the images files to the assets folder
-        image_files = [
-            os.path.join(image_folder, filename)
-            for filename in os.listdir(image_folder)
-        ]
-        asset_image_paths = self.store_image(image_files)
-        asset_image_paths = sorted(asset_image_paths)
-
         # Construct dataset
         dataset = Dataset()
+        dataset.set_archive(archive)
         for idx, filename in enumerate(filenames):
-            embedding_path = os.path.join(embedding_folder, f"{filename}.npy")
-            annotation_path = os.path.join(annotation_folder, f"{filename}.json")
+            embedding_name = ProjectArchive.join(
+                ProjectArchive.EMBEDDING_FOLDER, f"{filename}.npy"
+            )
+            annotation_name = ProjectArchive.join(
+                ProjectArchive.ANNOTATION_FOLDER, f"{filename}.json"
+            )
 
             data = Data()
             data.set_image_name(image_filenames[idx])
-            data.set_image_path(asset_image_paths[idx])
+            data.set_image_path(self.get_image_url(archive, image_filenames[idx]))
 
-            embedding = np.load(embedding_path)
-            data.set_embedding(embedding)
+            data.set_archive(archive)
+            data.set_embedding_path(embedding_name)
 
-            if os.path.exists(annotation_path):
-                annotations = load_json(annotation_path)
+            if archive.has(annotation_name):
+                annotations = archive.read_json(annotation_name)
                 data.set_segmentation(annotations)
 
             data.set_idx(idx)
             dataset.add_data(data)
 
         # Load project info
-        project_info = load_json(project_info_path)
+        project_info = archive.read_json(ProjectArchive.PROJECT_INFO_FILE)
         last_image_idx = project_info["last_image_idx"]
         category_info = project_info["category_info"]
         dataset.set_category_info(category_info)
 
-        # Delete the temporary folder
-        shutil.rmtree(temp_output_dir)
+        # Nothing is changed right after loading
+        dataset.clear_dirty()
+
+        # Apply the edits that were not saved to the project file before.
+        # The replayed data stay dirty until the project is saved.
+        ProjectJournal(project_path).replay(dataset)
 
         self.logger.info(f"Project loaded in {time.time() - start_time} seconds")
 
         return dataset, last_image_idx
 
-    def store_image(self, image_paths: List[str]) -> List[str]:
-        """
-        Store images to the assest folder for front end to access.
-
-        Returns:
-        - List[str]: List of relative image paths in the asset folder
-        """
-        self.clear_asset_folder()
-        asset_folder = os.path.join(
-            ProjectLoader.WEB_FOLDER_NAME, ProjectLoader.ASSET_FOLDER
-        )
-        os.makedirs(get_resource_path(asset_folder), exist_ok=True)
-
-        assset_image_paths = []
-        for image_path in image_paths:
-            image = Image.open(image_path)
-
-            save_path = os.path.join(asset_folder, os.path.basename(image_path))
-            save_path = get_resource_path(save_path)
-            image.save(save_path)
-
-            asset_image_path = os.path.join(
-                ProjectLoader.ASSET_FOLDER, os.path.basename(image_path)
-            )
-            assset_image_paths.append(asset_image_path)
-
-        return assset_image_paths
-
-    def clear_asset_folder(self):
+    def get_image_url(self, archive: ProjectArchive, image_filename: str) -> str:
         """
-        Clear the asset folder
+        Get the url of the image relative to the front end pages. The url
+        contains the content key of the image, so that the browser can cache
+        it until the image changes.
         """
-        asset_folder = os.path.join(
-            ProjectLoader.WEB_FOLDER_NAME, ProjectLoader.ASSET_FOLDER
+        content_key = archive.get_content_key(
+            ProjectArchive.join(ProjectArchive.IMAGE_FOLDER, image_filename)
         )
-        if os.path.exists(asset_folder):
-            # Delete all the files in the folder
-            for filename in os.listdir(asset_folder):
-                file_path = os.path.join(asset_folder, filename)
-                file_path = get_resource_path(file_path)
-                os.remove(file_path)
+        return "/".join([ProjectLoader.IMAGE_ROUTE, content_key, image_filename])
@@ -0,0 +1,191 @@
+import copy
+import logging
+import os
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from ..dataset import Dataset, Data
+from ..mask.maskCreator import MaskCreator
+from ..mask.maskProposer import MaskProposer
+from ..sessionConfig import SessionConfig
+from ..util.coco import is_rel_encoding
+from .projectArchive import ProjectArchive
+
+from typing import Callable, Dict, List, Tuple
+
+
+# Project archive and mask proposer of a propose worker process, created once
+# per process by init_propose_worker instead of once per image
+worker_archive: ProjectArchive = None
+worker_proposer: MaskProposer = None
+
+
+def init_propose_worker(
+    project_path: str,
+    decoder_model_path: str,
+    session_config: SessionConfig,
+    settings: Dict,
+):
+    global worker_archive, worker_proposer
+    worker_archive = ProjectArchive(project_path)
+    mask_creator = MaskCreator(
+        decoder_model_path, load_async=False, session_config=session_config
+    )
+    worker_proposer = MaskProposer(mask_creator, **settings)
+
+
+def propose_image_masks(
+    task: Tuple[int, str, List[int], List[Dict]]
+) -> Tuple[int, List[Dict]]:
+    """
+    Propose the masks of an image from its embedding in the project archive.
+    Runs in a propose worker process.
+
+    Args:
+        task: (image idx, embedding name, image size, existing annotations)
+
+    Returns:
+        (image idx, proposed annotations)
+    """
+    idx, embedding_name, image_size, annotations = task
+    embedding = worker_archive.load_numpy(embedding_name)
+    return idx, worker_proposer.propose(embedding, image_size, annotations)
+
+
+class ProjectProposer:
+    """
+    Propose the masks of all the images of a project with MaskProposer, and
+    add them to the annotations of the images with the category -1
+    """
+
+    def __init__(self, project_path: str):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.project_path = project_path
+
+    def propose(
+        self,
+        dataset: Dataset,
+        decoder_model_path: str,
+        session_config: SessionConfig = None,
+        settings: Dict = None,
+        num_workers: int = None,
+        progress_callback: Callable[[int, int], None] = None,
+    ) -> int:
+        """
+        Propose the masks of the images of the dataset in a process pool.
+        The proposals are added to the data of the dataset, which has to be
+        saved afterwards.
+
+        Params:
+        - dataset: The dataset loaded from the project
+        - decoder_model_path: Path of the decoder model
+        - session_config: Settings of the onnxruntime session of the decoder
+        - settings: Keyword arguments of MaskProposer, e.g. points_per_side
+        - num_workers: Number of propose processes. Default is the number of CPUs.
+          With 1 worker, the masks are proposed in the current process.
+        - progress_callback: Called with (number of processed images, total)
+
+        Returns:
+            The number of proposed masks
+        """
+        settings = settings if settings is not None else {}
+        tasks = []
+        for data in dataset.get_data_list():
+            annotations = [
+                {"segmentation": annotation["segmentation"]}
+                for annotation in data.get_segmentation()["annotations"]
+                if is_rel_encoding(annotation["segmentation"])
+            ]
+            tasks.append(
+                (
+                    data.get_idx(),
+                    data.get_embedding_path(),
+                    [data.get_image_height(), data.get_image_width()],
+                    annotations,
+                )
+            )
+
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        num_workers = max(min(num_workers, len(tasks)), 1)
+        session_config = self.get_worker_session_config(session_config, num_workers)
+        self.logger.info(
+            f"Proposing masks of {len(tasks)} images with {num_workers} workers"
+        )
+
+        num_proposals = 0
+        if num_workers == 1:
+            init_propose_worker(
+                self.project_path, decoder_model_path, session_config, settings
+            )
+            try:
+                for count, task in enumerate(tasks, start=1):
+                    idx, proposals = propose_image_masks(task)
+                    num_proposals += self.add_proposals(dataset.get_data(idx), proposals)
+                    if progress_callback is not None:
+                        progress_callback(count, len(tasks))
+            finally:
+                worker_archive.close()
+            return num_proposals
+
+        with ProcessPoolExecutor(
+            max_workers=num_workers,
+            initializer=init_propose_worker,
+            initargs=(self.project_path, decoder_model_path, session_config, settings),
+        ) as executor:
+            futures = [executor.submit(propose_image_masks, task) for task in tasks]
+            for count, future in enumerate(as_completed(futures), start=1):
+                idx, proposals = future.result()
+                num_proposals += self.add_proposals(dataset.get_data(idx), proposals)
+                if progress_callback is not None:
+                    progress_callback(count, len(tasks))
+        return num_proposals
+
+    def get_worker_session_config(
+        self, session_config: SessionConfig, num_workers: int
+    ) -> SessionConfig:
+        """
+        Split the CPU threads between the workers, unless the number of
+        threads of the decoder is set
+        """
+        session_config = (
+            copy.deepcopy(session_config)
+            if session_config is not None
+            else SessionConfig()
+        )
+        decoder_settings = session_config.get_settings(SessionConfig.DECODER)
+        if num_workers > 1 and "intra_op_num_threads" not in decoder_settings:
+            num_threads = max((os.cpu_count() or 1) // num_workers, 1)
+            session_config.update(
+                {SessionConfig.DECODER: {"intra_op_num_threads": num_threads}}
+            )
+        return session_config
+
+    def add_proposals(self, data: Data, proposals: List[Dict]) -> int:
+        """
+        Add the proposed annotations to the data, with the unused mask ids
+
+        Returns:
+            The number of added annotations
+        """
+        if len(proposals) == 0:
+            return 0
+
+        segmentation = data.get_segmentation()
+        annotations = list(segmentation["annotations"])
+        used_ids = set(annotation["id"] for annotation in annotations)
+        mask_id = 0
+        for proposal in proposals:
+            while mask_id in used_ids:
+                mask_id += 1
+            proposal["id"] = mask_id
+            proposal["image_id"] = data.get_idx()
+            used_ids.add(mask_id)
+            annotations.append(proposal)
+
+        data.set_segmentation(
+            {
+                "images": segmentation["images"],
+                "annotations": annotations,
+            }
+        )
+        return len(proposals)
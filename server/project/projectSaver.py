@@ -1,11 +1,12 @@
 import os
+import json
 import zipfile
 import logging
 import shutil
+import warnings
 
-from ..util.json import save_json
-from ..dataset import Dataset
-from PIL import Image
+from ..dataset import Dataset, Data
+from .projectArchive import ProjectArchive
 
 from ..jsonFormat import (
     ImageJson,
@@ -16,89 +17,160 @@ from ..jsonFormat import (
 )
 
 
-TEMP_CREATE_NAME = "__coralscop_lat_temp"
-TEMP_CREATE_NAME_2 = "__coralscop_lat_temp_2"
+TEMP_SAVE_SUFFIX = ".saving"
 
 
 class ProjectSaver:
+
+    # Fall back to a full save when the members shadowed by incremental saves
+    # take more than this fraction of the project file
+    COMPACT_RATIO = 0.2
+
     def __init__(self):
         self.logger = logging.getLogger(self.__class__.__name__)
 
     def save_dataset(
         self, dataset: Dataset, project_path_origin: str, project_path_new: str
     ):
-        print(f"Saving dataset to {project_path_new} and {project_path_origin}")
-        # Unzip the original project to temp folder
-        temp_folder_origin = os.path.join(
-            os.path.dirname(project_path_origin), TEMP_CREATE_NAME
+        """
+        Save the dataset to the new project path.
+
+        If the dataset is saved back to the project file it is opened from,
+        only the changed annotation files and the project info are appended
+        to the archive. Otherwise, the whole project is rewritten.
+        """
+        self.logger.info(
+            f"Saving dataset to {project_path_new} and {project_path_origin}"
         )
-        if os.path.exists(temp_folder_origin):
-            shutil.rmtree(temp_folder_origin)
 
-        os.makedirs(temp_folder_origin, exist_ok=True)
-        with zipfile.ZipFile(project_path_origin, "r") as archive:
-            archive.extractall(temp_folder_origin)
+        archive = dataset.get_archive()
+        if (
+            archive is not None
+            and self.is_same_path(archive.get_project_path(), project_path_origin)
+            and self.is_same_path(project_path_origin, project_path_new)
+            and not self.should_compact(archive)
+        ):
+            self.save_incremental(dataset, archive)
+        else:
+            self.save_full(dataset, project_path_origin, project_path_new)
+
+        # The dataset is in sync with its own project file after saving to it
+        if archive is not None and self.is_same_path(
+            archive.get_project_path(), project_path_new
+        ):
+            dataset.clear_dirty()
+
+    def is_same_path(self, path_a: str, path_b: str) -> bool:
+        return os.path.abspath(path_a) == os.path.abspath(path_b)
+
+    def should_compact(self, archive: ProjectArchive) -> bool:
+        project_size = os.path.getsize(archive.get_project_path())
+        stale_size = archive.get_stale_size()
+        return stale_size > project_size * ProjectSaver.COMPACT_RATIO
+
+    def save_incremental(self, dataset: Dataset, archive: ProjectArchive):
+        """
+        Append the changed annotation files and the project info to the
+        project archive. The images and embeddings are left untouched.
+        """
+        if not dataset.is_dirty():
+            self.logger.info(f"Nothing changed since the last save")
+            return
+
+        dirty_data_list = dataset.get_dirty_data_list()
+        self.logger.info(
+            f"Saving {len(dirty_data_list)} changed annotations incrementally ..."
+        )
 
-        # Create temp folder for the new project
-        temp_folder_new = os.path.join(
-            os.path.dirname(project_path_new), TEMP_CREATE_NAME_2
+        # Appending overwrites the central directory of the archive, so keep it
+        # to restore the archive if the save fails halfway
+        project_path = archive.get_project_path()
+        central_directory_offset = archive.get_central_directory_offset()
+        with open(project_path, "rb") as f:
+            f.seek(central_directory_offset)
+            central_directory = f.read()
+
+        try:
+            with warnings.catch_warnings():
+                # The newer member shadows the older member with the same name
+                warnings.filterwarnings("ignore", message="Duplicate name")
+                with zipfile.ZipFile(project_path, "a") as new_archive:
+                    for data in dirty_data_list:
+                        self.write_annotation(new_archive, data)
+                    self.write_project_info(new_archive, dataset)
+        except Exception:
+            self.logger.error(f"Incremental save failed, restoring {project_path}")
+            with open(project_path, "r+b") as f:
+                f.seek(central_directory_offset)
+                f.write(central_directory)
+                f.truncate()
+            raise
+        finally:
+            archive.open()
+
+    def save_full(
+        self, dataset: Dataset, project_path_origin: str, project_path_new: str
+    ):
+        """
+        Write the whole project to the new project path. The images and
+        embeddings are copied from the original project archive.
+        """
+        # Reuse the archive of the dataset if it is opened from the same file.
+        archive = dataset.get_archive()
+        own_archive = archive is None or not self.is_same_path(
+            archive.get_project_path(), project_path_origin
         )
-        if os.path.exists(temp_folder_new):
-            shutil.rmtree(temp_folder_new)
-        os.makedirs(temp_folder_new, exist_ok=True)
-
-        # Copy the images to the new project folder
-        image_folder_origin = os.path.join(temp_folder_origin, "images")
-        image_folder_new = os.path.join(temp_folder_new, "images")
-        os.makedirs(image_folder_new, exist_ok=True)
-        for image_name in os.listdir(image_folder_origin):
-            image_path_origin = os.path.join(image_folder_origin, image_name)
-            image_path_new = os.path.join(image_folder_new, image_name)
-            shutil.copy(image_path_origin, image_path_new)
-
-        # Copy the embeddings to the new project folder
-        embedding_folder_origin = os.path.join(temp_folder_origin, "embeddings")
-        embedding_folder_new = os.path.join(temp_folder_new, "embeddings")
-        os.makedirs(embedding_folder_new, exist_ok=True)
-        for embedding_name in os.listdir(embedding_folder_origin):
-            embedding_path_origin = os.path.join(
-                embedding_folder_origin, embedding_name
-            )
-            embedding_path_new = os.path.join(embedding_folder_new, embedding_name)
-            shutil.copy(embedding_path_origin, embedding_path_new)
-
-        # Generate annotation to the new project folder
-        annotation_folder_new = os.path.join(temp_folder_new, "annotations")
-        os.makedirs(annotation_folder_new, exist_ok=True)
-        for data in dataset.get_data_list():
-            filename = os.path.splitext(data.get_image_name())[0]
-            annotation_path = os.path.join(annotation_folder_new, f"{filename}.json")
-
-            annotation_file_json = AnnotationFileJson()
-
-            image_json = ImageJson()
-            image_json.set_id(data.get_idx())
-            image_json.set_filename(data.get_image_name())
-            image_json.set_width(data.get_image_width())
-            image_json.set_height(data.get_image_height())
-            annotation_file_json.add_image(image_json)
-
-            for mask in data.get_segmentation()["annotations"]:
-                annotation_json = AnnotationJson()
-                annotation_json.set_segmentation(mask["segmentation"])
-                annotation_json.set_bbox(mask["bbox"])
-                annotation_json.set_area(mask["area"])
-                annotation_json.set_category_id(mask["category_id"])
-                annotation_json.set_id(mask["id"])
-                annotation_json.set_image_id(data.get_idx())
-                annotation_json.set_iscrowd(mask["iscrowd"])
-                annotation_file_json.add_annotation(annotation_json)
-
-            save_json(annotation_file_json.to_json(), annotation_path)
-
-        # Generate the project info file to the new project folder
-        project_info_path = os.path.join(temp_folder_new, "project_info.json")
+        if own_archive:
+            archive = ProjectArchive(project_path_origin)
+
+        # The new project is written to a temporary file first, since the new
+        # project path can be the original project path that is being read.
+        temp_project_path = project_path_new + TEMP_SAVE_SUFFIX
+        with zipfile.ZipFile(temp_project_path, "w") as new_archive:
+            # Copy the images and embeddings to the new project
+            for folder in [
+                ProjectArchive.IMAGE_FOLDER,
+                ProjectArchive.EMBEDDING_FOLDER,
+            ]:
+                for filename in archive.list_folder(folder):
+                    name = ProjectArchive.join(folder, filename)
+                    with archive.open_member(name) as src, new_archive.open(
+                        name, "w"
+                    ) as dst:
+                        shutil.copyfileobj(src, dst)
+
+            # Generate annotation to the new project
+            for data in dataset.get_data_list():
+                self.write_annotation(new_archive, data)
+
+            # Generate the project info file to the new project
+            self.write_project_info(new_archive, dataset)
+
+        # Replace the project file. The archive has to be closed while its
+        # file is replaced, and is reopened to read the new file afterwards.
+        replacing_archive = self.is_same_path(
+            archive.get_project_path(), project_path_new
+        )
+        if own_archive or replacing_archive:
+            archive.close()
+
+        os.replace(temp_project_path, project_path_new)
 
+        if replacing_archive and not own_archive:
+            archive.open()
+
+    def write_annotation(self, archive: zipfile.ZipFile, data: Data):
+        filename = os.path.splitext(data.get_image_name())[0]
+        annotation_name = ProjectArchive.join(
+            ProjectArchive.ANNOTATION_FOLDER, f"{filename}.json"
+        )
+        annotation_file_json = self.to_annotation_file_json(data)
+        archive.writestr(
+            annotation_name,
+            json.dumps(annotation_file_json.to_json(), indent=4),
+        )
+
+    def write_project_info(self, archive: zipfile.ZipFile, dataset: Dataset):
         project_info_json = ProjectInfoJson()
         project_info_json.set_last_image_idx(dataset.get_last_saved_id())
         for category in dataset.get_category_info():
@@ -108,24 +180,30 @@ class ProjectSaver:
             category_json.set_supercategory(category["supercategory"])
             project_info_json.add_category_info(category_json)
 
-        project_info_json.set_last_image_idx(dataset.get_last_saved_id())
-
-        save_json(project_info_json.to_json(), project_info_path)
-
-        # Remove the temp folder for original project
-        shutil.rmtree(temp_folder_origin)
-
-        # Zip the new project folder to the new project path
-        if os.path.exists(project_path_new):
-            os.remove(project_path_new)
-
-        with zipfile.ZipFile(project_path_new, "w") as archive:
-            for root, _, files in os.walk(temp_folder_new):
-                for file in files:
-                    archive.write(
-                        os.path.join(root, file),
-                        os.path.relpath(os.path.join(root, file), temp_folder_new),
-                    )
+        archive.writestr(
+            ProjectArchive.PROJECT_INFO_FILE,
+            json.dumps(project_info_json.to_json(), indent=4),
+        )
 
-        # Remove the temp folder for the new project
-        shutil.rmtree(temp_folder_new)
+    def to_annotation_file_json(self, data: Data) -> AnnotationFileJson:
+        annotation_file_json = AnnotationFileJson()
+
+        image_json = ImageJson()
+        image_json.set_id(data.get_idx())
+        image_json.set_filename(data.get_image_name())
+        image_json.set_width(data.get_image_width())
+        image_json.set_height(data.get_image_height())
+        annotation_file_json.add_image(image_json)
+
+        for mask in data.get_segmentation()["annotations"]:
+            annotation_json = AnnotationJson()
+            annotation_json.set_segmentation(mask["segmentation"])
+            annotation_json.set_bbox(mask["bbox"])
+            annotation_json.set_area(mask["area"])
+            annotation_json.set_category_id(mask["category_id"])
+            annotation_json.set_id(mask["id"])
+            annotation_json.set_image_id(data.get_idx())
+            annotation_json.set_iscrowd(mask["iscrowd"])
+            annotation_file_json.add_annotation(annotation_json)
+
+        return annotation_file_json
@@ -1,14 +1,23 @@
 import logging
+import mimetypes
+import threading
 import time
 import os
+import bottle
+import eel
+import numpy as np
 
 from tkinter import Tk, filedialog, messagebox
 from .embedding import EmbeddingGenerator
+from .embeddingCache import EmbeddingCache
+from .sessionConfig import SessionConfig
+from .prefetcher import DataPrefetcher
+from .annotationRenderer import AnnotationRenderer
 
 # from .maskEiditor import MaskEidtor
 from .mask.maskCreator import MaskCreator
 from .mask.prompt import Prompt
-from .util.general import get_resource_path
+from .util.general import get_model_paths
 
 from .project import (
     ProjectCreator,
@@ -16,10 +25,11 @@ from .project import (
     ProjectExportor,
     JsonImportor,
     ProjectSaver,
+    ProjectJournal,
 )
+from .project.projectArchive import ProjectArchive
 from .util.requests import ProjectCreateRequest
 from .dataset import Dataset, Data
-from .util.coco import to_coco_annotation, rle_mask_to_rle_vis_encoding
 from .util.requests import FileDialogRequest
 
 from typing import Dict, List, Tuple
@@ -45,52 +55,74 @@ class Server:
     This class handle all the requests from teh client sides
     """
 
-    def __init__(self, model_type: str = "vit_b"):
+    # Field projections of get_data_page
+    DATA_FIELDS_METADATA = "metadata"
+    DATA_FIELDS_ANNOTATIONS = "annotations"
+    DATA_FIELDS_FULL = "full"
+
+    # The image urls contain the content key of the image, so the browser
+    # never needs to revalidate them
+    IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+    # Interval in seconds of the progress updates of the export
+    EXPORT_PROGRESS_INTERVAL = 0.2
+
+    def __init__(
+        self,
+        model_type: str = "vit_b",
+        embedding_cache_dir: str = None,
+        embedding_cache_size: int = None,
+        session_config: SessionConfig = None,
+    ):
+        """
+        Args:
+            model_type: SAM model type, "vit_b" or "vit_h"
+            embedding_cache_dir: Folder of the embedding cache shared across
+                projects. Use the default folder if None.
+            embedding_cache_size: Size cap of the embedding cache in bytes.
+                Use the default cap if None. The cache is disabled if 0.
+            session_config: Settings of the onnxruntime sessions. Use the
+                default settings if None.
+        """
         self.logger = logging.getLogger(self.__class__.__name__)
 
-        # Embedding Encoder Model
-        self.logger.info("Loading embedding encoder model ...")
-        start_time = time.time()
+        # Embedding Encoder Model. The model is loaded on the first project
+        # creation, since opening a project does not need it.
         self.model_type = model_type
-        if model_type == "vit_h":
-            self.encoder_model_path = get_resource_path(
-                os.path.join("models", "vit_h_encoder_quantized.onnx")
-            )
-            self.decoder_model_path = get_resource_path(
-                os.path.join("models", "vit_h_decoder_quantized.onnx")
-            )
-        elif model_type == "vit_b":
-            self.encoder_model_path = get_resource_path(
-                os.path.join("models", "vit_b_encoder_quantized.onnx")
-            )
-            self.decoder_model_path = get_resource_path(
-                os.path.join("models", "vit_b_decoder_quantized.onnx")
-            )
-        else:
-            raise ValueError(
-                f"Unsupported model type: {model_type}. Supported types are 'vit_b' and 'vit_h'."
-            )
+        self.encoder_model_path, self.decoder_model_path = get_model_paths(model_type)
 
-        self.embeddings_generator = EmbeddingGenerator(self.encoder_model_path)
-        self.logger.info(
-            f"Embedding model loaded in {time.time() - start_time} seconds"
+        embedding_cache = None
+        if embedding_cache_size != 0:
+            embedding_cache = EmbeddingCache(embedding_cache_dir, embedding_cache_size)
+
+        self.embeddings_generator = EmbeddingGenerator(
+            self.encoder_model_path,
+            model_type=model_type,
+            embedding_cache=embedding_cache,
+            session_config=session_config,
         )
 
-        # Mask Editor
-        self.logger.info("Mask Editor initialized ...")
-        start_time = time.time()
-        self.mask_creator = MaskCreator(self.decoder_model_path)
-        self.logger.info(
-            f"Mask Creator initialized in {time.time() - start_time} seconds"
+        # Mask Editor. The decoder model is loaded and warmed up in the
+        # background while the window opens.
+        self.mask_creator = MaskCreator(
+            self.decoder_model_path, load_async=True, session_config=session_config
         )
+        self.logger.info("Mask Creator initialized ...")
 
         # Project creation
         self.project_creator = ProjectCreator(self.embeddings_generator)
 
+        # Set to stop the running export of the annotated images
+        self.export_stop_event = threading.Event()
+
         # Dataset
         self.dataset: Dataset = None
         self.current_image_idx: int = 0
         self.project_path: str = None
+        self.journal: ProjectJournal = None
+
+        # Background loading of the neighbouring images
+        self.prefetcher = DataPrefetcher()
 
     def select_folder(self, file_dialog_request: FileDialogRequest):
         """
@@ -204,23 +236,21 @@ class Server:
         dataset, last_image_idx = project_loader.load(project_path)
         self.logger.info(f"Project loaded with last image idx: {last_image_idx}")
 
+        # Release the archive of the previous project
+        if self.dataset is not None and self.dataset.get_archive() is not None:
+            self.dataset.get_archive().close()
+
         self.set_dataset(dataset)
         self.set_current_image_idx(last_image_idx)
 
         self.set_project_path(project_path)
         self.logger.info(f"Project path set to {self.project_path}")
 
+        self.journal = ProjectJournal(project_path)
+
     def get_current_data_dict(self) -> Dict:
         return self.get_data_dict(self.get_current_image_idx())
 
-    @time_it
-    def get_gallery_data_list(self) -> List[Dict]:
-        """
-        Get the list of data for the gallery view
-        """
-        data_list = self.dataset.get_data_list()
-        return [data.to_image_json() for data in data_list]
-
     @time_it
     def get_data_dict(self, image_idx: int) -> Dict:
         """
@@ -242,7 +272,12 @@ class Server:
             self.logger.error(f"Category info not found")
             return None
 
-        response = data.to_json()
+        # Use the prefetched payload if the data is not changed since then.
+        # The payload is copied, as the category info is added per request.
+        response = self.prefetcher.get_payload(data)
+        if response is None:
+            response = data.to_json()
+        response = dict(response)
         response["category_info"] = category_info
 
         return response
@@ -265,10 +300,83 @@ class Server:
 
         return data
 
+    def get_image_response(
+        self, content_key: str, image_name: str, if_none_match: str = None
+    ) -> bottle.HTTPResponse:
+        """
+        Get the response of the image route, streaming the image bytes from
+        the project archive as they are
+
+        Args:
+            content_key: Content key of the image in the url
+            image_name: File name of the image
+            if_none_match: If-None-Match header of the request
+
+        Returns:
+            The image with caching headers, 304 if the browser has the image,
+            or 404 if the current project has no such image
+        """
+        archive = self.dataset.get_archive() if self.dataset is not None else None
+        name = ProjectArchive.join(ProjectArchive.IMAGE_FOLDER, image_name)
+        if (
+            archive is None
+            or not archive.has(name)
+            or archive.get_content_key(name) != content_key
+        ):
+            return bottle.HTTPError(404, f"Image not found: {image_name}")
+
+        etag = f'"{content_key}"'
+        headers = {"ETag": etag, "Cache-Control": Server.IMAGE_CACHE_CONTROL}
+        if if_none_match is not None and etag in [
+            tag.strip() for tag in if_none_match.split(",")
+        ]:
+            return bottle.HTTPResponse(status=304, headers=headers)
+
+        content_type, _ = mimetypes.guess_type(image_name)
+        headers["Content-Type"] = content_type or "application/octet-stream"
+        headers["Content-Length"] = str(archive.get_info(name).file_size)
+        return bottle.HTTPResponse(archive.open_member(name), headers=headers)
+
     @time_it
-    def get_data_list(self) -> List[Data]:
-        self.logger.info(f"Getting data list ...")
-        return self.dataset.get_data_list()
+    def get_data_page(
+        self, offset: int, limit: int, fields: str = DATA_FIELDS_METADATA
+    ) -> Dict:
+        """
+        Get a page of the data list, sorted by image idx:
+        {
+            "total": int - Number of data in the dataset,
+            "offset": int,
+            "data_list": List[Dict],
+        }
+
+        The fields of each data depend on the projection:
+        - "metadata": Image information only, see Data.to_metadata_json
+        - "annotations": Data.to_json without the visualization rle
+        - "full": Data.to_json
+        """
+        self.logger.info(
+            f"Getting data page at {offset} with limit {limit} and fields {fields} ..."
+        )
+        data_list = self.dataset.get_data_list()
+        page = data_list[max(0, offset) : max(0, offset) + max(0, limit)]
+
+        if fields == Server.DATA_FIELDS_METADATA:
+            page = [data.to_metadata_json() for data in page]
+        elif fields == Server.DATA_FIELDS_ANNOTATIONS:
+            page = [data.to_json(include_rle=False) for data in page]
+        elif fields == Server.DATA_FIELDS_FULL:
+            page = [data.to_json() for data in page]
+        else:
+            raise ValueError(
+                f"Unsupported fields: {fields}. Supported fields are "
+                f"'{Server.DATA_FIELDS_METADATA}', '{Server.DATA_FIELDS_ANNOTATIONS}' and '{Server.DATA_FIELDS_FULL}'."
+            )
+
+        return {
+            "total": len(data_list),
+            "offset": offset,
+            "data_list": page,
+        }
 
     def to_next_data(self) -> None:
         """
@@ -306,6 +414,7 @@ class Server:
 
     def set_dataset(self, dataset):
         self.dataset = dataset
+        self.prefetcher.reset(dataset)
 
     def get_dataset(self):
         return self.dataset
@@ -316,15 +425,23 @@ class Server:
 
         self.current_image_idx = image_idx
 
+        # The embedding is copied out of the memory-mapped project archive, so
+        # that no mapping of the project file outlives the navigation
         data = self.get_data(image_idx)
+        embedding = self.prefetcher.get_embedding(image_idx)
+        if embedding is None:
+            embedding = np.array(data.get_embedding())
         self.mask_creator.set_image(
-            data.get_embedding(),
+            embedding,
             [
                 data.get_image_height(),
                 data.get_image_width(),
             ],
         )
 
+        # Warm the neighbours while the annotator works on this image
+        self.prefetcher.prefetch(image_idx)
+
     def get_current_image_idx(self):
         return self.current_image_idx
 
@@ -346,6 +463,9 @@ class Server:
         self.dataset.update_data(data_idx, segmentation)
         self.dataset.set_category_info(data["category_info"])
 
+        # Record the edit, so that it survives a crash before the next save
+        self.journal.append(data_idx, segmentation, data["category_info"])
+
     @time_it
     def save_dataset(self, output_path: str):
 
@@ -357,6 +477,10 @@ class Server:
         project_saver = ProjectSaver()
         project_saver.save_dataset(self.dataset, self.get_project_path(), output_path)
 
+        # The project file now contains all the journaled edits
+        if os.path.abspath(output_path) == os.path.abspath(self.get_project_path()):
+            self.journal.clear()
+
     def get_project_path(self) -> str:
         return self.project_path
 
@@ -367,12 +491,16 @@ class Server:
         data_list = self.dataset.get_data_list_by_category_id(category_id)
         return [data.get_idx() for data in data_list]
 
-    def create_mask(self, prompts: List[Dict]) -> Dict:
+    def create_mask(self, prompts: List[Dict], preview_size: int = None) -> Dict:
         """
         Create a mask based on the prompts
 
         Args:
             prompts: List of prompts
+            preview_size: If given, create a preview mask with the longest side
+                at most preview_size, e.g. the display resolution of the image,
+                instead of the full resolution mask. The full resolution mask
+                of the preview is created by confirm_mask.
 
         Returns:
             A dictionary containing the mask annotation,
@@ -387,15 +515,43 @@ class Server:
                 "iscrowd": int,
                 "rle": rle-encoded mask, added for frontend visualization
             }
+
+            or the preview mask if preview_size is given
+            {
+                "width": int,  # Width of the preview mask
+                "height": int,  # Height of the preview mask
+                "rle": rle-encoded mask, for frontend visualization
+            }
         """
         self.logger.info(f"Creating mask ...")
 
         prompts = [Prompt(prompt) for prompt in prompts]
-        mask = self.mask_creator.create_mask(prompts)
-        annotation = to_coco_annotation(mask)
-        annotation["category_id"] = -2  # Category id for prompted mask
-        annotation["rle"] = rle_mask_to_rle_vis_encoding(annotation["segmentation"])
+        # The encodings are cached with the decoder results, so that a
+        # repeated mask is not encoded again
+        annotation = self.mask_creator.create_mask(prompts, preview_size=preview_size)
+        if preview_size is not None:
+            height, width = annotation["segmentation"]["size"]
+            return {
+                "width": width,
+                "height": height,
+                "rle": annotation["rle"],
+            }
+        return self.to_prompted_mask_annotation(annotation)
+
+    def confirm_mask(self) -> Dict:
+        """
+        Create the full resolution mask of the last created mask
 
+        Returns:
+            The mask annotation, in the same format as create_mask
+        """
+        self.logger.info(f"Confirming mask ...")
+        return self.to_prompted_mask_annotation(self.mask_creator.get_full_mask())
+
+    def to_prompted_mask_annotation(self, annotation: Dict) -> Dict:
+        # Copy the cached annotation of the mask creator before changing it
+        annotation = dict(annotation)
+        annotation["category_id"] = -2  # Category id for prompted mask
         return annotation
 
     @time_it
@@ -405,10 +561,61 @@ class Server:
         project_export.export_images(output_dir)
 
     @time_it
-    def export_annotated_images(self, output_dir: str, data_list: List[Dict]):
+    def export_annotated_images(
+        self, output_dir: str, mask_opacity: float = AnnotationRenderer.DEFAULT_MASK_OPACITY
+    ) -> bool:
+        """
+        Export the annotated images, reporting the progress to the front end
+        through updateProgressPercentage. The export is stopped by
+        terminate_export_process.
+
+        Returns:
+            Whether all the images are exported
+        """
         self.logger.info(f"Exporting annotated images to {output_dir} ...")
-        project_export = ProjectExportor(self.project_path)
-        project_export.export_annotated_images(output_dir, data_list)
+        self.export_stop_event.clear()
+        progress = {"count": 0, "total": 0}
+        result = {"finished": False, "error": None}
+
+        def progress_callback(count: int, total: int):
+            progress["count"] = count
+            progress["total"] = total
+
+        def export():
+            try:
+                project_export = ProjectExportor(self.project_path)
+                result["finished"] = project_export.export_annotated_images(
+                    output_dir,
+                    self.get_dataset(),
+                    mask_opacity=mask_opacity,
+                    progress_callback=progress_callback,
+                    stop_event=self.export_stop_event,
+                )
+            except Exception as e:
+                result["error"] = e
+
+        # The export runs in a thread while this call waits in the event loop
+        # of eel, so that the progress is sent and the terminate request is
+        # handled in the meantime
+        export_thread = threading.Thread(target=export)
+        export_thread.start()
+        reported_percentage = None
+        while export_thread.is_alive():
+            eel.sleep(Server.EXPORT_PROGRESS_INTERVAL)
+            if progress["total"] > 0:
+                percentage = int(progress["count"] / progress["total"] * 100)
+                if percentage != reported_percentage:
+                    eel.updateProgressPercentage(percentage)
+                    reported_percentage = percentage
+        export_thread.join()
+
+        if result["error"] is not None:
+            raise result["error"]
+        return result["finished"]
+
+    def terminate_export_process(self):
+        self.logger.info(f"Terminating export ...")
+        self.export_stop_event.set()
 
     @time_it
     def export_coco(self, output_path: str):
@@ -452,3 +659,11 @@ class Server:
 
         self.logger.info(f"Matched {matched_count} data")
         self.dataset.set_category_info(improted_dataset.get_category_info())
+
+        # Record the imported annotations, so that they survive a crash. The
+        # import replaces the annotations of every image, so one record of
+        # all the images replaces the journal.
+        self.journal.reset(
+            {data.get_idx(): data.get_segmentation() for data in self.dataset.get_data_list()},
+            self.dataset.get_category_info(),
+        )
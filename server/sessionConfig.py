@@ -0,0 +1,324 @@
+import argparse
+import copy
+import json
+import logging
+import os
+
+import onnxruntime as ort
+
+from typing import Dict, List
+from .util.general import compute_bytes_hash
+
+
+class SessionConfig:
+    """
+    Settings of the onnxruntime sessions of the encoder and decoder models.
+
+    The settings are read from a json config file and command line arguments,
+    which override the config file:
+    {
+        "providers": ["openvino", "cpu"],
+        "intra_op_num_threads": 32,
+        "inter_op_num_threads": 1,
+        "execution_mode": "sequential",
+        "graph_optimization_level": "all",
+        "enable_cpu_mem_arena": true,
+        "enable_mem_pattern": true,
+        "optimized_model_dir": "~/.sat/optimized_models",
+        "encoder": {...},  # settings of the encoder only
+        "decoder": {...}   # settings of the decoder only
+    }
+
+    Missing settings keep the onnxruntime defaults. Providers that are not
+    installed are skipped, and the CPU provider is always the last fallback.
+    """
+
+    ENCODER = "encoder"
+    DECODER = "decoder"
+
+    DEFAULT_PROVIDERS = ["CUDAExecutionProvider", "CPUExecutionProvider"]
+    PROVIDER_ALIASES = {
+        "cpu": "CPUExecutionProvider",
+        "cuda": "CUDAExecutionProvider",
+        "tensorrt": "TensorrtExecutionProvider",
+        "openvino": "OpenVINOExecutionProvider",
+        "dnnl": "DnnlExecutionProvider",
+        "directml": "DmlExecutionProvider",
+        "coreml": "CoreMLExecutionProvider",
+    }
+
+    GRAPH_OPTIMIZATION_LEVELS = {
+        "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    EXECUTION_MODES = {
+        "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+        "parallel": ort.ExecutionMode.ORT_PARALLEL,
+    }
+
+    SETTING_KEYS = [
+        "providers",
+        "intra_op_num_threads",
+        "inter_op_num_threads",
+        "execution_mode",
+        "graph_optimization_level",
+        "enable_cpu_mem_arena",
+        "enable_mem_pattern",
+        "optimized_model_dir",
+    ]
+
+    def __init__(self, settings: Dict = None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.settings: Dict = {}
+        self.model_settings: Dict[str, Dict] = {
+            SessionConfig.ENCODER: {},
+            SessionConfig.DECODER: {},
+        }
+        if settings is not None:
+            self.update(settings)
+
+    @staticmethod
+    def from_file(config_path: str) -> "SessionConfig":
+        with open(config_path, "r") as f:
+            return SessionConfig(json.load(f))
+
+    def update(self, settings: Dict):
+        """
+        Update the settings. Settings that are None are ignored.
+        """
+        for key, value in settings.items():
+            if key in self.model_settings:
+                self.model_settings[key].update(self.check_settings(value))
+            else:
+                self.settings.update(self.check_settings({key: value}))
+
+    def check_settings(self, settings: Dict) -> Dict:
+        checked = {}
+        for key, value in settings.items():
+            assert key in SessionConfig.SETTING_KEYS, f"Unknown session setting: {key}"
+            if value is None:
+                continue
+            if key == "graph_optimization_level":
+                assert (
+                    value in SessionConfig.GRAPH_OPTIMIZATION_LEVELS
+                ), f"Invalid graph optimization level: {value}"
+            elif key == "execution_mode":
+                assert (
+                    value in SessionConfig.EXECUTION_MODES
+                ), f"Invalid execution mode: {value}"
+            elif key == "providers" and isinstance(value, str):
+                value = [provider for provider in value.split(",") if provider]
+            checked[key] = value
+        return checked
+
+    def get_settings(self, model: str) -> Dict:
+        """
+        Get the settings of the model, "encoder" or "decoder"
+        """
+        settings = copy.deepcopy(self.settings)
+        settings.update(self.model_settings.get(model, {}))
+        return settings
+
+    @staticmethod
+    def resolve_provider(provider: str) -> str:
+        return SessionConfig.PROVIDER_ALIASES.get(provider.lower(), provider)
+
+    def get_providers(self, settings: Dict) -> List[str]:
+        """
+        Get the requested providers that are installed, followed by the CPU provider
+        """
+        # Only the providers requested by the user are warned about, the
+        # default providers are tried silently
+        log = self.logger.warning if "providers" in settings else self.logger.debug
+        requested = settings.get("providers", SessionConfig.DEFAULT_PROVIDERS)
+        requested = [self.resolve_provider(provider) for provider in requested]
+        available = ort.get_available_providers()
+
+        providers = []
+        for provider in requested:
+            if provider not in available:
+                log(
+                    f"Execution provider {provider} is not available. "
+                    f"Available providers: {available}"
+                )
+            elif provider not in providers:
+                providers.append(provider)
+        if "CPUExecutionProvider" not in providers:
+            providers.append("CPUExecutionProvider")
+        return providers
+
+    def get_optimized_model_path(
+        self, model_path: str, settings: Dict, providers: List[str]
+    ) -> str:
+        """
+        Get the path of the optimized model serialized by a previous session.
+        The optimized model depends on the model file, the onnxruntime version,
+        the optimization level and the providers, so all of them are in the key.
+        """
+        optimized_model_dir = os.path.expanduser(settings["optimized_model_dir"])
+        stat = os.stat(model_path)
+        key = compute_bytes_hash(
+            json.dumps(
+                [
+                    os.path.abspath(model_path),
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    ort.__version__,
+                    settings.get("graph_optimization_level", "all"),
+                    providers,
+                ]
+            ).encode("utf-8")
+        )[:16]
+        filename = os.path.splitext(os.path.basename(model_path))[0]
+        return os.path.join(optimized_model_dir, f"{filename}.{key}.onnx")
+
+    def get_session_options(self, settings: Dict) -> ort.SessionOptions:
+        session_options = ort.SessionOptions()
+        if "intra_op_num_threads" in settings:
+            session_options.intra_op_num_threads = int(settings["intra_op_num_threads"])
+        if "inter_op_num_threads" in settings:
+            session_options.inter_op_num_threads = int(settings["inter_op_num_threads"])
+        if "execution_mode" in settings:
+            session_options.execution_mode = SessionConfig.EXECUTION_MODES[
+                settings["execution_mode"]
+            ]
+        if "enable_cpu_mem_arena" in settings:
+            session_options.enable_cpu_mem_arena = bool(settings["enable_cpu_mem_arena"])
+        if "enable_mem_pattern" in settings:
+            session_options.enable_mem_pattern = bool(settings["enable_mem_pattern"])
+        if "graph_optimization_level" in settings:
+            session_options.graph_optimization_level = (
+                SessionConfig.GRAPH_OPTIMIZATION_LEVELS[
+                    settings["graph_optimization_level"]
+                ]
+            )
+        return session_options
+
+    def create_session(self, model_path: str, model: str) -> ort.InferenceSession:
+        """
+        Create the session of the model with its settings.
+
+        Args:
+            model_path: Path of the onnx model
+            model: "encoder" or "decoder"
+        """
+        settings = self.get_settings(model)
+        providers = self.get_providers(settings)
+        session_options = self.get_session_options(settings)
+
+        # Load the optimized model of a previous session if there is one,
+        # otherwise optimize the model and save it for the next sessions
+        session_model_path = model_path
+        if settings.get("optimized_model_dir"):
+            optimized_model_path = self.get_optimized_model_path(
+                model_path, settings, providers
+            )
+            if os.path.exists(optimized_model_path):
+                session_model_path = optimized_model_path
+                session_options.graph_optimization_level = (
+                    ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+                )
+            else:
+                os.makedirs(os.path.dirname(optimized_model_path), exist_ok=True)
+                session_options.optimized_model_filepath = optimized_model_path
+
+        try:
+            session = ort.InferenceSession(
+                session_model_path, sess_options=session_options, providers=providers
+            )
+        except Exception as e:
+            if session_model_path != model_path:
+                # The saved optimized model is unreadable, e.g. the previous
+                # session was killed while writing it
+                self.logger.warning(f"Unable to load the optimized model of {model}: {e}")
+                os.remove(session_model_path)
+                session_model_path = model_path
+                session_options = self.get_session_options(settings)
+            elif session_options.optimized_model_filepath:
+                # Providers that compile the graph, e.g. OpenVINO, cannot save
+                # the optimized model
+                self.logger.warning(f"Unable to save the optimized model of {model}: {e}")
+                session_options.optimized_model_filepath = ""
+            else:
+                raise
+            session = ort.InferenceSession(
+                session_model_path, sess_options=session_options, providers=providers
+            )
+
+        self.logger.info(
+            f"Session of {model} {model_path}: "
+            f"providers={session.get_providers()}, "
+            f"intra_op_num_threads={session_options.intra_op_num_threads}, "
+            f"inter_op_num_threads={session_options.inter_op_num_threads}, "
+            f"execution_mode={settings.get('execution_mode', 'sequential')}, "
+            f"graph_optimization_level={settings.get('graph_optimization_level', 'all')}, "
+            f"enable_cpu_mem_arena={session_options.enable_cpu_mem_arena}, "
+            f"enable_mem_pattern={session_options.enable_mem_pattern}, "
+            f"model_file={session_model_path}"
+        )
+        return session
+
+    @staticmethod
+    def add_arguments(parser: argparse.ArgumentParser):
+        """
+        Add the command line arguments of the session settings to the parser
+        """
+        parser.add_argument(
+            "--session-config",
+            type=str,
+            default=None,
+            help="Json file of the onnxruntime session settings. Command line settings override it.",
+        )
+        parser.add_argument(
+            "--providers",
+            type=str,
+            default=None,
+            help="Comma separated execution providers in order of preference, "
+            "e.g. openvino,cpu. Supported: "
+            + ", ".join(SessionConfig.PROVIDER_ALIASES.keys())
+            + ". Default is cuda,cpu.",
+        )
+        parser.add_argument(
+            "--intra-op-threads",
+            type=int,
+            default=None,
+            help="Number of threads used within an operator. Default is the onnxruntime default.",
+        )
+        parser.add_argument(
+            "--inter-op-threads",
+            type=int,
+            default=None,
+            help="Number of threads used across operators in parallel execution mode.",
+        )
+        parser.add_argument(
+            "--graph-optimization",
+            type=str,
+            choices=list(SessionConfig.GRAPH_OPTIMIZATION_LEVELS.keys()),
+            default=None,
+            help="Graph optimization level. Default is all.",
+        )
+        parser.add_argument(
+            "--optimized-model-dir",
+            type=str,
+            default=None,
+            help="Folder to save the optimized models in, so that later sessions skip the optimization.",
+        )
+
+    @staticmethod
+    def from_args(args: argparse.Namespace) -> "SessionConfig":
+        if args.session_config is not None:
+            session_config = SessionConfig.from_file(args.session_config)
+        else:
+            session_config = SessionConfig()
+        session_config.update(
+            {
+                "providers": args.providers,
+                "intra_op_num_threads": args.intra_op_threads,
+                "inter_op_num_threads": args.inter_op_threads,
+                "graph_optimization_level": args.graph_optimization,
+                "optimized_model_dir": args.optimized_model_dir,
+            }
+        )
+        return session_config
@@ -1,6 +1,7 @@
+import logging
 import matplotlib.pyplot as plt
 from typing import List, Dict
-from server.dataset import Data, DataFilter
+from server.dataset import Data
 from openpyxl import Workbook
 import os
 from datetime import datetime
@@ -21,6 +22,7 @@ class StatisticGraph:
     NUM_OF_COLONY_H = "No. of Colony"
 
     def __init__(self, json_item: Dict, label_colors: List[str]):
+        self.logger = logging.getLogger(self.__class__.__name__)
         self.label_colors = label_colors
         self.json_item = json_item
         self.id_to_name = self.get_id_to_name()
@@ -63,7 +65,7 @@ class StatisticGraph:
             data[supercategory_id][StatisticGraph.CORAL_ID_H] = supercategory_id
 
         for key, value in data.items():
-            print(f"key: {key}, value: {value}")
+            self.logger.debug(f"key: {key}, value: {value}")
             value[StatisticGraph.CORAL_COVERAGE_H] = value[StatisticGraph.NUM_OF_PIXELS_H] / image_pixel
             value[StatisticGraph.HEALTHY_COVERAGE_H] = value[StatisticGraph.NUM_OF_HEALTHY_PIXEL_H] / image_pixel
             value[StatisticGraph.BLEACHED_COVERAGE_H] = value[StatisticGraph.NUM_OF_BLEACHED_PIXEL_H] / image_pixel
@@ -79,7 +81,7 @@ class StatisticGraph:
     def export_excel(self, output_path: str):
         wb = Workbook()
         ws = wb.active
-        print(f"image: {self.json_item['images']}")
+        self.logger.debug(f"image: {self.json_item['images']}")
         filename = self.json_item["images"][0]["filename"]
         ws.title = filename
 
@@ -115,7 +117,7 @@ class StatisticGraph:
         data = dict(sorted(data.items()))
 
         for _, value in data.items():
-            print(f"value: {value}")
+            self.logger.debug(f"value: {value}")
             row = [value[header] for header in headers]
             ws.append(row)
 
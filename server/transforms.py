@@ -5,12 +5,15 @@
 # LICENSE file in the root directory of this source tree.
 
 import numpy as np
-import torch
-from torch.nn import functional as F
-from torchvision.transforms.functional import resize, to_pil_image  # type: ignore
 
 from copy import deepcopy
-from typing import Tuple
+from PIL import Image
+from typing import TYPE_CHECKING, Tuple
+
+# torch is only needed by the *_torch methods. It is imported on use, so that
+# the application runs with NumPy and onnxruntime only.
+if TYPE_CHECKING:
+    import torch
 
 
 class ResizeLongestSide:
@@ -18,6 +21,8 @@ class ResizeLongestSide:
     Resizes images to the longest side 'target_length', as well as provides
     methods for resizing coordinates and boxes. Provides methods for
     transforming both numpy array and batched torch tensors.
+
+    The numpy methods do not depend on torch.
     """
 
     def __init__(self, target_length: int) -> None:
@@ -30,7 +35,11 @@ class ResizeLongestSide:
         target_size = self.get_preprocess_shape(
             image.shape[0], image.shape[1], self.target_length
         )
-        return np.array(resize(to_pil_image(image), target_size))
+        # Same as torchvision resize of a PIL image, which resizes bilinearly with PIL
+        target_h, target_w = target_size
+        return np.array(
+            Image.fromarray(image).resize((target_w, target_h), Image.BILINEAR)
+        )
 
     def apply_coords(
         self, coords: np.ndarray, original_size: Tuple[int, ...]
@@ -58,12 +67,14 @@ class ResizeLongestSide:
         boxes = self.apply_coords(boxes.reshape(-1, 2, 2), original_size)
         return boxes.reshape(-1, 4)
 
-    def apply_image_torch(self, image: torch.Tensor) -> torch.Tensor:
+    def apply_image_torch(self, image: "torch.Tensor") -> "torch.Tensor":
         """
         Expects batched images with shape BxCxHxW and float format. This
         transformation may not exactly match apply_image. apply_image is
         the transformation expected by the model.
         """
+        from torch.nn import functional as F
+
         # Expects an image in BCHW format. May not exactly match apply_image.
         target_size = self.get_preprocess_shape(
             image.shape[0], image.shape[1], self.target_length
@@ -73,12 +84,14 @@ class ResizeLongestSide:
         )
 
     def apply_coords_torch(
-        self, coords: torch.Tensor, original_size: Tuple[int, ...]
-    ) -> torch.Tensor:
+        self, coords: "torch.Tensor", original_size: Tuple[int, ...]
+    ) -> "torch.Tensor":
         """
         Expects a torch tensor with length 2 in the last dimension. Requires the
         original image size in (H, W) format.
         """
+        import torch
+
         old_h, old_w = original_size
         new_h, new_w = self.get_preprocess_shape(
             original_size[0], original_size[1], self.target_length
@@ -89,8 +102,8 @@ class ResizeLongestSide:
         return coords
 
     def apply_boxes_torch(
-        self, boxes: torch.Tensor, original_size: Tuple[int, ...]
-    ) -> torch.Tensor:
+        self, boxes: "torch.Tensor", original_size: Tuple[int, ...]
+    ) -> "torch.Tensor":
         """
         Expects a torch tensor with shape Bx4. Requires the original image
         size in (H, W) format.
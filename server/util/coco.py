@@ -1,6 +1,6 @@
 from pycocotools import mask as coco_mask
 import numpy as np
-from typing import Dict, List
+from typing import Dict, List, Tuple
 import cv2
 
 
@@ -12,15 +12,157 @@ def is_polygon_encoding(segmentation: List) -> bool:
     return type(segmentation) == list
 
 
+def get_rle_key(segmentation: Dict) -> Tuple:
+    """
+    Get a hashable key identifying the rle mask
+    """
+    counts = segmentation["counts"]
+    if isinstance(counts, list):
+        counts = tuple(counts)
+    return (tuple(segmentation["size"]), counts)
+
+
+def decode_rle_counts(segmentation: Dict) -> np.ndarray:
+    """
+    Decode the counts of a COCO rle mask into column-major run lengths,
+    following rleFrString of pycocotools. The runs alternate between
+    background and foreground, starting with background.
+    """
+    counts = segmentation["counts"]
+    if isinstance(counts, list):
+        return np.array(counts, dtype=np.int64)
+    if isinstance(counts, str):
+        counts = counts.encode("utf-8")
+    if len(counts) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # Each value is stored in 5-bit groups, least significant first, with
+    # 0x20 marking that more groups follow and 0x10 of the last group as sign
+    chars = np.frombuffer(counts, dtype=np.uint8).astype(np.int64) - 48
+    is_last = (chars & 0x20) == 0
+    ends = np.flatnonzero(is_last)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    group_idx = np.arange(chars.size) - np.repeat(starts, ends - starts + 1)
+
+    values = np.add.reduceat((chars & 0x1F) << (5 * group_idx), starts)
+    negative = (chars[ends] & 0x10) != 0
+    values[negative] -= np.left_shift(1, 5 * (group_idx[ends[negative]] + 1))
+
+    # Values after the third are stored as the difference to the value two
+    # positions before
+    runs = values.copy()
+    runs[3::2] = np.cumsum(values[1::2])[1:]
+    runs[4::2] = np.cumsum(values[2::2])[1:]
+    return runs
+
+
 def rle_mask_to_rle_vis_encoding(segmentation: Dict) -> List[int]:
-    arr = coco_mask.decode(segmentation)
+    """
+    Convert the COCO rle mask into row-major run lengths for front end
+    visualization, starting with a run of zeros.
+
+    The conversion works on the column-major runs directly, without
+    decoding the mask. A row-major run ends at pixel (y, x) when the
+    values of (y, x) and its left neighbour differ, so the run boundaries
+    of column x are the rows where column x and column x - 1 differ.
+    The left neighbour of (y, 0) is (y - 1, width - 1).
+    """
+    height, width = segmentation["size"]
+    total = height * width
+    if total == 0:
+        return []
+
+    # Column-major indices where the mask value changes
+    runs = decode_rle_counts(segmentation)
+    toggles = np.cumsum(runs)[:-1]
+    toggles = toggles[toggles < total]
+
+    # Boundaries of each column as (column, row) with rows in [0, height],
+    # taking the value above and below the column as 0
+    columns = toggles // height
+    rows = toggles % height
+    interior = rows > 0
+    column_offsets = np.arange(width, dtype=np.int64) * height
+    starts_with_one = np.searchsorted(toggles, column_offsets, side="right") % 2 == 1
+    ends_with_one = (
+        np.searchsorted(toggles, column_offsets + height, side="left") % 2 == 1
+    )
+    boundary_columns = np.concatenate(
+        (
+            columns[interior],
+            np.flatnonzero(starts_with_one),
+            np.flatnonzero(ends_with_one),
+        )
+    )
+    boundary_rows = np.concatenate(
+        (
+            rows[interior],
+            np.zeros(np.count_nonzero(starts_with_one), dtype=np.int64),
+            np.full(np.count_nonzero(ends_with_one), height, dtype=np.int64),
+        )
+    )
+
+    # Column x differs from column x - 1 between the boundaries that appear
+    # in only one of them. Column 0 is compared with the last column shifted
+    # down by one row.
+    not_last = boundary_columns < width - 1
+    last = ~not_last
+    event_columns = np.concatenate(
+        (
+            boundary_columns,
+            boundary_columns[not_last] + 1,
+            np.zeros(np.count_nonzero(last), dtype=np.int64),
+        )
+    )
+    event_rows = np.concatenate(
+        (
+            boundary_rows,
+            boundary_rows[not_last],
+            np.minimum(boundary_rows[last] + 1, height),
+        )
+    )
+    keys, key_counts = np.unique(
+        event_columns * (height + 1) + event_rows, return_counts=True
+    )
+    keys = keys[key_counts % 2 == 1]
+
+    if keys.size == 0:
+        return [total]
+
+    # The remaining boundaries of each column pair up as [start, end) rows
+    change_columns = keys[0::2] // (height + 1)
+    change_starts = keys[0::2] % (height + 1)
+    change_lengths = keys[1::2] % (height + 1) - change_starts
+
+    # Expand each row interval into the flat row-major indices
+    offsets = np.repeat(np.cumsum(change_lengths) - change_lengths, change_lengths)
+    change_rows = (
+        np.repeat(change_starts, change_lengths) + np.arange(offsets.size) - offsets
+    )
+    indices = np.sort(change_rows * width + np.repeat(change_columns, change_lengths))
+
+    indices = np.concatenate(([0], indices, [total]))
+    return np.diff(indices).tolist()
 
+
+def rle_mask_to_rle_vis_encoding_dense(segmentation: Dict) -> List[int]:
+    """
+    Reference implementation of rle_mask_to_rle_vis_encoding that decodes
+    the full mask
+    """
+    return numpy_mask_to_rle_vis_encoding(coco_mask.decode(segmentation))
+
+
+def numpy_mask_to_rle_vis_encoding(mask: np.ndarray) -> List[int]:
+    """
+    Convert the mask into row-major run lengths for front end
+    visualization, starting with a run of zeros.
+    """
     # Flatten the 2D array to a 1D array
-    flat = arr.flatten()
+    flat = mask.ravel()
 
     # Find the indices where the value changes
-    diffs = np.diff(flat)
-    change_indices = np.where(diffs != 0)[0] + 1
+    change_indices = np.flatnonzero(flat[1:] != flat[:-1]) + 1
 
     # Include the start and end indices
     indices = np.concatenate(([0], change_indices, [len(flat)]))
@@ -29,7 +171,7 @@ def rle_mask_to_rle_vis_encoding(segmentation: Dict) -> List[int]:
     run_lengths = np.diff(indices)
 
     # Ensure the encoding starts with zero
-    if flat[0] == 0:
+    if len(flat) == 0 or not flat[0]:
         return run_lengths.tolist()
     else:
         # Insert a zero at the beginning to start with zero
@@ -37,9 +179,8 @@ def rle_mask_to_rle_vis_encoding(segmentation: Dict) -> List[int]:
 
 
 def numpy_mask_to_rle_mask(mask: np.ndarray) -> Dict:
-    mask = mask.astype(np.uint8)
-    mask = np.asfortranarray(mask)
-    rle = coco_mask.encode(mask)
+    # Convert and reorder the mask in a single copy
+    rle = coco_mask.encode(np.asfortranarray(mask, dtype=np.uint8))
 
     # Make sure that the counts are in a string format
     rle["counts"] = rle["counts"].decode("utf-8")
@@ -51,6 +192,33 @@ def decode_rle_mask(segmentation: Dict) -> np.ndarray:
     return mask
 
 
+def decode_rle_mask_crop(
+    segmentation: Dict, x0: int, y0: int, x1: int, y1: int
+) -> np.ndarray:
+    """
+    Decode the rectangle [y0, y1) x [x0, x1) of the COCO rle mask only,
+    without decoding the full mask. Only the columns of the rectangle are
+    expanded from the column-major runs.
+
+    Returns:
+        Boolean mask with shape (y1 - y0, x1 - x0)
+    """
+    height, _ = segmentation["size"]
+    start = x0 * height
+    end = x1 * height
+    if end <= start or y1 <= y0:
+        return np.zeros((max(y1 - y0, 0), max(x1 - x0, 0)), dtype=bool)
+
+    # Column-major indices where the mask value changes. Only the first run
+    # may be empty, so the indices are unique.
+    toggles = np.cumsum(decode_rle_counts(segmentation))[:-1]
+    changes = np.zeros(end - start, dtype=np.uint8)
+    changes[0] = np.count_nonzero(toggles <= start) % 2
+    changes[toggles[(toggles > start) & (toggles < end)] - start] ^= 1
+    columns = np.bitwise_xor.accumulate(changes).reshape(x1 - x0, height)
+    return columns[:, y0:y1].T.astype(bool)
+
+
 def to_coco_annotation(mask: np.ndarray) -> Dict:
     """
     Convert the given mask into COCO annotation format
@@ -70,10 +238,14 @@ def to_coco_annotation(mask: np.ndarray) -> Dict:
                 "iscrowd": int,
             }
     """
+    return rle_to_coco_annotation(numpy_mask_to_rle_mask(mask))
 
-    rle = coco_mask.encode(np.asfortranarray(mask.astype(np.uint8)))
-    rle["counts"] = rle["counts"].decode("utf-8")
 
+def rle_to_coco_annotation(rle: Dict) -> Dict:
+    """
+    Convert the given COCO rle mask into COCO annotation format, in the same
+    format as to_coco_annotation
+    """
     bbox = coco_mask.toBbox(rle)
     bbox = bbox.tolist()
     bbox = [int(coord) for coord in bbox]
@@ -92,6 +264,17 @@ def to_coco_annotation(mask: np.ndarray) -> Dict:
     return annotation
 
 
+def rle_to_vis_annotation(rle: Dict) -> Dict:
+    """
+    Convert the given COCO rle mask into COCO annotation format, with an
+    additional key "rle" which is the RLE encoding of the mask for front end
+    visualization
+    """
+    annotation = rle_to_coco_annotation(rle)
+    annotation["rle"] = rle_mask_to_rle_vis_encoding(rle)
+    return annotation
+
+
 def rle_mask_to_poly_mask(rle: Dict) -> List[int]:
     mask = decode_rle_mask(rle)
     # Find contours using OpenCV
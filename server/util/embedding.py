@@ -0,0 +1,73 @@
+import numpy as np
+
+# Storage formats of the embeddings in a project
+FLOAT32 = "float32"
+FLOAT16 = "float16"
+INT8 = "int8"
+EMBEDDING_FORMATS = [FLOAT32, FLOAT16, INT8]
+
+# An int8 embedding is stored as a structured array with the scale of each
+# channel next to its values, so that it stays a single memory-mappable .npy
+# with shape (N, C)
+INT8_MAX = 127
+
+
+def get_int8_dtype(height: int, width: int) -> np.dtype:
+    return np.dtype([("scale", "<f4"), ("values", "i1", (height, width))])
+
+
+def is_int8_embedding(embedding: np.ndarray) -> bool:
+    return embedding.dtype.names is not None and "scale" in embedding.dtype.names
+
+
+def encode_embedding(embedding: np.ndarray, embedding_format: str) -> np.ndarray:
+    """
+    Convert the float32 embedding with shape (N, C, H, W) into the storage
+    format.
+    - float32: unchanged
+    - float16: half of the size
+    - int8: a quarter of the size, with symmetric per-channel quantization
+      of each value to round(value / scale), scale = max(|value|) / 127
+    """
+    assert (
+        embedding_format in EMBEDDING_FORMATS
+    ), f"Invalid embedding format: {embedding_format}"
+    if embedding_format == FLOAT32:
+        return np.asarray(embedding, dtype=np.float32)
+    if embedding_format == FLOAT16:
+        return np.asarray(embedding, dtype=np.float16)
+
+    embedding = np.asarray(embedding, dtype=np.float32)
+    batch_size, channels, height, width = embedding.shape
+    scale = np.abs(embedding).max(axis=(2, 3)) / INT8_MAX
+    scale[scale == 0] = 1
+
+    encoded = np.empty((batch_size, channels), dtype=get_int8_dtype(height, width))
+    encoded["scale"] = scale
+    values = embedding / scale[:, :, None, None]
+    np.rint(values, out=values)
+    encoded["values"] = values
+    return encoded
+
+
+def decode_embedding(embedding: np.ndarray) -> np.ndarray:
+    """
+    Convert the stored embedding in any format into the contiguous float32
+    input of the decoder. Only this copy is float32, the stored embedding
+    stays in its compact format.
+    """
+    if not is_int8_embedding(embedding):
+        return np.ascontiguousarray(embedding, dtype=np.float32)
+
+    decoded = embedding["values"].astype(np.float32)
+    decoded *= embedding["scale"][:, :, None, None]
+    return decoded
+
+
+def get_embedding_format(embedding: np.ndarray) -> str:
+    if is_int8_embedding(embedding):
+        return INT8
+    if embedding.dtype == np.float16:
+        return FLOAT16
+    return FLOAT32
+
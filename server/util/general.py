@@ -1,4 +1,5 @@
 import base64
+import hashlib
 import numpy as np
 import logging
 import os
@@ -9,6 +10,7 @@ import time
 from PIL import Image
 from io import BytesIO
 from functools import wraps
+from typing import Tuple
 
 logger = logging.getLogger("GeneralUtil")
 
@@ -41,6 +43,20 @@ def remove_image_url_header(image_url):
     return image_url.split(",")[1]
 
 
+def compute_bytes_hash(data: bytes) -> str:
+    """Compute the sha256 hex digest of the given bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def compute_file_hash(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Compute the sha256 hex digest of the file content, reading it in chunks"""
+    hasher = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
 def get_resource_path(relative_path):
     """Get the absolute path to a resource, works for dev and for PyInstaller"""
     try:
@@ -52,6 +68,26 @@ def get_resource_path(relative_path):
     return os.path.join(base_path, relative_path)
 
 
+def get_model_paths(model_type: str) -> Tuple[str, str]:
+    """
+    Get the paths of the encoder and decoder models of the SAM model type
+
+    Returns:
+        (encoder model path, decoder model path)
+    """
+    if model_type not in ["vit_b", "vit_h"]:
+        raise ValueError(
+            f"Unsupported model type: {model_type}. Supported types are 'vit_b' and 'vit_h'."
+        )
+    encoder_model_path = get_resource_path(
+        os.path.join("models", f"{model_type}_encoder_quantized.onnx")
+    )
+    decoder_model_path = get_resource_path(
+        os.path.join("models", f"{model_type}_decoder_quantized.onnx")
+    )
+    return encoder_model_path, decoder_model_path
+
+
 def load_image_from_content(content):
     try:
         image_data = base64.b64decode(content)
@@ -1,7 +1,9 @@
+import cv2
 import numpy as np
 
 from PIL import Image
 from typing import Tuple, Dict, List, Union
+from ..transforms import ResizeLongestSide
 
 def determine_sam_input_shape(image: Image) -> Tuple[int, int]:
     ori_width, ori_height = image.size
@@ -17,25 +19,132 @@ def determine_sam_input_shape(image: Image) -> Tuple[int, int]:
 
     return resized_width, resized_height
 
-def preprocess_image(image: Image) -> np.ndarray:
-    resized_width, resized_height = determine_sam_input_shape(image)
+SAM_INPUT_SIZE = 1024
+
+# Normalization of the encoder input, (pixel - mean) / std, computed as
+# pixel * scale + offset in float32
+PIXEL_MEAN = np.array([123.675, 116.28, 103.53], dtype=np.float32)
+PIXEL_STD = np.array([58.395, 57.12, 57.375], dtype=np.float32)
+PIXEL_SCALE = (1.0 / PIXEL_STD).astype(np.float32)
+PIXEL_OFFSET = (-PIXEL_MEAN / PIXEL_STD).astype(np.float32)
+
+
+def create_input_buffer(batch_size: int = 1) -> np.ndarray:
+    """
+    Create a buffer for the encoder input with shape (batch_size, 3, 1024, 1024)
+    """
+    return np.zeros(
+        (batch_size, 3, SAM_INPUT_SIZE, SAM_INPUT_SIZE), dtype=np.float32
+    )
+
 
+def resize_image(image: Image) -> np.ndarray:
+    """
+    Resize the image so that its longest side is 1024
+
+    Returns:
+        The resized RGB image in uint8, with shape (H, W, 3)
+    """
+    resized_width, resized_height = determine_sam_input_shape(image)
     image = image.resize((resized_width, resized_height), Image.Resampling.BILINEAR)
+    return np.asarray(image.convert("RGB"))
 
-    input_tensor = np.array(image)
 
-    mean = np.array([123.675, 116.28, 103.53])
-    std = np.array([[58.395, 57.12, 57.375]])
+def normalize_image(resized_image: np.ndarray, output: np.ndarray) -> np.ndarray:
+    """
+    Normalize the resized image into the output buffer in CHW order.
+    The area outside the image is padded with zeros.
 
-    input_tensor = (input_tensor - mean) / std
-    input_tensor = input_tensor.transpose(2,0,1)[None,:,:,:].astype(np.float32)
+    Args:
+        resized_image: Image returned by resize_image, with shape (H, W, 3)
+        output: Buffer with shape (3, 1024, 1024) in float32
 
-    if resized_height < resized_width:
-        input_tensor = np.pad(input_tensor,((0,0),(0,0),(0,1024-resized_height),(0,0)))
-    else:
-        input_tensor = np.pad(input_tensor,((0,0),(0,0),(0,0),(0,1024-resized_width)))
-    
-    return input_tensor
+    Returns:
+        The output buffer
+    """
+    height, width = resized_image.shape[:2]
+    for channel in range(3):
+        output_channel = output[channel, :height, :width]
+        np.multiply(
+            resized_image[:, :, channel],
+            PIXEL_SCALE[channel],
+            out=output_channel,
+            casting="unsafe",
+        )
+        output_channel += PIXEL_OFFSET[channel]
+    output[:, height:, :] = 0
+    output[:, :height, width:] = 0
+    return output
+
+
+def preprocess_image(image: Image, output: np.ndarray = None) -> np.ndarray:
+    """
+    Preprocess the image into the encoder input with shape (1, 3, 1024, 1024).
+    If the output buffer is given, the input is written into it, so that the
+    buffer can be reused across images.
+    """
+    if output is None:
+        output = create_input_buffer(1)
+    normalize_image(resize_image(image), output[0])
+    return output
+
+
+def preprocess_images(
+    resized_images: List[np.ndarray], output: np.ndarray = None
+) -> np.ndarray:
+    """
+    Preprocess a batch of resized images into the encoder input with shape
+    (N, 3, 1024, 1024). If the output buffer is given, it must hold at least
+    N images, and the first N are returned.
+
+    Args:
+        resized_images: Images returned by resize_image
+        output: Buffer created by create_input_buffer
+    """
+    if output is None:
+        output = create_input_buffer(len(resized_images))
+    assert len(output) >= len(
+        resized_images
+    ), f"Buffer of {len(output)} images is too small for {len(resized_images)} images"
+    for idx, resized_image in enumerate(resized_images):
+        normalize_image(resized_image, output[idx])
+    return output[: len(resized_images)]
+
+def postprocess_masks(
+    low_res_logits: np.ndarray,
+    image_size: List[int],
+    output_size: List[int] = None,
+) -> np.ndarray:
+    """
+    Upsample the low resolution logits of the decoder to the image size, as
+    the postprocessing of the decoder model does: upsample to the encoder
+    input, remove the padding and resize to the image size, bilinearly.
+
+    Args:
+        low_res_logits: Logits with shape (256, 256)
+        image_size: (height, width) of the image
+        output_size: (height, width) of the output with the aspect ratio of
+            the image, e.g. a preview. Default is the image size.
+
+    Returns:
+        The logits with shape of the output size
+    """
+    height, width = image_size
+    if output_size is None:
+        output_size = image_size
+    logits = cv2.resize(
+        low_res_logits,
+        (SAM_INPUT_SIZE, SAM_INPUT_SIZE),
+        interpolation=cv2.INTER_LINEAR,
+    )
+    new_height, new_width = ResizeLongestSide.get_preprocess_shape(
+        height, width, SAM_INPUT_SIZE
+    )
+    logits = logits[:new_height, :new_width]
+    output_height, output_width = output_size
+    return cv2.resize(
+        logits, (output_width, output_height), interpolation=cv2.INTER_LINEAR
+    )
 
 def preprocess_point(input_point: Union[np.ndarray, List[List[int]]], ori_width: int, ori_height: int, resized_width: int, resized_height: int) -> np.ndarray:
     """
@@ -13,7 +13,13 @@ class ProjectCreateRequest:
                     "image_path": "/path/to/image.jpg"
                 }
             ],
-            "output_file": "/path/to/output"
+            "output_file": "/path/to/output",
+            "num_workers": 4,  (optional) number of image decoding threads
+            "batch_size": 4,  (optional) number of images per encoder run
+            "resume": true,  (optional) reuse the images finished by an interrupted creation,
+                default is false, which removes the unfinished images when stopped
+            "embedding_format": "float16"  (optional) storage format of the embeddings,
+                "float32", "float16" or "int8"
         }
 
         If the image_path is provided, the image_url will be ignored.
@@ -28,6 +34,18 @@ class ProjectCreateRequest:
     def get_output_file(self) -> str:
         return self.request["output_file"]
 
+    def get_num_workers(self, default: int = 4) -> int:
+        return max(1, int(self.request.get("num_workers", default)))
+
+    def get_batch_size(self, default: int = 1) -> int:
+        return max(1, int(self.request.get("batch_size", default)))
+
+    def get_resume(self, default: bool = False) -> bool:
+        return bool(self.request.get("resume", default))
+
+    def get_embedding_format(self, default: str = "float32") -> str:
+        return self.request.get("embedding_format", default)
+
 
 class FileDialogRequest:
 
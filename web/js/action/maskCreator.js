@@ -49,7 +49,8 @@ export class MaskCreator {
         MaskCreator.instance = this;
 
         this.prompts = [];
-        this.mask = null;
+        this.preview = null;
+        this.isConfirming = false;
     }
 
     addPrompt(imageX, imageY, label) {
@@ -59,7 +60,7 @@ export class MaskCreator {
 
     clearPrompts() {
         this.prompts = [];
-        this.mask = null;
+        this.preview = null;
         this.updateMask();
     }
 
@@ -70,8 +71,7 @@ export class MaskCreator {
 
     /**
      * Update the mask based on the prompts.
-     * Meanwhile, visualize the mask on the canvas.
-     * @returns {Mask} Updated mask
+     * Meanwhile, visualize the preview mask on the canvas.
      */
     updateMask() {
         const manager = new Manager();
@@ -85,11 +85,17 @@ export class MaskCreator {
             return;
         }
 
+        // The mask is previewed at the display resolution of the image, the
+        // full resolution mask is only created when it is confirmed
         const core = manager.getCore();
-        core.createPromptedMask(this.prompts, (annotation) => {
-            this.mask = new Mask(annotation);
-            canvas.showPromptedMask(this.mask, this.prompts);
-        });
+        core.createPromptedMask(
+            this.prompts,
+            canvas.getPreviewSize(),
+            (preview) => {
+                this.preview = preview;
+                canvas.showPromptedMask(preview, this.prompts);
+            }
+        );
     }
 
     /**
@@ -97,7 +103,7 @@ export class MaskCreator {
      * After that, clear the prompts.
      */
     confirmPrompt() {
-        if (this.mask === null) {
+        if (this.preview === null || this.isConfirming) {
             return;
         }
 
@@ -109,29 +115,39 @@ export class MaskCreator {
             .getActionPanel();
         const promptCategorySelector = actionPanel.getPromptCategorySelector();
         const selectedCategory = promptCategorySelector.getSelectedCategory();
-        if (selectedCategory) {
-            this.mask.setCategory(selectedCategory);
-        } else {
-            const category = new Category(Category.UNDEFINED_ID);
-            this.mask.setCategory(category);
-        }
+        const category = selectedCategory
+            ? selectedCategory
+            : new Category(Category.UNDEFINED_ID);
 
-        // Record data
         const core = manager.getCore();
-        core.recordData();
-
-        // Add the mask into the data
-        const data = core.getData();
-        data.addMask(this.mask);
-        this.mask.setModified(true);
-
-        // Update the visualization of canvas
-        const canvas = manager
-            .getToolInterface()
-            .getAnnotationPage()
-            .getCanvas();
-        canvas.updateMasks();
-
-        this.clearPrompts();
+        this.isConfirming = true;
+        core.confirmPromptedMask(
+            (annotation) => {
+                this.isConfirming = false;
+                const mask = new Mask(annotation);
+                mask.setCategory(category);
+
+                // Record data
+                core.recordData();
+
+                // Add the mask into the data
+                const data = core.getData();
+                data.addMask(mask);
+                mask.setModified(true);
+
+                // Update the visualization of canvas
+                const canvas = manager
+                    .getToolInterface()
+                    .getAnnotationPage()
+                    .getCanvas();
+                canvas.updateMasks();
+
+                this.clearPrompts();
+            },
+            (error) => {
+                this.isConfirming = false;
+                core.popUpError(error);
+            }
+        );
     }
 }
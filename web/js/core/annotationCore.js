@@ -3,7 +3,6 @@ import { CategoryManager } from "../data/index.js";
 import { MaskCreator, MaskSelector } from "../action/index.js";
 import { Manager } from "../manager.js";
 import { Record, HistoryManager } from "../action/historyManager.js";
-import { AnnotationRenderer } from "../panels/annotationRenderer.js";
 import { LoadingPopManager } from "../util/loadingPopManager.js";
 import { GeneralPopManager } from "../util/generalPopManager.js";
 import { Data } from "../data/index.js";
@@ -12,6 +11,11 @@ import { FileDialogRequest } from "../requests/filedialogRequest.js";
 export class AnnotationCore extends Core {
     static DEFAULT_HISTORY_SIZE = 10;
 
+    // Field projections of the data page request
+    static DATA_FIELDS_METADATA = "metadata";
+    static DATA_FIELDS_ANNOTATIONS = "annotations";
+    static DATA_FIELDS_FULL = "full";
+
     constructor() {
         super();
         this.data = null;
@@ -108,8 +112,36 @@ export class AnnotationCore extends Core {
         topPanel.update();
     }
 
-    createPromptedMask(prompts, callBack = null, errorCallBack = null) {
-        eel.create_mask(prompts)()
+    /**
+     * Create the preview mask of the prompts, with the longest side at most
+     * previewSize. The full resolution mask is created by confirmPromptedMask.
+     */
+    createPromptedMask(
+        prompts,
+        previewSize,
+        callBack = null,
+        errorCallBack = null
+    ) {
+        eel.create_mask(prompts, previewSize)()
+            .then((preview) => {
+                if (callBack != null) {
+                    callBack(preview);
+                }
+            })
+            .catch((error) => {
+                if (errorCallBack != null) {
+                    errorCallBack(error);
+                } else {
+                    this.popUpError(error);
+                }
+            });
+    }
+
+    /**
+     * Create the full resolution mask annotation of the last prompted mask
+     */
+    confirmPromptedMask(callBack = null, errorCallBack = null) {
+        eel.confirm_mask()()
             .then((annotation) => {
                 if (callBack != null) {
                     callBack(annotation);
@@ -141,65 +173,42 @@ export class AnnotationCore extends Core {
     }
 
     exportAnnotatedImages(outputDir, callBack = null, errorCallBack = null) {
-        this.getDataList(async (dataList) => {
-            const loadingPopManager = new LoadingPopManager();
-
-            let idx = 0;
-            const dataLen = dataList.length;
-
-            for (const data of dataList) {
-                try {
-                    const annotatedDataInfoList = [];
-                    const annotationRenderer = new AnnotationRenderer();
-                    await annotationRenderer.render(data);
-                    const encodedImage = annotationRenderer.getEncodedImage();
-                    const imageName = data.getImageName();
-                    const annotatedDataInfo = {
-                        image_name: imageName,
-                        encoded_image: encodedImage,
-                    };
-                    annotatedDataInfoList.push(annotatedDataInfo);
-
-                    await eel
-                        .export_annotated_images(
-                            outputDir,
-                            annotatedDataInfoList
-                        )()
-                        .catch((error) => {
-                            if (errorCallBack != null) {
-                                errorCallBack(error);
-                            } else {
-                                this.popUpError(error);
-                            }
-                            return;
-                        });
-
-                    idx += 1;
-                    if (loadingPopManager.isShowing()) {
-                        loadingPopManager.updatePercentage(
-                            ((idx / dataLen) * 100).toFixed(2)
-                        );
-                    }
+        // The images are rendered by the server, with the mask opacity
+        // currently used by the canvas. The server reports the progress
+        // through updateProgressPercentage, and stops on terminateExport.
+        const manager = new Manager();
+        const canvas = manager.getToolInterface().getAnnotationPage().getCanvas();
+        const maskOpacity = canvas.getMaskOpacity();
 
-                    const terminate =
-                        loadingPopManager.getProperty("terminate");
-                    if (terminate) {
-                        loadingPopManager.hide();
-                        return;
-                    }
-                } catch (error) {
-                    if (errorCallBack != null) {
-                        errorCallBack(error);
-                    } else {
-                        this.popUpError(error);
-                    }
+        eel.export_annotated_images(outputDir, maskOpacity)()
+            .then(() => {
+                if (callBack != null) {
+                    callBack();
                 }
-            }
+            })
+            .catch((error) => {
+                if (errorCallBack != null) {
+                    errorCallBack(error);
+                } else {
+                    this.popUpError(error);
+                }
+            });
+    }
 
-            if (callBack != null) {
-                callBack();
-            }
-        });
+    terminateExport(callBack = null, errorCallBack = null) {
+        eel.terminate_export_process()()
+            .then(() => {
+                if (callBack != null) {
+                    callBack();
+                }
+            })
+            .catch((error) => {
+                if (errorCallBack != null) {
+                    errorCallBack(error);
+                } else {
+                    this.popUpError(error);
+                }
+            });
     }
 
     exportCOCO(outputPath, callBack = null, errorCallBack = null) {
@@ -256,16 +265,29 @@ export class AnnotationCore extends Core {
             });
     }
 
-    getDataList(callBack = null, errorCallBack = null) {
-        eel.get_data_list()()
-            .then((dataInfoList) => {
-                const dataList = [];
-                for (const dataInfo of dataInfoList) {
-                    dataList.push(Data.parseResponse(dataInfo));
-                }
-
+    /**
+     * Get a page of the data list
+     * @param {number} offset Index of the first data in the page
+     * @param {number} limit Maximum number of data in the page
+     * @param {string} fields One of "metadata", "annotations" and "full"
+     * @param {function} callBack Called with the page response:
+     * {
+     *   "total": number,
+     *   "offset": number,
+     *   "data_list": List[Dict]
+     * }
+     */
+    getDataPage(
+        offset,
+        limit,
+        fields = AnnotationCore.DATA_FIELDS_METADATA,
+        callBack = null,
+        errorCallBack = null
+    ) {
+        eel.get_data_page(offset, limit, fields)()
+            .then((page) => {
                 if (callBack != null) {
-                    callBack(dataList);
+                    callBack(page);
                 }
             })
             .catch((error) => {
@@ -19,6 +19,9 @@ import { NavigationBarLabel } from "./panels/navigationBarLabel.js";
  * Core of the frontend. It is used to communicate with the backend.
  */
 export class LabelCore extends AnnotationCore {
+    // Number of images per gallery request
+    static GALLERY_PAGE_SIZE = 100;
+
     constructor() {
         super();
         this.data = null;
@@ -40,7 +43,7 @@ export class LabelCore extends AnnotationCore {
             loadingPopManager.show();
 
             eel.load_project(filePath_)()
-                .then((galleryDataList) => {
+                .then(() => {
                     eel.get_current_data()()
                         .then((response) => {
                             loadingPopManager.hide();
@@ -51,10 +54,7 @@ export class LabelCore extends AnnotationCore {
                                 response["category_info"]
                             );
 
-                            const galleryPage = manager
-                                .getToolInterface()
-                                .getGalleryPage();
-                            galleryPage.updateGallery(galleryDataList);
+                            this.loadGallery();
 
                             const data = Data.parseResponse(response);
                             this.setData(data);
@@ -137,6 +137,33 @@ export class LabelCore extends AnnotationCore {
         }
     }
 
+    /**
+     * Load the gallery a page of image metadata at a time, so that a large
+     * project is not sent to the front end in a single response
+     * @param {number} offset Index of the first data of the page to load
+     */
+    loadGallery(offset = 0) {
+        const galleryPage = new Manager().getToolInterface().getGalleryPage();
+        if (offset === 0) {
+            galleryPage.clearGallery();
+        }
+
+        this.getDataPage(
+            offset,
+            LabelCore.GALLERY_PAGE_SIZE,
+            AnnotationCore.DATA_FIELDS_METADATA,
+            (page) => {
+                const dataList = page["data_list"];
+                galleryPage.addGalleryItems(dataList);
+
+                const nextOffset = page["offset"] + dataList.length;
+                if (dataList.length > 0 && nextOffset < page["total"]) {
+                    this.loadGallery(nextOffset);
+                }
+            }
+        );
+    }
+
     nextData(callBack = null, errorCallBack = null) {
         this.save(() => {
             eel.get_next_data()()
@@ -26,6 +26,15 @@ export class GalleryPage extends Page {
      */
     updateGallery(galleryDataList) {
         this.clearGallery();
+        this.addGalleryItems(galleryDataList);
+    }
+
+    /**
+     * Append items to the gallery, e.g. when the gallery is loaded page by
+     * page
+     * @param {Object} galleryDataList - List of gallery data, see updateGallery
+     */
+    addGalleryItems(galleryDataList) {
         for (const galleryData of galleryDataList) {
             const galleryItem = this.createGalleryItem(galleryData);
             this.galleryContainer.appendChild(galleryItem);
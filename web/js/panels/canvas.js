@@ -1,5 +1,5 @@
 import { ActionManager } from "../action/actionManager.js";
-import { Mask, Data } from "../data/index.js";
+import { Mask, Data, Category } from "../data/index.js";
 import { Prompt } from "../action/maskCreator.js";
 import { MaskDrawer } from "../util/maskDrawer.js";
 import { hexToRGB } from "../util/color.js";
@@ -387,46 +387,59 @@ export class Canvas {
     /**
      * Show the given promted mask.
      * If the given mask is null, then do not show anything.
-     * @param {Mask} mask
+     * @param {Object} preview Preview mask created by the server, with its
+     *     width, height and row-major rle
      * @param {Prompt[]} prompts
      */
-    showPromptedMask(mask, prompts) {
-        this.promptedMask = mask;
-        if (mask === null) {
+    showPromptedMask(preview, prompts) {
+        this.promptedMask = preview;
+        if (preview === null) {
             return;
         }
 
-        // Draw masks
+        // Draw the preview mask at its resolution
+        const previewCanvas = document.createElement("canvas");
+        const previewCtx = previewCanvas.getContext("2d");
+        previewCanvas.width = preview["width"];
+        previewCanvas.height = preview["height"];
+
+        const imageData = previewCtx.createImageData(
+            preview["width"],
+            preview["height"]
+        );
+        const data = imageData.data;
+
+        const category = new Category(Category.PROMPT_ID);
+        const [r, g, b] = hexToRGB(category.getMaskColor());
+
+        // The runs alternate between 0 and 1, starting with 0
+        const rle = preview["rle"];
+        let index = 0;
+        for (let i = 0; i < rle.length; i++) {
+            if (i % 2 === 1) {
+                for (let j = index; j < index + rle[i]; j++) {
+                    data[j * 4] = r;
+                    data[j * 4 + 1] = g;
+                    data[j * 4 + 2] = b;
+                    data[j * 4 + 3] = 255;
+                }
+            }
+            index += rle[i];
+        }
+        previewCtx.putImageData(imageData, 0, 0);
+
+        // Scale the preview mask to the image
         const maskCanvas = document.createElement("canvas");
         const maskCtx = maskCanvas.getContext("2d");
         maskCanvas.width = this.imageWidth;
         maskCanvas.height = this.imageHeight;
-
-        const imageData = maskCtx.getImageData(
+        maskCtx.drawImage(
+            previewCanvas,
             0,
             0,
             this.imageWidth,
             this.imageHeight
         );
-        const data = imageData.data;
-
-        const maskData = mask.getDecodedMask();
-        const [r, g, b] = hexToRGB(mask.getMaskColor());
-
-        for (let i = 0; i < maskData.length; i++) {
-            if (maskData[i] === 1) {
-                const x = i % this.imageWidth;
-                const y = Math.floor(i / this.imageWidth);
-                const index = (y * this.imageWidth + x) * 4;
-
-                // Set pixel color with alpha transparency
-                data[index] = r; // Red
-                data[index + 1] = g; // Green
-                data[index + 2] = b; // Blue
-                data[index + 3] = 255; // Alpha
-            }
-        }
-        maskCtx.putImageData(imageData, 0, 0);
 
         // Draw prompted points
         const pointRadius = Math.min(this.imageWidth, this.imageHeight) * 0.01;
@@ -445,6 +458,17 @@ export class Canvas {
         this.promptingMaskCache.src = maskCanvas.toDataURL();
     }
 
+    /**
+     * Get the longest side of the image at the current display resolution,
+     * which is the size of the preview masks
+     * @returns {number}
+     */
+    getPreviewSize() {
+        const displaySize =
+            Math.max(this.imageWidth, this.imageHeight) * this.scale;
+        return Math.max(Math.ceil(displaySize), 1);
+    }
+
     getEncodedImage() {
         return this.canvas.toDataURL("image/png");
     }
@@ -124,8 +124,9 @@ export class NavigationBarQuickStart extends NavigationBar {
                         loadingPopManager.updateText(
                             "Terminating the process. Please wait."
                         );
-                        loadingPopManager.addProperty("terminate", true);
+                        core.terminateExport();
                     });
+                    loadingPopManager.updatePercentage(0);
                     loadingPopManager.show();
 
                     core.exportAnnotatedImages(
@@ -49,7 +49,7 @@ export class QuickStartCore extends AnnotationCore {
             loadingPopManager.show();
 
             eel.load_project(filePath_)()
-                .then((galleryDataList) => {
+                .then(() => {
                     eel.get_current_data()()
                         .then((response) => {
                             loadingPopManager.hide();
@@ -108,7 +108,10 @@ export class QuickStartCore extends AnnotationCore {
  */
 eel.expose(updateProgressPercentage);
 function updateProgressPercentage(percentage) {
-    // Do nothing
+    const loadingPopManager = new LoadingPopManager();
+    if (loadingPopManager.isShowing()) {
+        loadingPopManager.updatePercentage(percentage);
+    }
 }
 
 /**